@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Shapelets.io
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+########################################################################################################################
+# IMPORT
+########################################################################################################################
+import numpy as np
+from khiva.array import Array
+
+
+########################################################################################################################
+
+def _num_series(tss):
+    """ Number of time series and their length.
+
+    :param tss: KHIVA array or numpy array with one time series per row.
+    :return: Number of time series and length of the time series.
+    """
+    if isinstance(tss, Array):
+        dims = tss.get_dims()
+        return int(dims[1]), int(dims[0])
+    return tss.shape[0], tss.shape[1]
+
+
+def _host_series(tss):
+    """ Float64 numpy copy of a set of time series.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :return: Numpy array with one time series per row.
+    """
+    if isinstance(tss, Array):
+        n, length = _num_series(tss)
+        return tss.to_numpy().astype(np.float64).reshape(n, length)
+    return np.atleast_2d(np.asarray(tss, dtype=np.float64))
+
+
+def _running_extremum(series, size, function):
+    """ Maximum or minimum of every window of consecutive points, computed by doubling the span of the windows.
+
+    :param series: Numpy array with one time series per row.
+    :param size: Number of points of the windows.
+    :param function: np.maximum or np.minimum.
+    :return: Numpy array whose position (r, i) is the extremum of the points i to i + size - 1 of the row r.
+    """
+    table = series
+    span = 1
+    while span * 2 <= size:
+        table = function(table[:, :-span], table[:, span:])
+        span *= 2
+    count = series.shape[1] - size + 1
+    return function(table[:, :count], table[:, size - span:size - span + count])
+
+
+def _z_normalize(series):
+    """ Z-normalizes every row of a matrix. Constant rows are normalized to zero.
+
+    :param series: Numpy array with one time series per row.
+    :return: Numpy array with the z-normalized time series.
+    """
+    stds = series.std(axis=1, keepdims=True)
+    return (series - series.mean(axis=1, keepdims=True)) / np.where(stds > 0, stds, np.inf)
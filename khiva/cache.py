@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Shapelets.io
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+########################################################################################################################
+# IMPORT
+########################################################################################################################
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+from khiva.array import Array, dtype
+
+
+########################################################################################################################
+
+class _ResultCache(object):
+    """ Least recently used cache of results, kept in the host, with an optional on-disk tier. """
+
+    def __init__(self, max_entries, directory):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.directory is not None and os.path.isfile(self._path(key)):
+            with open(self._path(key), "rb") as handler:
+                value = pickle.load(handler)
+            self._put_in_memory(key, value)
+            return value
+        return None
+
+    def put(self, key, value):
+        self._put_in_memory(key, value)
+        if self.directory is not None:
+            with open(self._path(key), "wb") as handler:
+                pickle.dump(value, handler, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _put_in_memory(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.directory, name))
+
+
+_cache = None
+_state = threading.local()
+
+
+def enable_cache(max_entries=128, directory=None):
+    """ Enables the cache of results of the expensive KHIVA functions (`stomp`, `stomp_self_join`, `matrix_profile`,
+    `matrix_profile_self_join`, `mass`, `dtw` and `k_shape`). The results are keyed by a hash of the contents of the
+    input arrays and the rest of the parameters, so computing the key requires downloading the input arrays.
+
+    Notice that algorithms with a random initialization, like `k_shape`, return the cached result for the same input.
+    Calls of `k_shape` with a callback or a checkpoint are not cached, so that they always resume and call back.
+
+    :param max_entries: Maximum number of results kept in memory. The least recently used ones are discarded first.
+    :param directory: Directory where the results are also stored, so that they survive the memory cache and the
+                      process. None keeps the results only in memory.
+    """
+    global _cache
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _cache = _ResultCache(max_entries, directory)
+
+
+def disable_cache():
+    """ Disables the cache of results and discards the results kept in memory.
+    """
+    global _cache
+    _cache = None
+
+
+def clear_cache():
+    """ Discards all the cached results, in memory and on disk.
+    """
+    if _cache is not None:
+        _cache.clear()
+
+
+def _update_hash(digest, value):
+    """ Feeds a value to a hash.
+
+    :param digest: Hash object.
+    :param value: KHIVA array, numpy array, or any other value whose representation identifies it.
+    """
+    if isinstance(value, Array):
+        digest.update(b"khiva.Array")
+        digest.update(str(value.khiva_type.value).encode())
+        digest.update(np.asarray(value.dims).tobytes())
+        digest.update(np.ascontiguousarray(value.to_numpy()).tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(b"numpy.ndarray")
+        digest.update(str(value.dtype).encode())
+        digest.update(str(value.shape).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(type(value).__name__.encode())
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def _to_host(value):
+    """ Converts the KHIVA arrays of a result to numpy arrays, keeping the structure of the result.
+
+    :param value: KHIVA array, namedtuple, tuple or list of them, or any other picklable value.
+    :return: The host representation of the result.
+    """
+    if isinstance(value, Array):
+        return _HostArray(value.to_numpy(), value.khiva_type.value)
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return _copy_attributes(value, type(value)(*[_to_host(item) for item in value]))
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_host(item) for item in value)
+    return value
+
+
+def _from_host(value):
+    """ Uploads the numpy arrays of a host representation created with `_to_host` as new KHIVA arrays.
+
+    :param value: The host representation of the result.
+    :return: The result.
+    """
+    if isinstance(value, _HostArray):
+        return Array.from_numpy(np.asarray(value.data), dtype(value.khiva_type))
+    if isinstance(value, np.ndarray):
+        # Numpy results are copied, so that a caller modifying its result does not modify the cached one.
+        return value.copy()
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return _copy_attributes(value, type(value)(*[_from_host(item) for item in value]))
+    if isinstance(value, (list, tuple)):
+        return type(value)(_from_host(item) for item in value)
+    return value
+
+
+def _copy_attributes(source, target):
+    """ Copies the instance attributes of a result, like the inertia of a clustering, that are not fields of its
+    namedtuple.
+
+    :param source: Original result.
+    :param target: Converted result.
+    :return: The converted result.
+    """
+    if getattr(source, "__dict__", None):
+        target.__dict__.update(source.__dict__)
+    return target
+
+
+class _HostArray(object):
+    """ Contents and type of a KHIVA array kept in the host. """
+    __slots__ = ("data", "khiva_type")
+
+    def __init__(self, data, khiva_type):
+        self.data = data
+        self.khiva_type = khiva_type
+
+    def __getstate__(self):
+        return self.data, self.khiva_type
+
+    def __setstate__(self, state):
+        self.data, self.khiva_type = state
+
+
+@contextlib.contextmanager
+def _bypass_cache():
+    """ Context in which the calls to cached functions are not cached. Internal drivers computing a result by blocks
+    use it, so that every block is not hashed and stored as a result of its own.
+    """
+    previous = getattr(_state, "computing", False)
+    _state.computing = True
+    try:
+        yield
+    finally:
+        _state.computing = previous
+
+
+def cached(function=None, side_effects=()):
+    """ Decorator that caches the results of a function while the cache is enabled with `enable_cache`. Every call
+    returns new KHIVA arrays, so cached results are never shared between callers. Calls made while computing the
+    result of another cached function are not cached.
+
+    :param function: Function to be cached.
+    :param side_effects: Names of the parameters whose use makes a call have side effects, like calling back or
+                         saving files. Calls where any of them is not None are never cached, so that their side
+                         effects are not skipped.
+    :return: The decorated function, or a decorator when `function` is not given.
+    """
+    if function is None:
+        return functools.partial(cached, side_effects=side_effects)
+    signature = inspect.signature(function)
+    name = "{}.{}".format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = _cache
+        if cache is None or getattr(_state, "computing", False):
+            return function(*args, **kwargs)
+
+        arguments = signature.bind(*args, **kwargs)
+        if any(arguments.arguments.get(parameter) is not None for parameter in side_effects):
+            return function(*args, **kwargs)
+        arguments.apply_defaults()
+        digest = hashlib.sha1(name.encode())
+        for argument, value in arguments.arguments.items():
+            digest.update(argument.encode())
+            _update_hash(digest, value)
+        key = digest.hexdigest()
+
+        result = cache.get(key)
+        if result is None:
+            with _bypass_cache():
+                result = _to_host(function(*args, **kwargs))
+            cache.put(key, result)
+        return _from_host(result)
+
+    return wrapper
@@ -11,16 +11,29 @@
 # IMPORT
 ########################################################################################################################
 import ctypes
+import os
+import numpy as np
 from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH
-from khiva.array import Array
+from khiva.array import Array, dtype
+from khiva.distances import sbd, euclidean, condensed_index, pairwise_distances, _sbd_matrix
+from khiva._series import _host_series, _z_normalize
+from khiva.cache import cached
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 ########################################################################################################################
 
-ClusteringResult = namedtuple("ClusteringResult", ["centroids", "labels"])
+class ClusteringResult(namedtuple("ClusteringResult", ["centroids", "labels"])):
+    """ Centroids and labels of a clustering, with its inertia when it is known. """
+    inertia = None
 
+    def __new__(cls, centroids, labels, inertia=None):
+        result = super(ClusteringResult, cls).__new__(cls, centroids, labels)
+        result.inertia = inertia
+        return result
 
-def k_means(tss, k, tolerance=1e-10, max_iterations=100):
+
+def k_means(tss, k, tolerance=1e-10, max_iterations=100, init=None, n_init=1, random_state=None, n_jobs=None):
     """ Calculates the K-Means algorithm.
 
     [1] S. Lloyd. 1982. Least squares quantization in PCM. IEEE Transactions on Information Theory, 28, 2,
@@ -31,9 +44,29 @@ def k_means(tss, k, tolerance=1e-10, max_iterations=100):
     :param k:                   The number of means to be computed.
     :param tolerance:           The error tolerance to stop the computation of the centroids.
     :param max_iterations:      The maximum number of iterations allowed.
+    :param init:                'random' or 'k-means++' initialization of the centroids. When it, `n_init` or
+                                `random_state` are given, the Lloyd iterations are driven from Python, with the
+                                distances, sums and counts computed in the device.
+    :param n_init:              Number of fits with different initial centroids. The one with the lowest inertia
+                                (sum of squared distances to the centroids) is returned.
+    :param random_state:        Seed of the initializations.
+    :param n_jobs:              Number of fits run concurrently in threads. None runs all of them at once.
 
     :return: Tuple with an array of centroids and array of labels.
     """
+    if init is not None or n_init != 1 or random_state is not None:
+        series = _host_series(tss)
+        data, n = _upload_with_ones(tss, dtype.f64 if isinstance(tss, Array) and tss.khiva_type == dtype.f64 else
+                                    dtype.f32)
+        norms = np.sum(series ** 2, axis=1)
+
+        def fit(state):
+            centroids = _initial_centroids(series, k, init or "random", state, _euclidean_to)
+            return _lloyd(data, n, norms, centroids, tolerance, max_iterations)
+
+        return _clustering_result(*_best_of_restarts(fit, n_init, random_state, n_jobs),
+                                  khiva_type=data.khiva_type)
+
     centroids = ctypes.c_void_p(0)
     labels = ctypes.c_void_p(0)
 
@@ -54,7 +87,9 @@ def k_means(tss, k, tolerance=1e-10, max_iterations=100):
     return ClusteringResult(centroids = Array(centroids), labels=Array(labels))
 
 
-def k_shape(tss, k, tolerance=1e-10, max_iterations=100):
+@cached(side_effects=("callback", "checkpoint"))
+def k_shape(tss, k, tolerance=1e-10, max_iterations=100, init=None, n_init=1, random_state=None, n_jobs=None,
+            init_centroids=None, callback=None, checkpoint=None):
     """ Calculates the K-Shape algorithm.
 
     [1] John Paparrizos and Luis Gravano. 2016. k-Shape: Efficient and Accurate Clustering of Time Series.
@@ -66,9 +101,49 @@ def k_shape(tss, k, tolerance=1e-10, max_iterations=100):
     :param k:                   The number of means to be computed.
     :param tolerance:           The error tolerance to stop the computation of the centroids.
     :param max_iterations:      The maximum number of iterations allowed.
+    :param init:                'random' or 'k-means++' initialization of the centroids, the latter using the
+                                shape-based distance. When it, `n_init` or `random_state` are given, the iterations
+                                are driven from Python, with the shape-based distances to the centroids computed
+                                with batched FFT cross-correlations and the shape extraction in the host.
+    :param n_init:              Number of fits with different initial centroids. The one with the lowest inertia
+                                (sum of shape-based distances to the centroids) is returned.
+    :param random_state:        Seed of the initializations.
+    :param n_jobs:              Number of fits run concurrently in threads. None runs all of them at once.
+    :param init_centroids:      KHIVA array whose dimension zero is the length of the centroids and dimension one the
+                                number of centroids, or numpy array with one centroid per row, used as the initial
+                                centroids (e.g. the centroids of a previous fit). They are z-normalized.
+    :param callback:            Function called after every iteration with the number of the iteration, the centroids
+                                and the labels (numpy arrays) and the inertia. The fit stops when it returns True.
+                                Notice that it is not called when the result is taken from the cache.
+    :param checkpoint:          Path of a file where the centroids are saved after every iteration. When the file
+                                exists, the fit resumes from the saved centroids and iteration.
 
     :return: Tuple with an array of centroids and array of labels.
     """
+    if (init is not None or n_init != 1 or random_state is not None or init_centroids is not None
+            or callback is not None or checkpoint is not None):
+        series = _z_normalize(_host_series(tss))
+        first_iteration = 0
+        if checkpoint is not None and os.path.isfile(checkpoint):
+            init_centroids, first_iteration = _load_checkpoint(checkpoint)
+        if init_centroids is not None:
+            init_centroids = _z_normalize(_host_series(init_centroids))
+            if init_centroids.shape != (k, series.shape[1]):
+                raise ValueError("Expected {} initial centroids of length {}, got an array of shape {}".format(
+                    k, series.shape[1], init_centroids.shape))
+        if n_init != 1 and (init_centroids is not None or checkpoint is not None):
+            raise ValueError("n_init must be 1 when the initial centroids or a checkpoint are given")
+
+        def fit(state):
+            if init_centroids is None:
+                centroids = _initial_centroids(series, k, init or "random", state, _host_sbd)
+            else:
+                centroids = init_centroids.copy()
+            return _k_shape_iterations(series, centroids, tolerance, max_iterations, callback, checkpoint,
+                                       first_iteration)
+
+        return _clustering_result(*_best_of_restarts(fit, n_init, random_state, n_jobs), khiva_type=dtype.f32)
+
     centroids = ctypes.c_void_p(0)
     labels = ctypes.c_void_p(0)
 
@@ -88,3 +163,780 @@ def k_shape(tss, k, tolerance=1e-10, max_iterations=100):
 
     return ClusteringResult(centroids = Array(centroids), labels=Array(labels))
 
+
+def _upload_matrix(matrix, khiva_type):
+    """ Uploads a matrix so that the position row i column j of the KHIVA array is the position (i, j) of the numpy
+    array.
+
+    :param matrix: Numpy array with two dimensions.
+    :param khiva_type: KHIVA type of the elements.
+    :return: KHIVA array with the matrix.
+    """
+    result = Array.from_numpy(np.ascontiguousarray(matrix.T), khiva_type)
+    if matrix.shape[0] == 1 and matrix.shape[1] > 1:
+        # A single row is trimmed to a column when it is uploaded.
+        result = result.transpose()
+    return result
+
+
+def _upload_with_ones(tss, khiva_type):
+    """ Uploads a set of time series with an additional row of ones, so that the distances to a set of centroids and
+    the sums and counts of the clusters are computed with single matrix products.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param khiva_type: KHIVA type of the result. KHIVA arrays of other types are converted to it.
+    :return: KHIVA array with the time series and the row of ones, and the number of time series.
+    """
+    if isinstance(tss, Array):
+        n = int(tss.get_dims()[1])
+        if tss.khiva_type != khiva_type:
+            tss = tss.as_type(khiva_type)
+        return tss.join(0, _upload_matrix(np.ones((1, n)), khiva_type)), n
+    tss = np.atleast_2d(np.asarray(tss, dtype=np.float64))
+    return _upload_matrix(np.hstack([tss, np.ones((len(tss), 1))]).T, khiva_type), len(tss)
+
+
+def _centroid_weights(centroids, khiva_type):
+    """ Uploads the centroids as the weights that give the scores of `_centroid_scores` when they are multiplied by a
+    set of time series with the row of ones.
+
+    :param centroids: Numpy array with one centroid per row.
+    :param khiva_type: KHIVA type of the weights.
+    :return: KHIVA array with one row per centroid.
+    """
+    return _upload_matrix(np.hstack([-2 * centroids, np.sum(centroids ** 2, axis=1, keepdims=True)]), khiva_type)
+
+
+def _centroid_scores(data, n, centroids, weights=None):
+    """ Squared Euclidean distances from a set of time series to the centroids, minus the squared norm of the time
+    series, which does not change the nearest centroid.
+
+    :param data: KHIVA array with the time series and the row of ones.
+    :param n: Number of time series.
+    :param centroids: Numpy array with one centroid per row.
+    :param weights: KHIVA array with the weights of the centroids, or None to upload them.
+    :return: Numpy array with one row per time series and one column per centroid.
+    """
+    if weights is None:
+        weights = _centroid_weights(centroids, data.khiva_type)
+    return weights.matmul(data).to_numpy().reshape(n, len(centroids))
+
+
+def _squared_norms(data, n):
+    """ Squared norm of every time series, computed in the device.
+
+    :param data: KHIVA array with the time series and the row of ones.
+    :param n: Number of time series.
+    :return: Numpy array with the squared norms.
+    """
+    ones = _upload_matrix(np.ones((1, int(data.get_dims()[0]))), data.khiva_type)
+    return ones.matmul(data * data).to_numpy().reshape(n) - 1
+
+
+def _cluster_sums(data, n, labels, k):
+    """ Sums and counts of the time series of every cluster.
+
+    :param data: KHIVA array with the time series and the row of ones.
+    :param n: Number of time series.
+    :param labels: Numpy array with the label of every time series.
+    :param k: Number of clusters.
+    :return: Numpy array with the sum of the time series of every cluster, one per row, and numpy array with the
+             number of time series of every cluster.
+    """
+    assignments = np.zeros((n, k))
+    assignments[np.arange(n), labels] = 1
+    sums = data.matmul(_upload_matrix(assignments, data.khiva_type)).to_numpy().reshape(k, -1)
+    return sums[:, :-1], sums[:, -1]
+
+
+def _normalized_cross_correlations(series, center):
+    """ Coefficient normalized cross-correlation of every time series with a center for every shift, computed with the
+    FFT.
+
+    :param series: Numpy array with one time series per row.
+    :param center: Numpy array with the center.
+    :return: Numpy array with one row per time series, whose column s corresponds to the shift s - (length - 1), i.e.,
+             the correlation of the point i + s - (length - 1) of the time series with the point i of the center.
+    """
+    length = series.shape[1]
+    size = 1 << int(np.ceil(np.log2(2 * length - 1)))
+    correlations = np.fft.irfft(np.fft.rfft(series, size) * np.conj(np.fft.rfft(center, size)), size)
+    correlations = np.hstack([correlations[:, size - length + 1:], correlations[:, :length]])
+    norms = np.linalg.norm(series, axis=1) * np.linalg.norm(center)
+    return correlations / np.where(norms > 0, norms, np.inf)[:, None]
+
+
+def _host_sbd(series, center):
+    """ Shape-based distance of every time series to a center, computed in the host.
+
+    :param series: Numpy array with one time series per row.
+    :param center: Numpy array with the center.
+    :return: Numpy array with the distances.
+    """
+    return 1 - _normalized_cross_correlations(series, center).max(axis=1)
+
+
+def _shape_extraction(members, centroid):
+    """ Computes the centroid of a cluster of k-Shape: the members are aligned to the current centroid and the new
+    centroid is the shape that maximizes the sum of squared correlations with them, i.e., the first right singular
+    vector of the aligned and centered members.
+
+    :param members: Numpy array with the z-normalized members of the cluster, one per row.
+    :param centroid: Numpy array with the current centroid.
+    :return: Numpy array with the new z-normalized centroid.
+    """
+    length = members.shape[1]
+    aligned = members
+    if np.any(centroid):
+        shifts = _normalized_cross_correlations(members, centroid).argmax(axis=1) - (length - 1)
+        positions = np.arange(length)[None, :] + shifts[:, None]
+        valid = (positions >= 0) & (positions < length)
+        aligned = np.where(valid, np.take_along_axis(members, np.clip(positions, 0, length - 1), axis=1), 0)
+    aligned = _z_normalize(aligned)
+    centered = aligned - aligned.mean(axis=1, keepdims=True)
+    shape = np.linalg.svd(centered, full_matrices=False)[2][0]
+    if np.sum((aligned - shape) ** 2) > np.sum((aligned + shape) ** 2):
+        shape = -shape
+    return _z_normalize(shape[None])[0]
+
+
+def _initial_centroids(series, k, init, random_state, distance):
+    """ Chooses the initial centroids among the time series.
+
+    [1] David Arthur and Sergei Vassilvitskii. 2007. k-means++: The Advantages of Careful Seeding. In Proceedings of
+    the 18th Annual ACM-SIAM Symposium on Discrete Algorithms, Pages 1027-1035.
+
+    :param series: Numpy array with one time series per row.
+    :param k: Number of centroids.
+    :param init: 'random' chooses them uniformly, 'k-means++' chooses every new one with a probability proportional
+                 to the squared distance to the nearest centroid already chosen.
+    :param random_state: numpy RandomState.
+    :param distance: Function computing the distances of all the time series to one of them.
+    :return: Numpy array with one centroid per row.
+    """
+    if init == "random":
+        return series[random_state.choice(len(series), k, replace=False)].copy()
+    if init != "k-means++":
+        raise ValueError("init must be 'random' or 'k-means++'")
+    chosen = [random_state.randint(len(series))]
+    nearest = distance(series, series[chosen[0]]) ** 2
+    for _ in range(1, k):
+        total = nearest.sum()
+        candidate = random_state.choice(len(series), p=nearest / total) if total > 0 else random_state.randint(
+            len(series))
+        chosen.append(candidate)
+        nearest = np.minimum(nearest, distance(series, series[candidate]) ** 2)
+    return series[chosen].copy()
+
+
+def _euclidean_to(series, center):
+    """ Euclidean distance of every time series to a center.
+
+    :param series: Numpy array with one time series per row.
+    :param center: Numpy array with the center.
+    :return: Numpy array with the distances.
+    """
+    return np.sqrt(np.sum((series - center) ** 2, axis=1))
+
+
+def _lloyd(data, n, norms, centroids, tolerance, max_iterations):
+    """ Lloyd iterations of K-Means, with the distances, sums and counts computed in the device.
+
+    :param data: KHIVA array with the time series and the row of ones.
+    :param n: Number of time series.
+    :param norms: Numpy array with the squared norm of every time series.
+    :param centroids: Numpy array with the initial centroids, one per row.
+    :param tolerance: The error tolerance to stop the computation of the centroids.
+    :param max_iterations: The maximum number of iterations allowed.
+    :return: Numpy arrays with the centroids and the labels, and the inertia.
+    """
+    scores = _centroid_scores(data, n, centroids)
+    labels = scores.argmin(axis=1)
+    for _ in range(max_iterations):
+        sums, counts = _cluster_sums(data, n, labels, len(centroids))
+        updated = counts > 0
+        previous = centroids.copy()
+        centroids[updated] = sums[updated] / counts[updated, None]
+        scores = _centroid_scores(data, n, centroids)
+        new_labels = scores.argmin(axis=1)
+        converged = np.max(np.sum((centroids - previous) ** 2, axis=1)) <= tolerance or np.array_equal(new_labels,
+                                                                                                        labels)
+        labels = new_labels
+        if converged:
+            break
+    return centroids, labels, float(np.sum(np.maximum(scores[np.arange(n), labels] + norms, 0)))
+
+
+def _k_shape_iterations(series, centroids, tolerance, max_iterations, callback=None, checkpoint=None,
+                        first_iteration=0):
+    """ Iterations of k-Shape in the host. The shape-based distances of the time series to the centroids are computed
+    with batched FFT cross-correlations between the time series and the centroids only (see `_sbd_matrix`).
+
+    :param series: Numpy array with the z-normalized time series, one per row.
+    :param centroids: Numpy array with the initial centroids, one per row.
+    :param tolerance: The error tolerance to stop the computation of the centroids.
+    :param max_iterations: The maximum number of iterations allowed.
+    :param callback: Function called after every iteration, which stops the fit when it returns True, or None.
+    :param checkpoint: Path of the file where the centroids are saved after every iteration, or None.
+    :param first_iteration: Number of iterations already run, when the fit is resumed from a checkpoint.
+    :return: Numpy arrays with the centroids and the labels, and the inertia (sum of the shape-based distances of the
+             time series to their centroids).
+    """
+    n = len(series)
+    distances = _sbd_matrix(series, centroids)
+    labels = distances.argmin(axis=1)
+    for iteration in range(first_iteration, max_iterations):
+        previous = centroids.copy()
+        for cluster in range(len(centroids)):
+            members = series[labels == cluster]
+            if len(members) > 0:
+                centroids[cluster] = _shape_extraction(members, centroids[cluster])
+        distances = _sbd_matrix(series, centroids)
+        new_labels = distances.argmin(axis=1)
+        converged = np.max(np.sum((centroids - previous) ** 2, axis=1)) <= tolerance or np.array_equal(new_labels,
+                                                                                                        labels)
+        labels = new_labels
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, centroids, max_iterations if converged else iteration + 1)
+        if callback is not None and callback(iteration, centroids.copy(), labels.copy(),
+                                             float(np.sum(distances[np.arange(n), labels]))):
+            break
+        if converged:
+            break
+    return centroids, labels, float(np.sum(distances[np.arange(n), labels]))
+
+
+def _save_checkpoint(path, centroids, iteration):
+    """ Saves the centroids of a fit, replacing the previous checkpoint only once the new one is complete.
+
+    :param path: Path of the checkpoint.
+    :param centroids: Numpy array with one centroid per row.
+    :param iteration: Number of iterations run. A converged fit saves the maximum number of iterations, so that
+                      resuming it does not iterate again.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as handler:
+        np.savez(handler, centroids=centroids, iteration=iteration)
+    os.replace(temporary, path)
+
+
+def _load_checkpoint(path):
+    """ Loads the centroids saved by `_save_checkpoint`.
+
+    :param path: Path of the checkpoint.
+    :return: Numpy array with one centroid per row, and the number of iterations run.
+    """
+    with np.load(path) as checkpoint:
+        return checkpoint["centroids"], int(checkpoint["iteration"])
+
+
+def _best_of_restarts(fit, n_init, random_state, n_jobs):
+    """ Runs several fits with different seeds, concurrently in threads, and keeps the one with the lowest inertia.
+
+    :param fit: Function receiving a numpy RandomState and returning the centroids, the labels and the inertia.
+    :param n_init: Number of fits.
+    :param random_state: Seed of the seeds of the fits.
+    :param n_jobs: Number of threads. None uses one per fit.
+    :return: Centroids, labels and inertia of the best fit.
+    """
+    seeds = np.random.RandomState(random_state).randint(np.iinfo(np.int32).max, size=n_init)
+    states = [np.random.RandomState(seed) for seed in seeds]
+    n_jobs = n_init if n_jobs is None else n_jobs
+    if n_jobs == 1 or n_init == 1:
+        results = [fit(state) for state in states]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(fit, states))
+    return min(results, key=lambda result: result[2])
+
+
+def _clustering_result(centroids, labels, inertia, khiva_type):
+    """ Uploads the centroids and the labels of a fit.
+
+    :param centroids: Numpy array with one centroid per row.
+    :param labels: Numpy array with the label of every time series.
+    :param inertia: Inertia of the fit.
+    :param khiva_type: KHIVA type of the centroids.
+    :return: ClusteringResult.
+    """
+    return ClusteringResult(centroids=Array.from_numpy(centroids, khiva_type),
+                            labels=Array.from_numpy(labels.astype(np.int32), dtype.s32), inertia=inertia)
+
+
+class MiniBatchKMeans(object):
+    """ K-Means fitted incrementally on mini-batches of time series, so that arbitrarily many time series can be
+    clustered in bounded memory. Every batch is uploaded to the device with an additional row of ones, the distances
+    to the centroids are computed with one matrix product, and the sums and counts of the series of every cluster with
+    another one. Every centroid is the running mean of all the series assigned to it.
+
+    [1] D. Sculley. 2010. Web-scale k-means clustering. In Proceedings of the 19th International Conference on World
+    Wide Web, Pages 1177-1178.
+    """
+
+    def __init__(self, k, random_state=None, khiva_type=dtype.f32):
+        """ Creates the model.
+
+        :param k: The number of means to be computed.
+        :param random_state: Seed of the random choice of the initial centroids among the series of the first batch.
+        :param khiva_type: KHIVA type used to upload numpy batches.
+        """
+        self.k = k
+        self.random_state = np.random.RandomState(random_state)
+        self.khiva_type = khiva_type
+        self.centroids = None
+        self.counts = np.zeros(k)
+
+    def partial_fit(self, batch):
+        """ Updates the centroids with a batch of time series. The centroids are initialized with a random choice of
+        the series of the first batch.
+
+        :param batch: KHIVA array whose dimension zero is the length of the time series and dimension one the number
+                      of time series, or numpy array with one time series per row.
+        :return: The model.
+        """
+        data, n = _upload_with_ones(batch, self.khiva_type)
+        if self.centroids is None:
+            if n < self.k:
+                raise ValueError("The first batch must have at least k time series")
+            self.centroids = _host_series(batch)[self.random_state.choice(n, self.k, replace=False)]
+        labels = _centroid_scores(data, n, self.centroids).argmin(axis=1)
+
+        sums, counts = _cluster_sums(data, n, labels, self.k)
+        updated = counts > 0
+        total = self.counts + counts
+        self.centroids[updated] = ((self.counts[updated, None] * self.centroids[updated] + sums[updated]) /
+                                   total[updated, None])
+        self.counts = total
+        return self
+
+    def fit(self, batches):
+        """ Updates the centroids with every batch of an iterable, like a generator reading them from disk.
+
+        :param batches: Iterable of KHIVA arrays or numpy arrays with one time series per row.
+        :return: The model.
+        """
+        for batch in batches:
+            self.partial_fit(batch)
+        return self
+
+    def predict(self, batch):
+        """ Assigns every time series of a batch to its nearest centroid.
+
+        :param batch: KHIVA array whose dimension zero is the length of the time series and dimension one the number
+                      of time series, or numpy array with one time series per row.
+        :return: Numpy array with the label of every time series.
+        """
+        if self.centroids is None:
+            raise ValueError("The model has not been fitted")
+        data, n = _upload_with_ones(batch, self.khiva_type)
+        return _centroid_scores(data, n, self.centroids).argmin(axis=1)
+
+
+def _batches(tss, batch_size):
+    """ Splits a set of time series in batches.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param batch_size: Number of time series per batch, or None for a single batch.
+    :return: Generator of KHIVA arrays or numpy arrays with the batches.
+    """
+    if batch_size is None:
+        yield tss
+        return
+    n = int(tss.get_dims()[1]) if isinstance(tss, Array) else len(np.atleast_2d(tss))
+    for first in range(0, n, batch_size):
+        last = min(first + batch_size, n)
+        yield tss.get_cols(first, last - 1) if isinstance(tss, Array) else np.atleast_2d(tss)[first:last]
+
+
+class KMeans(object):
+    """ K-Means model whose centroids are kept in the device, so that new time series are labelled with one matrix
+    product per batch (see `k_means` for the parameters of the fit).
+    """
+
+    def __init__(self, k, tolerance=1e-10, max_iterations=100, init=None, n_init=1, random_state=None, n_jobs=None,
+                 khiva_type=dtype.f32):
+        self.k = k
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.init = init
+        self.n_init = n_init
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.khiva_type = khiva_type
+        self.centroids = None
+        self.labels = None
+        self.inertia = None
+
+    @classmethod
+    def from_centroids(cls, centroids, khiva_type=dtype.f32):
+        """ Creates a model with fixed centroids.
+
+        :param centroids: KHIVA array whose dimension zero is the length of the centroids and dimension one the number
+                          of centroids, or numpy array with one centroid per row.
+        :param khiva_type: KHIVA type used to upload numpy time series.
+        :return: The model.
+        """
+        host_centroids = _host_series(centroids)
+        model = cls(len(host_centroids), khiva_type=khiva_type)
+        model._set_centroids(host_centroids)
+        return model
+
+    def _set_centroids(self, centroids):
+        self.centroids = Array.from_numpy(centroids, self.khiva_type)
+        self._host_centroids = centroids
+        self._weights = _centroid_weights(centroids, self.khiva_type)
+
+    def fit(self, tss):
+        """ Fits the model with `k_means`.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series.
+        :return: The model.
+        """
+        result = k_means(tss, self.k, self.tolerance, self.max_iterations, self.init, self.n_init, self.random_state,
+                         self.n_jobs)
+        self._set_centroids(_host_series(result.centroids))
+        self.labels = result.labels
+        self.inertia = result.inertia
+        return self
+
+    def _check_fitted(self):
+        if self.centroids is None:
+            raise ValueError("The model has not been fitted")
+
+    def transform(self, tss, batch_size=None):
+        """ Euclidean distance of every time series to every centroid.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+        :param batch_size: Number of time series uploaded at a time, or None to upload all of them at once.
+        :return: Numpy array with one row per time series and one column per centroid.
+        """
+        self._check_fitted()
+        distances = []
+        for batch in _batches(tss, batch_size):
+            data, n = _upload_with_ones(batch, self.khiva_type)
+            scores = _centroid_scores(data, n, self._host_centroids, self._weights)
+            distances.append(np.sqrt(np.maximum(scores + _squared_norms(data, n)[:, None], 0)))
+        return np.vstack(distances)
+
+    def predict(self, tss, batch_size=None):
+        """ Label of the nearest centroid of every time series.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+        :param batch_size: Number of time series uploaded at a time, or None to upload all of them at once.
+        :return: Numpy array with the labels.
+        """
+        self._check_fitted()
+        labels = []
+        for batch in _batches(tss, batch_size):
+            data, n = _upload_with_ones(batch, self.khiva_type)
+            labels.append(_centroid_scores(data, n, self._host_centroids, self._weights).argmin(axis=1))
+        return np.concatenate(labels)
+
+
+class KShape(object):
+    """ k-Shape model whose new time series are z-normalized and labelled with the shape-based distance to the
+    centroids, batch after batch (see `k_shape` for the parameters of the fit). With `warm_start`, every fit starts
+    from the centroids of the previous one.
+    """
+
+    def __init__(self, k, tolerance=1e-10, max_iterations=100, init=None, n_init=1, random_state=None, n_jobs=None,
+                 khiva_type=dtype.f32, warm_start=False):
+        self.k = k
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.init = init
+        self.n_init = n_init
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.khiva_type = khiva_type
+        self.warm_start = warm_start
+        self.centroids = None
+        self.labels = None
+        self.inertia = None
+
+    @classmethod
+    def from_centroids(cls, centroids, khiva_type=dtype.f32):
+        """ Creates a model with fixed centroids, which are z-normalized.
+
+        :param centroids: KHIVA array whose dimension zero is the length of the centroids and dimension one the number
+                          of centroids, or numpy array with one centroid per row.
+        :param khiva_type: KHIVA type used to upload numpy time series.
+        :return: The model.
+        """
+        host_centroids = _z_normalize(_host_series(centroids))
+        model = cls(len(host_centroids), khiva_type=khiva_type)
+        model.centroids = Array.from_numpy(host_centroids, khiva_type)
+        return model
+
+    def fit(self, tss, callback=None, checkpoint=None):
+        """ Fits the model with `k_shape`.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series.
+        :param callback: Function called after every iteration (see `k_shape`).
+        :param checkpoint: Path of the file where the centroids are saved after every iteration (see `k_shape`).
+        :return: The model.
+        """
+        warm = self.warm_start and self.centroids is not None
+        result = k_shape(tss, self.k, self.tolerance, self.max_iterations, None if warm else self.init,
+                         1 if warm else self.n_init, self.random_state, self.n_jobs,
+                         self.centroids if warm else None, callback, checkpoint)
+        self.centroids, self.labels = result
+        self.inertia = result.inertia
+        return self
+
+    def transform(self, tss, batch_size=None):
+        """ Shape-based distance of every time series to every centroid.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+        :param batch_size: Number of time series processed at a time, or None to process all of them at once.
+        :return: Numpy array with one row per time series and one column per centroid.
+        """
+        if self.centroids is None:
+            raise ValueError("The model has not been fitted")
+        centroids = _host_series(self.centroids)
+        return np.vstack([_sbd_matrix(_host_series(batch), centroids) for batch in _batches(tss, batch_size)])
+
+    def predict(self, tss, batch_size=None):
+        """ Label of the nearest centroid of every time series.
+
+        :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+        :param batch_size: Number of time series processed at a time, or None to process all of them at once.
+        :return: Numpy array with the labels.
+        """
+        return self.transform(tss, batch_size).argmin(axis=1)
+
+
+def _lance_williams(linkage, d_kx, d_ky, d_xy, n_x, n_y, n_k):
+    """ Distances from a set of clusters to the union of clusters x and y, with the Lance-Williams formulas.
+
+    :param linkage: Name of the linkage.
+    :param d_kx: Numpy array with the distances of the clusters to x.
+    :param d_ky: Numpy array with the distances of the clusters to y.
+    :param d_xy: Distance between x and y.
+    :param n_x: Size of x.
+    :param n_y: Size of y.
+    :param n_k: Numpy array with the sizes of the clusters.
+    :return: Numpy array with the distances to the union.
+    """
+    if linkage == "single":
+        return np.minimum(d_kx, d_ky)
+    if linkage == "complete":
+        return np.maximum(d_kx, d_ky)
+    if linkage == "average":
+        return (n_x * d_kx + n_y * d_ky) / (n_x + n_y)
+    if linkage == "weighted":
+        return (d_kx + d_ky) / 2
+    return np.sqrt(np.maximum(((n_x + n_k) * d_kx ** 2 + (n_y + n_k) * d_ky ** 2 - n_k * d_xy ** 2) /
+                              (n_x + n_y + n_k), 0))
+
+
+_LINKAGES = ("single", "complete", "average", "weighted", "ward")
+
+
+def _nn_chain(distances, n, linkage):
+    """ Nearest-neighbour chain algorithm, which merges reciprocal nearest neighbours with O(n^2) operations.
+
+    :param distances: Numpy array with the condensed distances. It is overwritten with the distances between clusters.
+    :param n: Number of time series.
+    :param linkage: Name of the linkage, which must be reducible.
+    :return: Numpy array with the merges in the order they were found: the positions of the merged clusters, their
+             distance and the size of the union.
+    """
+    merges = np.empty((n - 1, 4))
+    sizes = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    chain = []
+    for step in range(n - 1):
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        while True:
+            x = chain[-1]
+            others = np.flatnonzero(active)
+            others = others[others != x]
+            row = distances[condensed_index(n, x, others)]
+            y = int(others[np.argmin(row)])
+            if len(chain) > 1:
+                previous = chain[-2]
+                # Ties are resolved in favour of the previous element of the chain, so that the chain ends.
+                if row[np.searchsorted(others, previous)] <= row.min():
+                    y = previous
+            if len(chain) > 1 and y == chain[-2]:
+                break
+            chain.append(y)
+        chain.pop()
+        chain.pop()
+        x, y = min(x, y), max(x, y)
+        d_xy = distances[condensed_index(n, x, y)]
+        merges[step] = x, y, d_xy, sizes[x] + sizes[y]
+
+        active[x] = False
+        others = np.flatnonzero(active)
+        others = others[others != y]
+        if len(others) > 0:
+            positions_y = condensed_index(n, y, others)
+            distances[positions_y] = _lance_williams(linkage, distances[condensed_index(n, x, others)],
+                                                     distances[positions_y], d_xy, sizes[x], sizes[y], sizes[others])
+        sizes[y] += sizes[x]
+    return merges
+
+
+def _label_merges(merges, n):
+    """ Sorts the merges by distance and names the clusters like SciPy: time series keep their index and the cluster
+    created by the merge i is n + i.
+
+    :param merges: Numpy array with the merges returned by `_nn_chain`.
+    :param n: Number of time series.
+    :return: Numpy array with the linkage matrix.
+    """
+    merges = merges[np.argsort(merges[:, 2], kind="mergesort")]
+    parents = np.arange(2 * n - 1)
+
+    def root(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for step, merge in enumerate(merges):
+        x, y = root(int(merge[0])), root(int(merge[1]))
+        parents[x] = parents[y] = n + step
+        merge[0], merge[1] = min(x, y), max(x, y)
+    return merges
+
+
+def hierarchical(tss, metric=euclidean, linkage="average", out=None, tile_size=None, memory_limit=None,
+                 khiva_type=dtype.f32, n_jobs=1):
+    """ Agglomerative hierarchical clustering. The distances between all the pairs of time series are computed by
+    tiles in the device and stored directly as a condensed vector (see `khiva.distances.pairwise_distances`), and the
+    clusters are merged with the nearest-neighbour chain algorithm, in O(n^2) time without further copies of the
+    distances.
+
+    [1] F. Murtagh and P. Contreras. 2012. Algorithms for hierarchical clustering: an overview. WIREs Data Mining and
+    Knowledge Discovery, 2, 1, Pages 86-97.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time
+                   series, like `euclidean` or `sbd`.
+    :param linkage: 'single', 'complete', 'average', 'weighted' or 'ward', with the meaning of SciPy `linkage`.
+    :param out: Numpy array or np.memmap where the condensed distances are stored, or path of a `.npy` file that is
+                created as a np.memmap. They are overwritten with the distances between clusters while merging.
+    :param tile_size: Number of time series per tile (see `khiva.distances.pairwise_distances`).
+    :param memory_limit: Number of bytes available for the tiles being computed.
+    :param khiva_type: KHIVA type used to upload numpy time series.
+    :param n_jobs: Number of worker processes computing tiles.
+    :return: Numpy array with the linkage matrix of SciPy: one row per merge with the two clusters merged, their
+             distance and the number of time series of the new cluster.
+    """
+    if linkage not in _LINKAGES:
+        raise ValueError("linkage must be one of {}".format(", ".join(_LINKAGES)))
+    distances = pairwise_distances(tss, metric, out=out, condensed=True, tile_size=tile_size,
+                                   memory_limit=memory_limit, khiva_type=khiva_type, n_jobs=n_jobs)
+    n = int(round((1 + np.sqrt(1 + 8 * len(distances))) / 2))
+    if n < 2:
+        raise ValueError("At least two time series are needed")
+    return _label_merges(_nn_chain(distances, n, linkage), n)
+
+
+SweepResult = namedtuple("SweepResult", ["ks", "inertia", "silhouette", "results"])
+
+
+def _silhouette(distances, labels, k, khiva_type):
+    """ Mean silhouette of a clustering. The sums of the distances of every time series to every cluster are computed
+    in the device, with the product of the distance matrix and the indicator matrix of the clusters.
+
+    :param distances: KHIVA array with the symmetric distance matrix.
+    :param labels: Numpy array with the label of every time series.
+    :param k: Number of clusters.
+    :param khiva_type: KHIVA type of the indicator matrix.
+    :return: The mean silhouette, or nan when there are less than two non-empty clusters.
+    """
+    n = len(labels)
+    counts = np.bincount(labels, minlength=k).astype(np.float64)
+    if np.count_nonzero(counts) < 2:
+        return float("nan")
+    indicators = np.zeros((n, k))
+    indicators[np.arange(n), labels] = 1
+    sums = distances.matmul(_upload_matrix(indicators, khiva_type)).to_numpy().reshape(k, n).T
+    own_counts = counts[labels]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(own_counts > 1, sums[np.arange(n), labels] / (own_counts - 1), 0)
+        means = np.where(counts > 0, sums / counts, np.inf)
+    means[np.arange(n), labels] = np.inf
+    b = means.min(axis=1)
+    scores = np.where(own_counts > 1, (b - a) / np.maximum(np.maximum(a, b), np.finfo(np.float64).tiny), 0)
+    return float(np.mean(scores))
+
+
+def sweep_k(tss, ks, algorithm="k_shape", tolerance=1e-10, max_iterations=100, init="k-means++", n_init=1,
+            random_state=None, n_jobs=None, silhouette=True):
+    """ Fits `k_means` or `k_shape` for several numbers of clusters, to choose one of them. The time series are
+    uploaded once and shared by all the fits, which run concurrently in threads, and the silhouettes are computed in
+    the device from a single distance matrix (Euclidean for `k_means`, shape-based for `k_shape`), which takes
+    n x n elements of device memory.
+
+    [1] P. J. Rousseeuw. 1987. Silhouettes: a graphical aid to the interpretation and validation of cluster analysis.
+    Journal of Computational and Applied Mathematics, 20, Pages 53-65.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param ks: Numbers of clusters.
+    :param algorithm: 'k_means' or 'k_shape'.
+    :param tolerance: The error tolerance to stop the computation of the centroids.
+    :param max_iterations: The maximum number of iterations allowed.
+    :param init: 'random' or 'k-means++' initialization of the centroids.
+    :param n_init: Number of fits with different initial centroids for every number of clusters.
+    :param random_state: Seed of the initializations.
+    :param n_jobs: Number of fits run concurrently in threads. None runs all of them at once.
+    :param silhouette: Whether the silhouettes are computed.
+    :return: SweepResult with the numbers of clusters, numpy arrays with the inertia and the mean silhouette (nan when
+             it is not computed) of every number of clusters, and the list of ClusteringResult.
+    """
+    if algorithm not in ("k_means", "k_shape"):
+        raise ValueError("algorithm must be 'k_means' or 'k_shape'")
+    ks = [int(k) for k in ks]
+    khiva_type = dtype.f64 if isinstance(tss, Array) and tss.khiva_type == dtype.f64 else dtype.f32
+    if algorithm == "k_means":
+        series = _host_series(tss)
+        uploaded = tss if isinstance(tss, Array) else Array.from_numpy(series, khiva_type)
+        data, n = _upload_with_ones(uploaded, khiva_type)
+        norms = np.sum(series ** 2, axis=1)
+        distance, metric = _euclidean_to, euclidean
+
+        def iterate(centroids):
+            return _lloyd(data, n, norms, centroids, tolerance, max_iterations)
+    else:
+        series = _z_normalize(_host_series(tss))
+        uploaded = Array.from_numpy(series, khiva_type)
+        distance, metric = _host_sbd, sbd
+
+        def iterate(centroids):
+            return _k_shape_iterations(series, centroids, tolerance, max_iterations)
+
+    def fit(k):
+        return _best_of_restarts(lambda state: iterate(_initial_centroids(series, k, init, state, distance)),
+                                 n_init, random_state, 1)
+
+    n_jobs = len(ks) if n_jobs is None else n_jobs
+    if n_jobs == 1 or len(ks) == 1:
+        fits = [fit(k) for k in ks]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            fits = list(executor.map(fit, ks))
+
+    silhouettes = np.full(len(ks), np.nan)
+    if silhouette:
+        upper = metric(uploaded)
+        distances = upper + upper.transpose()
+        silhouettes = np.array([_silhouette(distances, labels, k, khiva_type)
+                                for k, (_, labels, _) in zip(ks, fits)])
+    return SweepResult(ks=ks, inertia=np.array([inertia for _, _, inertia in fits]), silhouette=silhouettes,
+                       results=[_clustering_result(*result, khiva_type=khiva_type) for result in fits])
@@ -11,22 +11,272 @@
 # IMPORT
 ########################################################################################################################
 import ctypes
-from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH
-from khiva.array import Array
+import os
+import numpy as np
+from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH, _worker_pool
+from khiva.array import Array, dtype
+from khiva.cache import cached, _bypass_cache
+from khiva._series import _num_series, _host_series, _running_extremum, _z_normalize
+from collections import namedtuple
 
 
 ########################################################################################################################
+_BLOCK_ELEMENTS = 1 << 24
 
 
-def euclidean(tss):
+def condensed_index(n, i, j):
+    """ Position of the distance between two time series in a condensed distance vector, which follows the layout of
+    SciPy `pdist`: the distances of time series 0 to 1, 2, ..., n - 1, then of time series 1 to 2, ..., n - 1, etc.
+
+    :param n: Number of time series.
+    :param i: Index of the first time series, or numpy array of indexes.
+    :param j: Index of the second time series, or numpy array of indexes. It must be different from `i`.
+    :return: Position of the distance in the condensed vector.
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    if np.any(i == j):
+        raise ValueError("The distance of a time series to itself is not stored in a condensed vector")
+    return n * i - i * (i + 1) // 2 + j - i - 1
+
+
+def condensed_to_square(distances):
+    """ Converts a condensed distance vector to a symmetric distance matrix with zeros in the diagonal.
+
+    :param distances: Numpy array with the condensed distances, in the layout of SciPy `pdist`.
+    :return: Numpy array with the n x n distance matrix.
+    """
+    distances = np.asarray(distances)
+    n = int(round((1 + np.sqrt(1 + 8 * len(distances))) / 2))
+    if n * (n - 1) // 2 != len(distances):
+        raise ValueError("The length of the condensed vector must be n * (n - 1) / 2")
+    square = np.zeros((n, n), dtype=distances.dtype)
+    rows, cols = np.triu_indices(n, 1)
+    square[rows, cols] = distances
+    square[cols, rows] = distances
+    return square
+
+
+def _condensed(distances):
+    """ Downloads the upper triangle of a distance matrix as a condensed vector. Every block of rows is trimmed to the
+    columns at the right of its first row before being transferred.
+
+    :param distances: KHIVA array with an upper triangular distance matrix.
+    :return: Numpy array with the condensed distances.
+    """
+    n = distances.get_dims()[0]
+    result = np.empty(n * (n - 1) // 2)
+    block = max(1, _BLOCK_ELEMENTS // max(n, 1))
+    for first in range(0, n - 1, block):
+        last = min(first + block, n - 1)
+        values = distances.get_rows(first, last - 1).get_cols(first + 1, n - 1).to_numpy().reshape(
+            n - first - 1, last - first)
+        for i in range(first, last):
+            start = condensed_index(n, i, i + 1)
+            result[start:start + n - i - 1] = values[i - first:, i - first]
+    return result
+
+
+def _cross_distances(metric, tss, other, condensed):
+    """ Distances between every time series of a set and every time series of another one, by tiles.
+
+    The Euclidean, squared Euclidean and shape-based distances are computed directly between the rows and the columns
+    of rectangular tiles of about `_BLOCK_ELEMENTS` elements. The native kernels of the other metrics only compute
+    the distances within one set, so the distances of a tile are cut from the distances of the union of its rows and
+    columns, and the tiles are square, which keeps this work within four times the number of pairs.
+
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time series.
+    :param tss: KHIVA array with the first set of time series.
+    :param other: KHIVA array with the second set of time series.
+    :param condensed: Whether a condensed output was requested, which is not defined for two sets.
+    :return: KHIVA array where the position row i column j records the distance between the time series i of `tss`
+             and the time series j of `other`.
+    """
+    if condensed:
+        raise ValueError("The condensed output is only defined for the distances within one set of time series")
+    n_rows, length = _num_series(tss)
+    n_cols, other_length = _num_series(other)
+    if length != other_length:
+        raise ValueError("The time series of both sets must have the same length")
+    row_tile, col_tile = _cross_tiles(n_rows, n_cols, length, metric)
+    khiva_type = (dtype.f64 if tss.khiva_type == dtype.f64 else dtype.f32) if _is_direct(metric) else None
+
+    distances = np.empty((n_rows, n_cols))
+    for row_first in range(0, n_rows, row_tile):
+        row_last = min(row_first + row_tile, n_rows)
+        rows = tss.get_cols(row_first, row_last - 1)
+        for col_first in range(0, n_cols, col_tile):
+            col_last = min(col_first + col_tile, n_cols)
+            cols = other.get_cols(col_first, col_last - 1)
+            if khiva_type is None:
+                tile = _cross_tile(metric, rows, cols)
+                khiva_type = tile.khiva_type
+                distances[row_first:row_last, col_first:col_last] = tile.to_numpy().reshape(
+                    col_last - col_first, row_last - row_first).T
+            else:
+                distances[row_first:row_last, col_first:col_last] = _tile_distances(metric, rows, cols)
+
+    return _upload_distances(distances, khiva_type)
+
+
+def _is_direct(metric):
+    """ Whether the distances of a metric between two sets of time series are computed directly, without the native
+    kernel over their union.
+
+    :param metric: Function of `khiva.distances`.
+    :return: True for the Euclidean, squared Euclidean and shape-based distances.
+    """
+    return metric is euclidean or metric is squared_euclidean or metric is sbd
+
+
+def _cross_tiles(n_rows, n_cols, length, metric):
+    """ Number of rows and columns of the tiles of a cross distance matrix: rectangular tiles for the metrics computed
+    directly and square tiles, no larger than the smaller set, for the metrics computed over the union of the tiles.
+
+    :param n_rows: Number of time series of the first set.
+    :param n_cols: Number of time series of the second set.
+    :param length: Length of the time series.
+    :param metric: Function of `khiva.distances`.
+    :return: Number of rows and number of columns of the tiles.
+    """
+    if _is_direct(metric):
+        return _rectangle_tiles(n_rows, n_cols, length, metric)
+    tile_size = min(_tile_size(max(n_rows, n_cols), length, None), max(min(n_rows, n_cols), 1))
+    return tile_size, tile_size
+
+
+def _rectangle_tiles(n_rows, n_cols, length, metric):
+    """ Number of rows and columns of the tiles of a cross distance matrix computed directly, so that the distances
+    and the time series of a tile take about `_BLOCK_ELEMENTS` elements.
+
+    :param n_rows: Number of time series of the first set.
+    :param n_cols: Number of time series of the second set.
+    :param length: Length of the time series.
+    :param metric: Function of `khiva.distances`. The shape-based distance takes the cross-correlations of every pair.
+    :return: Number of rows and number of columns of the tiles.
+    """
+    pair = _fft_size(length) if metric is sbd else 1
+    row_tile = max(1, min(n_rows, int(np.sqrt(_BLOCK_ELEMENTS // pair)), _BLOCK_ELEMENTS // (2 * length)))
+    col_tile = max(1, min(n_cols, (_BLOCK_ELEMENTS - row_tile * length) // (row_tile * pair + length)))
+    row_tile = max(1, min(n_rows, (_BLOCK_ELEMENTS - col_tile * length) // (col_tile * pair + length)))
+    return row_tile, col_tile
+
+
+def _euclidean_tile(rows, cols, squared):
+    """ Euclidean distances between two blocks of time series, from their products computed in the device:
+    ||x - y||^2 = ||x||^2 + ||y||^2 - 2 x.y.
+
+    :param rows: KHIVA array with the first block of time series.
+    :param cols: KHIVA array with the second block of time series.
+    :param squared: Whether the squared distances are returned.
+    :return: Numpy array with the distance between the i-th time series of `rows` and the j-th of `cols` in the
+             position (i, j).
+    """
+    khiva_type = dtype.f64 if rows.khiva_type == dtype.f64 else dtype.f32
+    rows, cols = rows.as_type(khiva_type), cols.as_type(khiva_type)
+    n_rows, length = _num_series(rows)
+    n_cols, _ = _num_series(cols)
+    products = rows.transpose().matmul(cols)
+    norms = ((rows * rows).transpose().matmul(_ones(length, n_cols, khiva_type)) +
+             _ones(length, n_rows, khiva_type).transpose().matmul(cols * cols))
+    distances = np.maximum((norms - products - products).to_numpy().reshape(n_cols, n_rows).T, 0)
+    return distances if squared else np.sqrt(distances)
+
+
+def _ones(n_rows, n_cols, khiva_type):
+    """ KHIVA array of ones.
+
+    :param n_rows: Size of the dimension zero.
+    :param n_cols: Size of the dimension one.
+    :param khiva_type: KHIVA type of the array.
+    :return: KHIVA array of ones with dimensions [n_rows, n_cols].
+    """
+    if n_rows == 1 and n_cols > 1:
+        # A single row is trimmed to a column when it is uploaded.
+        return Array.from_numpy(np.ones((1, n_cols)), khiva_type).transpose()
+    return Array.from_numpy(np.ones((n_cols, n_rows)), khiva_type)
+
+
+def _fft_size(length):
+    """ Length of the FFT of the cross-correlations of two time series.
+
+    :param length: Length of the time series.
+    :return: The smallest power of two not lower than 2 * length - 1.
+    """
+    return 1 << int(np.ceil(np.log2(max(2 * length - 1, 1))))
+
+
+def _sbd_matrix(series, others):
+    """ Shape-based distances between two sets of time series, computed in the host with the FFT: the
+    cross-correlations of every pair are the inverse FFT of the product of the FFT of one series and the conjugated
+    FFT of the other. The time series are z-normalized like in `sbd`, and the first set is split in batches so that
+    the cross-correlations of a batch take about `_BLOCK_ELEMENTS` elements.
+
+    :param series: Numpy array with one time series per row.
+    :param others: Numpy array with one time series per row, of the same length.
+    :return: Numpy array with the distance between the i-th time series of `series` and the j-th of `others` in the
+             position (i, j).
+    """
+    series, others = (_z_normalize(values) for values in (series, others))
+    size = _fft_size(series.shape[1])
+    transforms = np.conj(np.fft.rfft(others, size))
+    others_norms = np.linalg.norm(others, axis=1)
+    distances = np.empty((len(series), len(others)))
+    batch = max(1, _BLOCK_ELEMENTS // (len(others) * size))
+    for first in range(0, len(series), batch):
+        block = series[first:first + batch]
+        correlations = np.fft.irfft(np.fft.rfft(block, size)[:, np.newaxis] * transforms[np.newaxis], size)
+        norms = np.linalg.norm(block, axis=1)[:, np.newaxis] * others_norms[np.newaxis]
+        distances[first:first + batch] = 1 - correlations.max(axis=2) / np.where(norms > 0, norms, np.inf)
+    return distances
+
+
+def _upload_distances(distances, khiva_type):
+    """ Uploads a distance matrix so that the position row i column j of the KHIVA array is the position (i, j) of
+    the numpy array.
+
+    :param distances: Numpy array with the distance matrix.
+    :param khiva_type: KHIVA type of the distances.
+    :return: KHIVA array with the distances.
+    """
+    result = Array.from_numpy(distances.T, khiva_type)
+    if distances.shape[0] == 1 and distances.shape[1] > 1:
+        # A single row is trimmed to a column when it is uploaded.
+        result = result.transpose()
+    return result
+
+
+def _cross_tile(metric, rows, cols):
+    """ Distances between two blocks of time series, cut from the distances of their union.
+
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time series.
+    :param rows: KHIVA array with the first block of time series.
+    :param cols: KHIVA array with the second block of time series.
+    :return: KHIVA array where the position row i column j records the distance between the time series i of `rows`
+             and the time series j of `cols`.
+    """
+    n_rows = rows.get_dims()[1]
+    n_cols = cols.get_dims()[1]
+    with _bypass_cache():
+        union = metric(rows.join(1, cols))
+    return union.get_rows(0, n_rows - 1).get_cols(n_rows, n_rows + n_cols - 1)
+
+
+def euclidean(tss, other=None, condensed=False):
     """ Calculates euclidean distances between time series.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between two
             time series. Diagonal elements will be zero. For example: Position row 0 column 1 records the distance
             between time series 0 and time series 1.
     """
+    if other is not None:
+        return _cross_distances(euclidean, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -34,18 +284,34 @@ def euclidean(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
 
 
-def dtw(tss):
-    """ Calculates the Dynamic Time Warping Distance.
+@cached
+def dtw(tss, other=None, condensed=False, window=None):
+    """ Calculates the Dynamic Time Warping Distance. The cost of a warping path is the sum of the absolute
+    differences of the points it aligns.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
+    :param window: Width of the Sakoe-Chiba band, i.e., the maximum distance between the positions of two aligned
+                   points. None computes the unconstrained DTW in the device, while a window computes the banded DTW
+                   in the host, whose cost grows with the window instead of the length of the time series.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between
             two time series. Diagonal elements will be zero. For example: Position row 0 column 1 records the
             distance between time series 0 and time series 1.
     """
+    if window is not None:
+        return _banded_dtw_distances(tss, other, condensed, window)
+    if other is not None:
+        return _cross_distances(dtw, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -53,18 +319,27 @@ def dtw(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
 
 
-def hamming(tss):
+def hamming(tss, other=None, condensed=False):
     """ Calculates Hamming distances between time series.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between two
             time series. Diagonal elements will be zero. For example: Position row 0 column 1 records the distance
             between time series 0 and time series 1.
     """
+    if other is not None:
+        return _cross_distances(hamming, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -72,18 +347,27 @@ def hamming(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
 
 
-def manhattan(tss):
+def manhattan(tss, other=None, condensed=False):
     """ Calculates Manhattan distances between time series.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between two
             time series. Diagonal elements will be zero. For example: Position row 0 column 1 records the distance
             between time series 0 and time series 1.
     """
+    if other is not None:
+        return _cross_distances(manhattan, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -91,19 +375,28 @@ def manhattan(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
 
 
-def sbd(tss):
+def sbd(tss, other=None, condensed=False):
     """ Calculates the Shape-Based distance (SBD). It computes the normalized cross-correlation and
     it returns the value that maximizes the correlation value between time series.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between two time series.
             Diagonal elements will be zero. For example: Position row 0 column 1 records the distance between time series 0
             and time series 1.
     """
+    if other is not None:
+        return _cross_distances(sbd, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -111,18 +404,27 @@ def sbd(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
 
 
-def squared_euclidean(tss):
+def squared_euclidean(tss, other=None, condensed=False):
     """ Calculates the non squared version of the euclidean distance.
 
     :param tss: Expects an input array whose dimension zero is the length of the time series (all the same) and
                 dimension one indicates the number of time series.
+    :param other: Array with a second set of time series of the same length. If it is given, returns an Array where
+                  the position row i column j records the distance between the time series i of `tss` and the time
+                  series j of `other`.
+    :param condensed: If True, returns a numpy array with the distances between every pair of time series in the
+                      layout of SciPy `pdist`, downloaded by blocks without the zeros of the lower triangle.
     :return: Array with an upper triangular matrix where each position corresponds to the distance between two time series.
             Diagonal elements will be zero. For example: Position row 0 column 1 records the distance between time series 0
             and time series 1.
     """
+    if other is not None:
+        return _cross_distances(squared_euclidean, tss, other, condensed)
     b = ctypes.c_void_p(0)
     error_code = ctypes.c_int(0)
     error_message = ctypes.create_string_buffer(KHIVA_ERROR_LENGTH)
@@ -130,4 +432,484 @@ def squared_euclidean(tss):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
+    if condensed:
+        return _condensed(Array(array_reference=b))
     return Array(array_reference=b)
+
+
+DistanceTile = namedtuple("DistanceTile", ["row_start", "col_start", "distances"])
+NearestNeighboursResult = namedtuple("NearestNeighboursResult", ["distances", "indexes"])
+
+
+def _available_memory():
+    """ Physical memory currently available in the host, or 1 GiB when it cannot be queried.
+
+    :return: Number of bytes.
+    """
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 1 << 30
+
+
+def _tile_size(n, length, memory_limit):
+    """ Number of time series per tile so that a tile fits in the memory budget. The cross distances of two tiles are
+    computed from the distance matrix of their union, which takes four times the memory of the tile itself.
+
+    :param n: Number of time series.
+    :param length: Length of the time series.
+    :param memory_limit: Number of bytes available for a tile, or None to use a quarter of the available memory.
+    :return: Number of time series per tile.
+    """
+    if memory_limit is None:
+        memory_limit = _available_memory() // 4
+    # 8 bytes per element: (2t)^2 distances of the union, t^2 host distances and 2t time series.
+    size = (-16.0 * length + np.sqrt(256.0 * length * length + 160.0 * memory_limit)) / 80.0
+    return int(min(max(1, size), max(n, 1)))
+
+
+def _series_block(tss, first, last, khiva_type):
+    """ KHIVA array with a block of consecutive time series.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array (which can be a np.memmap) with one time series per row.
+    :param first: First time series of the block.
+    :param last: Last time series of the block (excluded).
+    :param khiva_type: KHIVA type used to upload numpy time series.
+    :return: KHIVA array with the time series of the block.
+    """
+    if isinstance(tss, Array):
+        return tss.get_cols(first, last - 1)
+    return Array.from_numpy(np.ascontiguousarray(tss[first:last]), khiva_type)
+
+
+def _tile_distances(metric, rows, cols=None):
+    """ Distances between two blocks of time series. The distances within a block, and the cross distances of the
+    metrics that are not computed directly (see `_cross_distances`), come from a pairwise metric over the block or
+    over the union of both blocks.
+
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time series.
+    :param rows: KHIVA array with the first block of time series.
+    :param cols: KHIVA array with the second block of time series, or None to compute the distances within `rows`.
+    :return: Numpy array with the distance between the i-th time series of `rows` and the j-th of `cols` in the
+             position (i, j).
+    """
+    n_rows = rows.get_dims()[1]
+    if cols is None:
+        with _bypass_cache():
+            upper = metric(rows).to_numpy().reshape(n_rows, n_rows).T
+        return upper + upper.T
+    if metric is sbd:
+        return _sbd_matrix(_host_series(rows), _host_series(cols))
+    if _is_direct(metric):
+        return _euclidean_tile(rows, cols, metric is squared_euclidean)
+    n_cols = cols.get_dims()[1]
+    return _cross_tile(metric, rows, cols).to_numpy().reshape(n_cols, n_rows).T
+
+
+def _distance_tile(task):
+    """ Computes one tile of the distance matrix in a worker process.
+
+    :param task: Tuple with the metric, the first row, the time series of the rows, the first column, the time series
+                 of the columns and the KHIVA type. When the time series of the columns are None, the tile is on the
+                 diagonal.
+    :return: DistanceTile.
+    """
+    metric, row_first, rows, col_first, cols, khiva_type = task
+    rows = Array.from_numpy(rows, khiva_type)
+    cols = None if cols is None else Array.from_numpy(cols, khiva_type)
+    return DistanceTile(row_start=row_first, col_start=col_first, distances=_tile_distances(metric, rows, cols))
+
+
+def iter_distance_tiles(tss, metric=euclidean, tile_size=None, memory_limit=None, khiva_type=dtype.f32, n_jobs=1):
+    """ Computes the distances between all the pairs of a set of time series by tiles, so that the whole distance
+    matrix never needs to be in memory. Only the tiles on or above the diagonal are computed, since the distance
+    matrix is symmetric.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array (which can be a np.memmap) with one time series per row.
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time
+                   series, like `euclidean` or `dtw`. It must be picklable when `n_jobs` is greater than 1.
+    :param tile_size: Number of time series per tile. None chooses it from `memory_limit`.
+    :param memory_limit: Number of bytes available for the tiles being computed. None uses a quarter of the
+                         available memory.
+    :param khiva_type: KHIVA type used to upload numpy time series.
+    :param n_jobs: Number of worker processes computing tiles, each of them with its own KHIVA library. With 1, the
+                   tiles are computed in this process, in order; otherwise they are yielded as they are finished.
+    :return: Generator of DistanceTile with the first row and the first column of the tile and a numpy array with
+             the distances between the time series of its rows and of its columns.
+    """
+    n, length = _num_series(tss)
+    if tile_size is None:
+        if memory_limit is None:
+            memory_limit = _available_memory() // 4
+        tile_size = _tile_size(n, length, memory_limit // n_jobs)
+        if n_jobs > 1:
+            # Enough tiles to keep every worker busy: t * (t + 1) / 2 tiles for t tiles per side.
+            tile_size = max(1, min(tile_size, -(-n // int(np.ceil(np.sqrt(8 * n_jobs))))))
+    bounds = [(first, min(first + tile_size, n)) for first in range(0, n, tile_size)]
+
+    if n_jobs == 1:
+        for i, (row_first, row_last) in enumerate(bounds):
+            rows = _series_block(tss, row_first, row_last, khiva_type)
+            yield DistanceTile(row_start=row_first, col_start=row_first, distances=_tile_distances(metric, rows))
+            for col_first, col_last in bounds[i + 1:]:
+                cols = _series_block(tss, col_first, col_last, khiva_type)
+                yield DistanceTile(row_start=row_first, col_start=col_first,
+                                   distances=_tile_distances(metric, rows, cols))
+        return
+
+    series = _host_series(tss) if isinstance(tss, Array) else tss
+
+    def tasks():
+        for i, (row_first, row_last) in enumerate(bounds):
+            rows = np.ascontiguousarray(series[row_first:row_last])
+            yield metric, row_first, rows, row_first, None, khiva_type
+            for col_first, col_last in bounds[i + 1:]:
+                yield metric, row_first, rows, col_first, np.ascontiguousarray(series[col_first:col_last]), khiva_type
+
+    pool = _worker_pool(n_jobs)
+    try:
+        for tile in pool.imap_unordered(_distance_tile, tasks()):
+            yield tile
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _store_tile(out, n, tile, condensed):
+    """ Copies a tile of distances to the output.
+
+    :param out: Numpy array (which can be a np.memmap) with the n x n distance matrix or the condensed distances.
+    :param n: Number of time series.
+    :param tile: DistanceTile.
+    :param condensed: Whether `out` is a condensed distance vector.
+    """
+    n_rows, n_cols = tile.distances.shape
+    if not condensed:
+        out[tile.row_start:tile.row_start + n_rows, tile.col_start:tile.col_start + n_cols] = tile.distances
+        out[tile.col_start:tile.col_start + n_cols, tile.row_start:tile.row_start + n_rows] = tile.distances.T
+        return
+    for i in range(n_rows):
+        row = tile.row_start + i
+        first = max(row + 1, tile.col_start)
+        last = tile.col_start + n_cols
+        if first < last:
+            start = condensed_index(n, row, first)
+            out[start:start + last - first] = tile.distances[i, first - tile.col_start:]
+
+
+def pairwise_distances(tss, metric=euclidean, out=None, callback=None, condensed=False, tile_size=None,
+                       memory_limit=None, khiva_type=dtype.f32, n_jobs=1):
+    """ Computes the distances between all the pairs of a set of time series by tiles (see `iter_distance_tiles`),
+    streaming every tile to a callback or to an output array, which can be a np.memmap that does not fit in memory.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array (which can be a np.memmap) with one time series per row.
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time
+                   series, like `euclidean` or `dtw`.
+    :param out: Numpy array or np.memmap where the distances are stored, or path of a `.npy` file that is created as
+                a np.memmap. None allocates a numpy array, unless a callback is given.
+    :param callback: Function called with every DistanceTile. When it is given and `out` is None, nothing is stored.
+    :param condensed: Whether the distances are stored as a condensed vector, in the layout of SciPy `pdist`, instead
+                      of a symmetric n x n matrix.
+    :param tile_size: Number of time series per tile. None chooses it from `memory_limit`.
+    :param memory_limit: Number of bytes available for the tiles being computed. None uses a quarter of the
+                         available memory.
+    :param khiva_type: KHIVA type used to upload numpy time series.
+    :param n_jobs: Number of worker processes computing tiles (see `iter_distance_tiles`).
+    :return: The output array with the distances, or None when only a callback is given.
+    """
+    n, _ = _num_series(tss)
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode="w+", dtype=np.float64, shape=shape)
+    elif out is None and callback is None:
+        out = np.empty(shape)
+    if out is not None and out.shape != shape:
+        raise ValueError("The output must have shape {}".format(shape))
+
+    for tile in iter_distance_tiles(tss, metric, tile_size, memory_limit, khiva_type, n_jobs):
+        if callback is not None:
+            callback(tile)
+        if out is not None:
+            _store_tile(out, n, tile, condensed)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+_DTW_BATCH = 64
+
+
+def _dtw_window(length, other_length, window):
+    """ Validated width of the Sakoe-Chiba band.
+
+    :param length: Length of the first time series.
+    :param other_length: Length of the second time series.
+    :param window: Width of the band, or None for an unconstrained DTW.
+    :return: Width of the band.
+    """
+    if window is None:
+        return max(length, other_length)
+    if window < abs(length - other_length):
+        raise ValueError("The window must be at least the difference between the lengths of the time series")
+    return int(window)
+
+
+def _banded_dtw(x, y, window, thresholds=None):
+    """ DTW distances between pairs of time series constrained to a Sakoe-Chiba band. The cost matrix is filled by
+    anti-diagonals, whose cells only depend on the two previous anti-diagonals, so every step is vectorized over the
+    cells of the band and over the pairs.
+
+    Every warping path crosses one of any two consecutive anti-diagonals, so once the minimum cost of both exceeds
+    the threshold of a pair, its distance cannot be below the threshold and the pair is abandoned.
+
+    :param x: Numpy array with the first time series of every pair, one per row.
+    :param y: Numpy array with the second time series of every pair, one per row.
+    :param window: Width of the band.
+    :param thresholds: Numpy array with the threshold of every pair, or None to compute all the distances.
+    :return: Numpy array with the distances, or inf for the pairs whose distance exceeds their threshold.
+    """
+    n_pairs, n = x.shape
+    m = y.shape[1]
+    result = np.full(n_pairs, np.inf)
+    active = np.arange(n_pairs)
+    thresholds = np.full(n_pairs, np.inf) if thresholds is None else np.asarray(thresholds, dtype=np.float64)
+    # The cell of row i of an anti-diagonal is stored in the column i + 1, so that the column 0 is always inf.
+    buffers = [np.full((n_pairs, n + 1), np.inf) for _ in range(3)]
+    written = [(0, 0)] * 3
+    previous_minima = np.full(n_pairs, np.inf)
+    abandoned = np.zeros(n_pairs, dtype=bool)
+
+    for k in range(n + m - 1):
+        lo = max(0, k - m + 1, (k - window + 1) // 2)
+        hi = min(n - 1, k, (k + window) // 2) + 1
+        current, previous, before = buffers[k % 3], buffers[(k - 1) % 3], buffers[(k - 2) % 3]
+        current[:, written[k % 3][0]:written[k % 3][1]] = np.inf
+        written[k % 3] = (lo + 1, hi + 1)
+        if hi <= lo:
+            minima = np.full(len(active), np.inf)
+        else:
+            cost = np.abs(x[:, lo:hi] - y[:, k - hi + 1:k - lo + 1][:, ::-1])
+            if k == 0:
+                current[:, 1] = cost[:, 0]
+            else:
+                current[:, lo + 1:hi + 1] = cost + np.minimum(
+                    np.minimum(previous[:, lo:hi], previous[:, lo + 1:hi + 1]), before[:, lo:hi])
+            minima = current[:, lo + 1:hi + 1].min(axis=1)
+
+        abandoned |= np.minimum(minima, previous_minima) > thresholds
+        previous_minima = minima
+        if np.count_nonzero(abandoned) * 8 >= len(active) and np.any(abandoned):
+            keep = ~abandoned
+            x, y, thresholds, active = x[keep], y[keep], thresholds[keep], active[keep]
+            buffers = [buffer[keep] for buffer in buffers]
+            previous_minima = previous_minima[keep]
+            abandoned = abandoned[keep]
+            if len(active) == 0:
+                return result
+
+    distances = buffers[(n + m - 2) % 3][:, n]
+    result[active] = np.where(distances <= thresholds, distances, np.inf)
+    return result
+
+
+def _banded_dtw_distances(tss, other, condensed, window):
+    """ Banded DTW distances between all the pairs of a set of time series, or across two sets.
+
+    :param tss: KHIVA array or numpy array with the first set of time series.
+    :param other: KHIVA array or numpy array with the second set of time series, or None.
+    :param condensed: Whether the distances within `tss` are returned as a condensed vector.
+    :param window: Width of the Sakoe-Chiba band.
+    :return: KHIVA array with the distances, with the same layout as `dtw`, or numpy array with the condensed ones.
+    """
+    series = _host_series(tss)
+    khiva_type = dtype.f64 if isinstance(tss, Array) and tss.khiva_type == dtype.f64 else dtype.f32
+    if other is None:
+        others = series
+        rows, cols = np.triu_indices(len(series), 1)
+    elif condensed:
+        raise ValueError("The condensed output is only defined for the distances within one set of time series")
+    else:
+        others = _host_series(other)
+        rows, cols = (indexes.ravel() for indexes in np.indices((len(series), len(others))))
+    window = _dtw_window(series.shape[1], others.shape[1], window)
+
+    distances = np.empty(len(rows))
+    block = max(1, _BLOCK_ELEMENTS // (4 * (series.shape[1] + 1) + others.shape[1]))
+    for first in range(0, len(rows), block):
+        last = first + block
+        distances[first:last] = _banded_dtw(series[rows[first:last]], others[cols[first:last]], window)
+    if condensed:
+        return distances
+    matrix = np.zeros((len(series), len(others)))
+    matrix[rows, cols] = distances
+    return _upload_distances(matrix, khiva_type)
+
+
+def _envelope(series, window):
+    """ Upper and lower envelopes of a set of time series, i.e., the maximum and minimum of the points within the
+    window of every point.
+
+    :param series: Numpy array with one time series per row.
+    :param window: Width of the window at each side of a point.
+    :return: Numpy arrays with the upper and the lower envelopes.
+    """
+    window = min(window, series.shape[1])
+    upper = np.pad(series, ((0, 0), (window, window)), mode="constant", constant_values=-np.inf)
+    lower = np.pad(series, ((0, 0), (window, window)), mode="constant", constant_values=np.inf)
+    return (_running_extremum(upper, 2 * window + 1, np.maximum),
+            _running_extremum(lower, 2 * window + 1, np.minimum))
+
+
+def lb_kim(queries, candidates):
+    """ LB_Kim lower bound of the DTW distance, using the first and the last points, which every warping path aligns.
+
+    [1] Sang-Wook Kim, Sanghyun Park and Wesley W. Chu (2001). An index-based approach for similarity search
+    supporting time warping in large sequence databases. ICDE 2001.
+
+    :param queries: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+    :param candidates: KHIVA array or numpy array with the candidate time series.
+    :return: Numpy array with the lower bound of every query (rows) and candidate (columns).
+    """
+    queries = _host_series(queries)
+    candidates = _host_series(candidates)
+    bounds = np.abs(queries[:, None, 0] - candidates[None, :, 0])
+    if queries.shape[1] > 1 or candidates.shape[1] > 1:
+        bounds += np.abs(queries[:, None, -1] - candidates[None, :, -1])
+    return bounds
+
+
+def lb_keogh(queries, candidates, window=None):
+    """ LB_Keogh lower bound of the banded DTW distance, which accumulates the distance of every point of a candidate
+    to the envelope of the query.
+
+    [1] Eamonn Keogh and Chotirat Ann Ratanamahatana (2005). Exact indexing of dynamic time warping. Knowledge and
+    Information Systems 7(3):358-386.
+
+    :param queries: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+    :param candidates: KHIVA array or numpy array with the candidate time series, of the same length as the queries.
+    :param window: Width of the Sakoe-Chiba band, or None for an unconstrained DTW.
+    :return: Numpy array with the lower bound of every query (rows) and candidate (columns).
+    """
+    queries = _host_series(queries)
+    candidates = _host_series(candidates)
+    if queries.shape[1] != candidates.shape[1]:
+        raise ValueError("The queries and the candidates must have the same length")
+    upper, lower = _envelope(queries, _dtw_window(queries.shape[1], candidates.shape[1], window))
+
+    bounds = np.empty((len(queries), len(candidates)))
+    block = max(1, _BLOCK_ELEMENTS // (len(queries) * queries.shape[1]))
+    for first in range(0, len(candidates), block):
+        block_candidates = candidates[None, first:first + block]
+        excess = np.maximum(block_candidates - upper[:, None], 0) + np.maximum(lower[:, None] - block_candidates, 0)
+        bounds[:, first:first + block] = excess.sum(axis=2)
+    return bounds
+
+
+def dtw_nearest_neighbours(queries, references, k=1, window=None):
+    """ Finds the k references nearest to every query in banded DTW distance. The references are visited in order of
+    their LB_Kim and LB_Keogh lower bounds, stopping when the bound exceeds the k-th best distance, and the DTW
+    distances are abandoned as soon as they exceed it.
+
+    :param queries: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+    :param references: KHIVA array or numpy array with the reference time series, of the same length as the queries.
+    :param k: Number of nearest references.
+    :param window: Width of the Sakoe-Chiba band, or None for an unconstrained DTW.
+    :return: NearestNeighboursResult with numpy arrays with the distances and the indexes of the nearest references
+             of every query, one row per query, sorted by distance.
+    """
+    queries = _host_series(queries)
+    references = _host_series(references)
+    if not 1 <= k <= len(references):
+        raise ValueError("k must be between 1 and the number of references")
+    window = _dtw_window(queries.shape[1], references.shape[1], window)
+    bounds = np.maximum(np.maximum(lb_kim(queries, references), lb_keogh(queries, references, window)),
+                        lb_keogh(references, queries, window).T)
+
+    distances = np.empty((len(queries), k))
+    indexes = np.empty((len(queries), k), dtype=np.int64)
+    batch = max(k, _DTW_BATCH)
+    for q, query in enumerate(queries):
+        order = np.argsort(bounds[q], kind="mergesort")
+        best_distances = np.empty(0)
+        best = np.empty(0, dtype=np.int64)
+        for first in range(0, len(order), batch):
+            threshold = best_distances[-1] if len(best) == k else np.inf
+            candidates = order[first:first + batch]
+            candidates = candidates[bounds[q, candidates] <= threshold]
+            if len(candidates) == 0:
+                break
+            candidate_distances = _banded_dtw(np.broadcast_to(query, (len(candidates), len(query))),
+                                              references[candidates], window, np.full(len(candidates), threshold))
+            found = np.isfinite(candidate_distances)
+            best_distances = np.concatenate([best_distances, candidate_distances[found]])
+            best = np.concatenate([best, candidates[found]])
+            nearest = np.lexsort((best, best_distances))[:k]
+            best_distances, best = best_distances[nearest], best[nearest]
+        distances[q] = best_distances
+        indexes[q] = best
+    return NearestNeighboursResult(distances=distances, indexes=indexes)
+
+
+def knn(queries, references, k=1, metric=euclidean, window=None, khiva_type=dtype.f32):
+    """ Finds the k references nearest to every query without materializing the whole distance matrix. The
+    references are split in blocks, and the distances of the queries to every block are computed in a single call
+    (see `_cross_distances`); only the k best distances of every query are kept in the host, merged block after
+    block. The queries are only split as well when there are more of them than the square root of `_BLOCK_ELEMENTS`,
+    so that the blocks of references stay large.
+
+    The search is exhaustive: every distance is computed, without lower bounds. Only the banded DTW prunes the
+    references, with the cascade of lower bounds and early abandoning of `dtw_nearest_neighbours`.
+
+    :param queries: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                    time series, or numpy array with one time series per row.
+    :param references: KHIVA array or numpy array with the reference time series, of the same length as the queries.
+    :param k: Number of nearest references.
+    :param metric: Function of `khiva.distances` computing the distances between all the pairs of a set of time
+                   series, like `euclidean`, `sbd` or `dtw`.
+    :param window: Width of the Sakoe-Chiba band when the metric is `dtw`. None computes the unconstrained DTW in
+                   the device.
+    :param khiva_type: KHIVA type used to upload numpy time series.
+    :return: NearestNeighboursResult with numpy arrays with the distances and the indexes of the nearest references
+             of every query, one row per query, sorted by distance.
+    """
+    if window is not None:
+        if metric is not dtw:
+            raise ValueError("The window is only defined for the dtw metric")
+        return dtw_nearest_neighbours(queries, references, k, window)
+
+    n_queries, length = _num_series(queries)
+    n_references, reference_length = _num_series(references)
+    if length != reference_length:
+        raise ValueError("The queries and the references must have the same length")
+    if not 1 <= k <= n_references:
+        raise ValueError("k must be between 1 and the number of references")
+    row_tile, col_tile = _cross_tiles(n_queries, n_references, length, metric)
+
+    distances = np.empty((n_queries, k))
+    indexes = np.empty((n_queries, k), dtype=np.int64)
+    for row_first in range(0, n_queries, row_tile):
+        row_last = min(row_first + row_tile, n_queries)
+        rows = _series_block(queries, row_first, row_last, khiva_type)
+        best_distances = np.empty((row_last - row_first, 0))
+        best = np.empty((row_last - row_first, 0), dtype=np.int64)
+        for col_first in range(0, n_references, col_tile):
+            col_last = min(col_first + col_tile, n_references)
+            cols = _series_block(references, col_first, col_last, khiva_type)
+            best_distances = np.hstack([best_distances, _tile_distances(metric, rows, cols)])
+            best = np.hstack([best, np.broadcast_to(np.arange(col_first, col_last), (row_last - row_first,
+                                                                                      col_last - col_first))])
+            if best.shape[1] > k:
+                nearest = np.argpartition(best_distances, k - 1, axis=1)[:, :k]
+                best_distances = np.take_along_axis(best_distances, nearest, axis=1)
+                best = np.take_along_axis(best, nearest, axis=1)
+        order = np.lexsort((best, best_distances), axis=1)
+        distances[row_first:row_last] = np.take_along_axis(best_distances, order, axis=1)
+        indexes[row_first:row_last] = np.take_along_axis(best, order, axis=1)
+    return NearestNeighboursResult(distances=distances, indexes=indexes)
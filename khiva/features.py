@@ -11,8 +11,12 @@
 # IMPORT
 ########################################################################################################################
 import ctypes
+import inspect
+import numpy as np
+import pandas as pd
 from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH
-from khiva.array import Array
+from khiva.array import Array, dtype
+from khiva._series import _host_series, _running_extremum
 from collections import namedtuple
 
 ########################################################################################################################
@@ -20,6 +24,8 @@ from collections import namedtuple
 LinearTrendResult = namedtuple(
     "LinearTrendResult", ["pvalue", "rvalue", "intercept", "slope", "stdrr"])
 FftCoefficientResult = namedtuple("FftCoefficientResult", ["real", "imag", "abs", "angle"])
+FeatureExtractionResult = namedtuple("FeatureExtractionResult", ["features", "names"])
+RollingFeaturesResult = namedtuple("RollingFeaturesResult", ["features", "names", "starts"])
 
 
 def abs_energy(arr):
@@ -1428,3 +1434,493 @@ def variance_larger_than_standard_deviation(arr):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
     return Array(array_reference=b)
+
+
+# Parameters that the features receive as KHIVA arrays, with the type used to upload them from lists or numpy arrays.
+_ARRAY_PARAMETERS = {
+    ("cwt_coefficients", "widths"): dtype.s32,
+    ("partial_autocorrelation", "lags"): dtype.s32,
+    ("quantile", "q"): dtype.f32,
+}
+
+# Public functions of this module that are not features of a single set of time series.
+_NOT_FEATURES = ("cross_correlation", "cross_covariance", "extract", "rolling")
+
+
+def _feature_function(name):
+    """ Function of this module computing a feature.
+
+    :param name: Name of the feature.
+    :return: The function.
+    """
+    function = globals().get(name)
+    if name.startswith("_") or name in _NOT_FEATURES or not inspect.isfunction(function) \
+            or function.__module__ != __name__:
+        raise ValueError("Unknown feature: {}".format(name))
+    return function
+
+
+def _feature_specs(feature_spec):
+    """ Normalizes a feature specification.
+
+    :param feature_spec: List whose elements are names of features or tuples with the name and a dictionary with the
+                         parameters, or dictionary from names to parameters (None for no parameters).
+    :return: List of tuples with the name and the parameters of every feature.
+    """
+    items = feature_spec.items() if isinstance(feature_spec, dict) else feature_spec
+    specs = []
+    for item in items:
+        name, parameters = (item, None) if isinstance(item, str) else item
+        _feature_function(name)
+        specs.append((name, dict(parameters or {})))
+    return specs
+
+
+def _feature_name(name, parameters):
+    """ Name of a feature with its parameters, like `quantile__q_0.5`.
+
+    :param name: Name of the feature.
+    :param parameters: Dictionary with the parameters.
+    :return: The name.
+    """
+    return "__".join([name] + ["{}_{}".format(key, _parameter_label(parameters[key]))
+                               for key in sorted(parameters)])
+
+
+def _parameter_label(value):
+    """ Text of a parameter in the name of a feature.
+
+    :param value: Value of the parameter.
+    :return: The text, without spaces.
+    """
+    if isinstance(value, Array):
+        value = value.to_numpy()
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return str(value).replace(" ", "")
+
+
+def _feature_arguments(name, parameters):
+    """ Uploads the parameters that the feature receives as KHIVA arrays.
+
+    :param name: Name of the feature.
+    :param parameters: Dictionary with the parameters.
+    :return: Dictionary with the arguments of the function of the feature.
+    """
+    arguments = dict(parameters)
+    for key, value in parameters.items():
+        khiva_type = _ARRAY_PARAMETERS.get((name, key))
+        if khiva_type is not None and not isinstance(value, Array):
+            arguments[key] = Array.from_numpy(np.atleast_1d(np.asarray(value)), khiva_type)
+    return arguments
+
+
+def _feature_parts(label, result, khiva_type):
+    """ Rows of the packed features coming from the result of a feature.
+
+    :param label: Name of the feature with its parameters.
+    :param result: KHIVA array, or namedtuple of KHIVA arrays, with one column per time series.
+    :param khiva_type: KHIVA type of the packed features.
+    :return: List of tuples with the names of the rows and the KHIVA array with them.
+    """
+    if isinstance(result, tuple):
+        return [part for field, value in zip(result._fields, result)
+                for part in _feature_parts("{}__{}".format(label, field), value, khiva_type)]
+    if result.khiva_type != khiva_type:
+        result = result.as_type(khiva_type)
+    rows = int(result.get_dims()[0])
+    names = [label] if rows == 1 else ["{}__{}".format(label, row) for row in range(rows)]
+    return [(names, result)]
+
+
+def _pack(parts):
+    """ Joins the rows of the features in a single KHIVA array.
+
+    :param parts: List of tuples with the names of the rows and the KHIVA array with them.
+    :return: FeatureExtractionResult.
+    """
+    arrays = [array for _, array in parts]
+    # The arrays are joined by pairs, so that every row is copied a logarithmic number of times.
+    while len(arrays) > 1:
+        arrays = [arrays[i].join(0, arrays[i + 1]) if i + 1 < len(arrays) else arrays[i]
+                  for i in range(0, len(arrays), 2)]
+    return FeatureExtractionResult(features=arrays[0], names=[name for names, _ in parts for name in names])
+
+
+def _constant(value, rows, cols, khiva_type):
+    """ Uploads a matrix filled with a constant.
+
+    :param value: The constant.
+    :param rows: Number of rows (dimension zero).
+    :param cols: Number of columns (dimension one).
+    :param khiva_type: KHIVA type of the matrix.
+    :return: KHIVA array with the matrix.
+    """
+    result = Array.from_numpy(np.full((cols, rows), value), khiva_type)
+    if rows == 1 and cols > 1:
+        # A single row is trimmed to a column when it is uploaded.
+        result = result.transpose()
+    return result
+
+
+class _FeaturePlan(object):
+    """ Intermediate results shared by the features extracted from a set of time series, computed once and only when
+    a feature needs them. The moments are computed in the device with matrix products, so the features depending on
+    the mean and the standard deviation do not compute them again, and all the quantiles (and the median) with the
+    same precision are computed with a single sort.
+
+    Only the moments, the extrema and the sorts of the quantiles are shared. The rest of the features, including the
+    spectral ones like `fft_coefficient` and `spkt_welch_density`, run their own native call and do not share their
+    FFTs or sorts with other features.
+    """
+
+    def __init__(self, tss, specs, khiva_type):
+        self.tss = tss
+        self.khiva_type = khiva_type
+        dims = tss.get_dims()
+        self.length = int(dims[0])
+        self.n = int(dims[1])
+        self.results = {}
+        # Quantiles requested by every feature, grouped by precision: label -> (precision, first row, last row).
+        self.quantiles = {}
+        self.quantile_values = {}
+        for name, parameters in specs:
+            if name == "quantile":
+                q = parameters["q"]
+                q = np.atleast_1d(q.to_numpy() if isinstance(q, Array) else np.asarray(q, dtype=np.float64))
+                precision = parameters.get("precision", 1e8)
+            elif name == "median":
+                q, precision = np.array([0.5]), 1e8
+            else:
+                continue
+            values = self.quantile_values.setdefault(precision, [])
+            self.quantiles[_feature_name(name, parameters)] = (precision, len(values), len(values) + len(q) - 1)
+            values.extend(q.tolist())
+
+    def get(self, name):
+        """ Intermediate result, computed the first time it is requested.
+
+        :param name: Name of the intermediate result.
+        :return: KHIVA array with the intermediate result.
+        """
+        if name not in self.results:
+            self.results[name] = getattr(self, "_" + name)()
+        return self.results[name]
+
+    def constant(self, value, rows=1):
+        """ Uploads a matrix filled with a constant, with one column per time series.
+
+        :param value: The constant.
+        :param rows: Number of rows.
+        :return: KHIVA array with the matrix.
+        """
+        return _constant(value, rows, self.n, self.khiva_type)
+
+    def _values(self):
+        if self.tss.khiva_type != self.khiva_type:
+            return self.tss.as_type(self.khiva_type)
+        return self.tss
+
+    def _ones(self):
+        return _constant(1, 1, self.length, self.khiva_type)
+
+    def _broadcast(self):
+        return _constant(1, self.length, 1, self.khiva_type)
+
+    def _sum(self):
+        return self.get("ones").matmul(self.get("values"))
+
+    def _mean(self):
+        return _constant(1.0 / self.length, 1, self.length, self.khiva_type).matmul(self.get("values"))
+
+    def _broadcast_mean(self):
+        return self.get("broadcast").matmul(self.get("mean"))
+
+    def _squared_deviations(self):
+        centered = self.get("values") - self.get("broadcast_mean")
+        return centered * centered
+
+    def _variance(self):
+        return _constant(1.0 / self.length, 1, self.length, self.khiva_type).matmul(self.get("squared_deviations"))
+
+    def _standard_deviation(self):
+        return self.get("variance") ** self.constant(0.5)
+
+    def _maximum(self):
+        return maximum(self.get("values"))
+
+    def _minimum(self):
+        return minimum(self.get("values"))
+
+    def count(self, condition):
+        """ Counts the elements of every time series fulfilling a condition.
+
+        :param condition: KHIVA array with the condition evaluated on every element of the time series.
+        :return: KHIVA array with the count of every time series.
+        """
+        return self.get("ones").matmul(condition.as_type(self.khiva_type))
+
+    def quantile(self, label):
+        """ Rows of the quantiles computed for all the features with the same precision that belong to a feature.
+
+        :param label: Name of the feature with its parameters.
+        :return: KHIVA array with the quantiles of the feature.
+        """
+        precision, first, last = self.quantiles[label]
+        key = "quantile_{}".format(precision)
+        if key not in self.results:
+            q = Array.from_numpy(np.array(self.quantile_values[precision]), dtype.f32)
+            self.results[key] = quantile(self.get("values"), q, precision)
+        if first == 0 and last == len(self.quantile_values[precision]) - 1:
+            return self.results[key]
+        return self.results[key].get_rows(first, last)
+
+
+def _ratio_beyond_r_sigma(plan, r):
+    """ `ratio_beyond_r_sigma` computed from the squared deviations and the variance of a _FeaturePlan. """
+    threshold = plan.get("broadcast").matmul(plan.get("variance") * plan.constant(float(r) ** 2))
+    return plan.count(plan.get("squared_deviations") > threshold) * plan.constant(1.0 / plan.length)
+
+
+def _large_standard_deviation(plan, r):
+    """ `large_standard_deviation` computed from the standard deviation and the extrema of a _FeaturePlan. """
+    spread = (plan.get("maximum") - plan.get("minimum")) * plan.constant(float(r))
+    return (plan.get("standard_deviation") > spread).as_type(plan.khiva_type)
+
+
+# Features computed from the intermediate results of a _FeaturePlan, with the same parameters as their functions.
+_PLANNED_FEATURES = {
+    "abs_energy": lambda plan: plan.get("ones").matmul(plan.get("values") * plan.get("values")),
+    "count_above_mean": lambda plan: plan.count(plan.get("values") > plan.get("broadcast_mean")),
+    "count_below_mean": lambda plan: plan.count(plan.get("values") < plan.get("broadcast_mean")),
+    "large_standard_deviation": _large_standard_deviation,
+    "maximum": lambda plan: plan.get("maximum"),
+    "mean": lambda plan: plan.get("mean"),
+    "minimum": lambda plan: plan.get("minimum"),
+    "ratio_beyond_r_sigma": _ratio_beyond_r_sigma,
+    "standard_deviation": lambda plan: plan.get("standard_deviation"),
+    "sum_values": lambda plan: plan.get("sum"),
+    "variance": lambda plan: plan.get("variance"),
+    "variance_larger_than_standard_deviation":
+        lambda plan: (plan.get("variance") > plan.get("standard_deviation")).as_type(plan.khiva_type),
+}
+
+
+def _extract_parts(tss, specs, khiva_type):
+    """ Computes a list of features in the device, sharing their intermediate results.
+
+    :param tss: KHIVA array with the time series.
+    :param specs: List of tuples with the name and the parameters of every feature.
+    :param khiva_type: KHIVA type of the features.
+    :return: List with the rows of every feature (see `_feature_parts`).
+    """
+    plan = _FeaturePlan(tss, specs, khiva_type)
+    results = {}
+    feature_parts = []
+    for name, parameters in specs:
+        label = _feature_name(name, parameters)
+        if label not in results:
+            if label in plan.quantiles:
+                results[label] = plan.quantile(label)
+            elif name in _PLANNED_FEATURES:
+                results[label] = _PLANNED_FEATURES[name](plan, **parameters)
+            else:
+                results[label] = _feature_function(name)(tss, **_feature_arguments(name, parameters))
+        feature_parts.append(_feature_parts(label, results[label], khiva_type))
+    return feature_parts
+
+
+def extract(tss, feature_spec, as_frame=False, khiva_type=dtype.f32):
+    """ Extracts several features of a set of time series. The time series are uploaded once, all the features are
+    computed in the device and packed in a single KHIVA array, so that they are downloaded at once. The features are
+    planned together: the mean, variance, standard deviation, extrema and sums are computed once and shared by the
+    features depending on them, all the quantiles and medians are computed with a single sort, and repeated features
+    are computed once.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param feature_spec: List whose elements are names of the functions of this module or tuples with the name and a
+                         dictionary with the parameters, like ``["mean", ("quantile", {"q": [0.1, 0.9]})]``, or
+                         dictionary from names to parameters. Parameters received as KHIVA arrays can be given as lists.
+    :param as_frame: Whether the features are downloaded as a pandas DataFrame with one row per time series and one
+                     column per feature.
+    :param khiva_type: KHIVA type of the packed features, which is also used to upload numpy time series.
+    :return: FeatureExtractionResult with the KHIVA array whose dimension zero are the features and dimension one the
+             time series, and the names of the features, like `mean`, `quantile__q_[0.1,0.9]__1` (second row of a
+             feature with several rows) or `linear_trend__slope` (field of a feature returning a tuple). With
+             `as_frame`, the pandas DataFrame.
+    """
+    if not isinstance(tss, Array):
+        tss = Array.from_numpy(np.atleast_2d(np.asarray(tss, dtype=np.float64)), khiva_type)
+    n = int(tss.get_dims()[1])
+    specs = _feature_specs(feature_spec)
+    if not specs:
+        raise ValueError("At least one feature is needed")
+    result = _pack([part for parts in _extract_parts(tss, specs, khiva_type) for part in parts])
+    if as_frame:
+        return pd.DataFrame(result.features.to_numpy().reshape(n, len(result.names)), columns=result.names)
+    return result
+
+
+# Number of elements of the windows uploaded at a time by `rolling`.
+_ROLLING_BLOCK_ELEMENTS = 1 << 24
+
+
+class _RollingWindows(object):
+    """ Features of sliding windows computed incrementally in the host, from running sums and running extrema of the
+    whole time series, without materializing the windows.
+    """
+
+    def __init__(self, series, window, starts):
+        self.series = series
+        self.window = window
+        self.starts = starts
+        self.results = {}
+
+    def get(self, name):
+        """ Intermediate result or feature of every window, computed the first time it is requested.
+
+        :param name: Name of the intermediate result or feature.
+        :return: Numpy array with one row per time series and one column per window.
+        """
+        if name not in self.results:
+            self.results[name] = getattr(self, "_" + name)()
+        return self.results[name]
+
+    def running_sum(self, values, window=None):
+        """ Sums of the windows of a set of sequences, from their cumulative sums.
+
+        :param values: Numpy array with one sequence per row.
+        :param window: Number of points of the windows. None uses the window of the features.
+        :return: Numpy array with the sum of every window.
+        """
+        window = self.window if window is None else window
+        cumulative = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.cumsum(values, axis=1, out=cumulative[:, 1:])
+        return cumulative[:, self.starts + window] - cumulative[:, self.starts]
+
+    def _offset(self):
+        # The series are centered before accumulating the sums of squares, to avoid the cancellation of large means.
+        return self.series.mean(axis=1, keepdims=True)
+
+    def _centered_mean(self):
+        return self.running_sum(self.series - self.get("offset")) / self.window
+
+    def _mean(self):
+        return self.get("centered_mean") + self.get("offset")
+
+    def _sum_values(self):
+        return self.get("mean") * self.window
+
+    def _variance(self):
+        squares = self.running_sum((self.series - self.get("offset")) ** 2) / self.window
+        return np.maximum(squares - self.get("centered_mean") ** 2, 0)
+
+    def _standard_deviation(self):
+        return np.sqrt(self.get("variance"))
+
+    def _abs_energy(self):
+        return self.running_sum(self.series ** 2)
+
+    def _maximum(self):
+        return _running_extremum(self.series, self.window, np.maximum)[:, self.starts]
+
+    def _minimum(self):
+        return _running_extremum(self.series, self.window, np.minimum)[:, self.starts]
+
+    def _absolute_sum_of_changes(self):
+        return self.running_sum(np.abs(np.diff(self.series, axis=1)), self.window - 1)
+
+    def _mean_absolute_change(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.get("absolute_sum_of_changes") / (self.window - 1)
+
+    def _mean_change(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.series[:, self.starts + self.window - 1] - self.series[:, self.starts]) / (self.window - 1)
+
+
+# Features without parameters that `rolling` computes incrementally.
+_INCREMENTAL_FEATURES = ("abs_energy", "absolute_sum_of_changes", "maximum", "mean", "mean_absolute_change",
+                         "mean_change", "minimum", "standard_deviation", "sum_values", "variance")
+
+
+def _rolling_extracted(series, window, starts, specs, khiva_type):
+    """ Features of sliding windows computed in the device with `extract`, uploading the windows by blocks.
+
+    :param series: Numpy array with one time series per row.
+    :param window: Number of points of the windows.
+    :param starts: Numpy array with the first point of every window.
+    :param specs: List of tuples with the name and the parameters of every feature.
+    :param khiva_type: KHIVA type used to upload the windows.
+    :return: List with the names of the rows of every feature, and numpy array with one row per window (of the first
+             time series, then of the second one, etc.) and one column per row of the features.
+    """
+    total = series.shape[0] * len(starts)
+    block = max(1, _ROLLING_BLOCK_ELEMENTS // window)
+    offsets = np.arange(window)
+    names, blocks = None, []
+    for first in range(0, total, block):
+        windows = np.arange(first, min(first + block, total))
+        batch = series[(windows // len(starts))[:, None], starts[windows % len(starts)][:, None] + offsets]
+        feature_parts = _extract_parts(Array.from_numpy(batch, khiva_type), specs, khiva_type)
+        packed = _pack([part for parts in feature_parts for part in parts])
+        names = [[name for row_names, _ in parts for name in row_names] for parts in feature_parts]
+        blocks.append(packed.features.to_numpy().reshape(len(windows), len(packed.names)))
+    return names, np.vstack(blocks)
+
+
+def rolling(tss, window, step=1, features=("mean",), as_frame=False, khiva_type=dtype.f32):
+    """ Computes features over sliding windows of every time series. The mean, variance, standard deviation, sum,
+    energy, extrema and changes are computed incrementally from running sums and running extrema, without
+    materializing the windows. Any other feature is computed in the device with `extract`, uploading the windows by
+    blocks.
+
+    :param tss: KHIVA array whose dimension zero is the length of the time series and dimension one the number of
+                time series, or numpy array with one time series per row.
+    :param window: Number of points of the windows.
+    :param step: Number of points between the first points of consecutive windows.
+    :param features: Features to be computed, in the format of the `feature_spec` of `extract`.
+    :param as_frame: Whether the features are returned as a pandas DataFrame indexed by the time series and the first
+                     point of the window, with one column per feature.
+    :param khiva_type: KHIVA type used to upload the windows.
+    :return: RollingFeaturesResult with the numpy array whose position (i, j, f) is the feature f of the window j of
+             the time series i, the names of the features (see `extract`), and the first point of every window. With
+             `as_frame`, the pandas DataFrame.
+    """
+    series = _host_series(tss)
+    n, length = series.shape
+    if window < 1 or window > length:
+        raise ValueError("The window must have between 1 and {} points".format(length))
+    if step < 1:
+        raise ValueError("The step must be positive")
+    starts = np.arange(0, length - window + 1, step)
+    specs = _feature_specs(features)
+    if not specs:
+        raise ValueError("At least one feature is needed")
+
+    incremental = _RollingWindows(series, window, starts)
+    extracted = [(name, parameters) for name, parameters in specs
+                 if name not in _INCREMENTAL_FEATURES or parameters]
+    if extracted:
+        extracted_names, extracted_values = _rolling_extracted(series, window, starts, extracted, khiva_type)
+        extracted_values = extracted_values.reshape(n, len(starts), -1)
+
+    names, columns = [], []
+    column = 0
+    index = 0
+    for name, parameters in specs:
+        if name in _INCREMENTAL_FEATURES and not parameters:
+            names.append(name)
+            columns.append(incremental.get(name)[:, :, None])
+        else:
+            rows = len(extracted_names[index])
+            names.extend(extracted_names[index])
+            columns.append(extracted_values[:, :, column:column + rows])
+            column += rows
+            index += 1
+    values = np.concatenate(columns, axis=2)
+    if as_frame:
+        frame_index = pd.MultiIndex.from_product([np.arange(n), starts], names=["series", "start"])
+        return pd.DataFrame(values.reshape(n * len(starts), len(names)), index=frame_index, columns=names)
+    return RollingFeaturesResult(features=values, names=names, starts=starts)
@@ -208,3 +208,25 @@ def version():
         raise Exception(str(error_message.value.decode()))
 
     return v.value.decode('utf8')
+
+
+def _initialize_worker(backend_value):
+    """ Prepares a worker process to run KHIVA computations. It loads the KHIVA library once per process and
+    activates the same backend used by the parent process.
+
+    :param backend_value: Value of the KHIVABackend to be set in the worker.
+    """
+    set_backend(KHIVABackend(backend_value))
+
+
+def _worker_pool(n_jobs):
+    """ Creates a pool of worker processes, each of them loading the KHIVA library once and using the active backend.
+
+    Worker processes are spawned instead of forked, so that device contexts from the parent process are never shared.
+
+    :param n_jobs: Number of worker processes.
+    :return: A multiprocessing pool.
+    """
+    import multiprocessing
+    return multiprocessing.get_context("spawn").Pool(processes=n_jobs, initializer=_initialize_worker,
+                                                     initargs=(get_backend().value,))
@@ -12,17 +12,85 @@
 # IMPORT
 ########################################################################################################################
 import ctypes
-from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH
-from khiva.array import Array
-from collections import namedtuple
+import hashlib
+import heapq
+import json
+import os
+import numpy as np
+from khiva.library import KhivaLibrary, KHIVA_ERROR_LENGTH, _worker_pool
+from khiva.array import Array, dtype
+from khiva.features import value_count, minimum
+from khiva.dimensionality import paa
+from khiva.cache import cached, _bypass_cache
+from collections import namedtuple, deque
 
 
 ########################################################################################################################
-MatrixProfileResult = namedtuple("MatrixProfileResult", ["profile", "index"])
+StoredMatrixProfile = namedtuple(
+    "StoredMatrixProfile",
+    ["profile", "index", "subsequence_length", "source_hash", "offset", "exclusion_zone", "normalize"])
+
+
+class MatrixProfileResult(namedtuple("MatrixProfileResult", ["profile", "index"])):
+    """ Matrix profile and matrix profile index. """
+    __slots__ = ()
+
+    def save(self, path, subsequence_length, time_series, exclusion_zone=None, normalize=True):
+        """ Saves the matrix profile in a directory, with the profile and the index as `profile.npy` and `index.npy`
+        files, which can be memory-mapped, and the metadata needed to resume the computation in `metadata.json`.
+
+        :param path: Directory where the matrix profile is saved. It is created if it does not exist.
+        :param subsequence_length: Subsequence length used to calculate the matrix profile.
+        :param time_series: KHIVA array or numpy array with the time series used to calculate the matrix profile.
+        :param exclusion_zone: Exclusion zone used to calculate the matrix profile. None stands for the default
+                               exclusion zone.
+        :param normalize: Whether the matrix profile uses the z-normalized or the non-normalized Euclidean distance.
+        """
+        if exclusion_zone is None:
+            exclusion_zone = _default_exclusion_zone(subsequence_length)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        profile, index = (value.to_numpy() if isinstance(value, Array) else np.asarray(value) for value in self)
+        time_series = _host_time_series(time_series)
+        np.save(os.path.join(path, "profile.npy"), profile)
+        np.save(os.path.join(path, "index.npy"), index)
+        with open(os.path.join(path, "metadata.json"), "w") as handler:
+            json.dump({"subsequence_length": int(subsequence_length), "source_hash": _hash_time_series(time_series),
+                       "offset": len(time_series), "exclusion_zone": int(exclusion_zone),
+                       "normalize": bool(normalize)}, handler)
+
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """ Loads a matrix profile saved with `save`.
+
+        :param path: Directory where the matrix profile was saved.
+        :param mmap_mode: Memory-map mode of the profile and the index (see numpy.load), or None to read them.
+        :return: StoredMatrixProfile with numpy arrays with the profile and the index, the subsequence length, the
+                 hash of the time series, the number of points of the time series that were processed, the
+                 exclusion zone and whether the distance is z-normalized.
+        """
+        with open(os.path.join(path, "metadata.json")) as handler:
+            metadata = json.load(handler)
+        subsequence_length = metadata["subsequence_length"]
+        return StoredMatrixProfile(profile=np.load(os.path.join(path, "profile.npy"), mmap_mode=mmap_mode),
+                                   index=np.load(os.path.join(path, "index.npy"), mmap_mode=mmap_mode),
+                                   subsequence_length=subsequence_length, source_hash=metadata["source_hash"],
+                                   offset=metadata["offset"],
+                                   exclusion_zone=metadata.get("exclusion_zone",
+                                                               _default_exclusion_zone(subsequence_length)),
+                                   normalize=metadata.get("normalize", True))
+
+
 BestNResult = namedtuple(
     "BestNResult", ["distances", "indexes", "subsequence_indexes"])
 BestNResultOcurrences = namedtuple(
     "BestNResultOcurrences", ["distances", "indexes"])
+LeftRightMatrixProfileResult = namedtuple(
+    "LeftRightMatrixProfileResult", ["profile", "index", "left_profile", "left_index", "right_profile", "right_index"])
+MultidimensionalMatrixProfileResult = namedtuple(
+    "MultidimensionalMatrixProfileResult", ["profile", "index", "dimensions"])
+ChainsResult = namedtuple("ChainsResult", ["indexes", "offsets", "series"])
+PanMatrixProfileResult = namedtuple("PanMatrixProfileResult", ["profile", "index", "subsequence_lengths"])
 
 
 def find_best_n_discords(profile, index, m, n, self_join=False):
@@ -61,6 +129,26 @@ def find_best_n_discords(profile, index, m, n, self_join=False):
     return BestNResult(distances=Array(b), indexes=Array(c), subsequence_indexes=Array(d))
 
 
+def find_best_n_left_discords(left_profile, left_index, m, n):
+    """ This function extracts the best N discords from a previously calculated left matrix profile. The
+    subsequences without neighbours in the past are never reported as discords.
+
+    :param left_profile: KHIVA array with the left matrix profile containing the minimum distance of each subsequence
+                         to the subsequences preceding it.
+    :param left_index: KHIVA array with the left matrix profile index containing where each minimum occurs.
+    :param m: Subsequence length value used to calculate the input matrix profile.
+    :param n: Number of discords to extract.
+    :return: KHIVA arrays with the discord distances, the discord indexes and the subsequence indexes.
+    """
+    profile = left_profile.to_numpy()
+    index = left_index.to_numpy()
+    missing = ~np.isfinite(profile)
+    profile[missing] = 0
+    index[missing] = 0
+    return find_best_n_discords(Array.from_numpy(profile, left_profile.khiva_type),
+                                Array.from_numpy(index, dtype.u32), m, n)
+
+
 def find_best_n_motifs(profile, index, m, n, self_join=False):
     """ This function extracts the best N discords from a previously calculated matrix profile.
 
@@ -138,6 +226,7 @@ def find_best_n_occurrences(query_time_series, time_series, number_of_occurrence
     return BestNResultOcurrences(distances=Array(distances), indexes=Array(indexes))
 
 
+@cached
 def mass(query_time_series, time_series):
     """ Mueen's Algorithm for Similarity Search.
 
@@ -171,6 +260,7 @@ def mass(query_time_series, time_series):
     return Array(array_reference=distances)
 
 
+@cached
 def stomp(first_time_series, second_time_series, subsequence_length):
     """ Stomp algorithm to calculate the matrix profile between `ta` and `tb` using a subsequence length of `m`.
 
@@ -203,7 +293,206 @@ def stomp(first_time_series, second_time_series, subsequence_length):
     return MatrixProfileResult(profile=Array(profile), index=Array(index))
 
 
-def stomp_self_join(time_series, subsequence_length):
+_BLOCK_ELEMENTS = 1 << 24
+
+
+def _default_exclusion_zone(subsequence_length):
+    """ Width of the trivial match exclusion zone used when the matrix profile is computed by blocks.
+
+    :param subsequence_length: Length of the subsequence.
+    :return: Number of subsequences at each side of a subsequence that are considered trivial matches.
+    """
+    return int(np.ceil(subsequence_length / 4.0))
+
+
+def _subsequences(time_series, first, last, subsequence_length):
+    """ View of the subsequences of a time series starting between `first` and `last` (excluded), one per row.
+
+    :param time_series: Numpy array with one time series.
+    :param first: First subsequence.
+    :param last: Last subsequence (excluded).
+    :param subsequence_length: Length of the subsequence.
+    :return: Numpy array with shape (last - first, subsequence_length).
+    """
+    stride = time_series.strides[0]
+    return np.lib.stride_tricks.as_strided(time_series[first:], shape=(last - first, subsequence_length),
+                                           strides=(stride, stride), writeable=False)
+
+
+def _moving_statistics(time_series, subsequence_length):
+    """ Mean and standard deviation of every subsequence of a time series.
+
+    :param time_series: Numpy array with one time series.
+    :param subsequence_length: Length of the subsequence.
+    :return: Numpy arrays with the means and the standard deviations.
+    """
+    n_subsequences = len(time_series) - subsequence_length + 1
+    means = np.empty(n_subsequences)
+    stds = np.empty(n_subsequences)
+    for first, last in _tile_bounds(n_subsequences, max(1, _BLOCK_ELEMENTS // subsequence_length)):
+        subsequences = _subsequences(time_series, first, last, subsequence_length)
+        means[first:last] = subsequences.mean(axis=1)
+        stds[first:last] = subsequences.std(axis=1)
+    return means, stds
+
+
+_EXCLUDED_DISTANCE = 1e30
+# Position larger than the position of any subsequence, exactly representable in double precision.
+_UNKNOWN_POSITION = 1 << 62
+
+
+def _outer(columns, rows, khiva_type):
+    """ Builds in the device a matrix whose values only depend on its row and its column, uploading the factors of
+    the rows and the columns instead of the matrix.
+
+    :param columns: Numpy array with shape (n_rows, k) with the factors of every row.
+    :param rows: Numpy array with shape (n_columns, k) with the factors of every column.
+    :param khiva_type: KHIVA type of the matrix.
+    :return: KHIVA array with dimensions [n_rows, n_columns] and the values of columns @ rows.T.
+    """
+    if columns.shape[1] == 1:
+        # A single factor would be uploaded as a 1-dimensional array, so a null factor is added.
+        columns = np.column_stack([columns, np.zeros(len(columns))])
+        rows = np.column_stack([rows, np.zeros(len(rows))])
+    return Array.from_numpy(columns, khiva_type).transpose().matmul(Array.from_numpy(rows, khiva_type))
+
+
+def _integer_outer(columns, rows):
+    """ Builds in the device a matrix of 64-bit integers like `_outer`. The products are computed in double precision,
+    which is exact for the positions of any time series, and then converted, so that positions are compared exactly.
+
+    :param columns: Numpy array with shape (n_rows, k) with the integer factors of every row.
+    :param rows: Numpy array with shape (n_columns, k) with the integer factors of every column.
+    :return: KHIVA array of signed 64-bit integers with dimensions [n_rows, n_columns].
+    """
+    return _outer(columns, rows, dtype.f64).as_type(dtype.s64)
+
+
+def _first_minimum(values, positions, khiva_type):
+    """ Minimum of every column of a matrix and the first position where it is found, reduced in the device. The
+    positions are integers, so they are not rounded through the floating point location of the minimum.
+
+    :param values: KHIVA array with dimensions [n_rows, n_columns].
+    :param positions: KHIVA array of signed 64-bit integers with the position of the row of every element.
+    :param khiva_type: KHIVA type of the values.
+    :return: Numpy arrays with the minimum and its position for every column.
+    """
+    n_rows, n_columns = int(values.dims[0]), int(values.dims[1])
+    minima = minimum(values).to_numpy().flatten().astype(np.float64)
+    broadcast = _outer(np.ones((n_rows, 1)), minima[:, np.newaxis], khiva_type)
+    at_minimum = (values == broadcast).as_type(dtype.s64)
+    elsewhere = (values != broadcast).as_type(dtype.s64)
+    candidates = positions * at_minimum + elsewhere * _integer_outer(np.full((n_rows, 1), _UNKNOWN_POSITION),
+                                                                     np.ones((n_columns, 1)))
+    return minima, minimum(candidates).to_numpy().flatten().astype(np.int64)
+
+
+def _nearest(distances, positions, bounds, left, khiva_type):
+    """ Minimum of every column of a distance matrix over the rows of one side of the column, reduced in the device
+    so that only the minima and their positions are downloaded.
+
+    :param distances: KHIVA array with dimensions [n_rows, n_columns].
+    :param positions: KHIVA array of signed 64-bit integers with the position of the row of every element.
+    :param bounds: KHIVA array of signed 64-bit integers with the last (left) or first (right) position of the side
+                   of every element.
+    :param left: Whether the side is made of the rows at or before the bounds, or at or after them.
+    :param khiva_type: KHIVA type of the distances.
+    :return: Numpy arrays with the minimum and its position for every column. Columns without any finite distance
+             in their side have an infinite minimum and a position of -1.
+    """
+    side = (positions <= bounds if left else positions >= bounds).as_type(khiva_type)
+    excluded = (positions > bounds if left else positions < bounds).as_type(khiva_type)
+    # The power discards the NaN and infinite distances of the excluded rows before they are multiplied by 0.
+    masked = (distances ** side) * side + excluded * _outer(np.full((int(distances.dims[0]), 1), _EXCLUDED_DISTANCE),
+                                                              np.ones((int(distances.dims[1]), 1)), khiva_type)
+    minima, rows = _first_minimum(masked, positions, khiva_type)
+    found = np.isfinite(minima) & (minima < _EXCLUDED_DISTANCE / 2)
+    return np.where(found, minima, np.inf), np.where(found, rows, -1)
+
+
+def _left_right_self_join(time_series, subsequence_length, exclusion_zone, khiva_type, normalize=True,
+                          epsilon=None, start=0):
+    """ Computes the left and right matrix profiles of one time series by blocks of queries. Every block is computed
+    with `mass` against the whole time series, which is uploaded once, and the past and future parts of the block
+    are reduced separately in the device, so that only the minima of every block are downloaded.
+
+    The non-normalized Euclidean distance is obtained from the z-normalized one and the moving statistics:
+    ||q - t||^2 = m (mean_q - mean_t)^2 + m (std_q - std_t)^2 + std_q std_t d_z(q, t)^2. The terms that only
+    depend on the query or on the reference subsequence are built in the device as products of their factors.
+
+    :param time_series: Numpy array with one time series.
+    :param subsequence_length: Length of the subsequence.
+    :param exclusion_zone: Number of subsequences at each side of a subsequence that are considered trivial matches.
+    :param khiva_type: KHIVA type used to upload the time series.
+    :param normalize: Whether the distance is the z-normalized or the non-normalized Euclidean distance.
+    :param epsilon: Standard deviation below which subsequences are considered constant, as in `stomp_self_join`.
+    :param start: Only the pairs of subsequences where at least one of them starts at or after `start` are joined.
+                  Only the subsequences from `start` on are used as queries. The rows of every block that belong to
+                  the earlier subsequences are transposed to update their right profiles, so every pair is computed
+                  once.
+    :return: Numpy arrays with the left profile, left index, right profile and right index. Subsequences without
+             neighbours in the past (or the future) have an infinite distance and an index of -1.
+    """
+    m = subsequence_length
+    n_subsequences = len(time_series) - m + 1
+    reference = Array.from_numpy(time_series, khiva_type)
+    means, stds = _moving_statistics(time_series, m)
+    # The means are centered so that the squared differences built from their products do not lose precision.
+    means = means - means.mean()
+    variable = (stds >= epsilon if epsilon is not None else stds > 0).astype(np.float64)
+    block_length = max(1, _BLOCK_ELEMENTS // n_subsequences)
+    left_profile = np.full(n_subsequences, np.inf)
+    right_profile = np.full(n_subsequences, np.inf)
+    left_index = np.full(n_subsequences, -1, dtype=np.int64)
+    right_index = np.full(n_subsequences, -1, dtype=np.int64)
+    ones_columns, ones_earlier = np.ones((n_subsequences, 1)), np.ones((start, 1))
+
+    for first, last in [(first + start, last + start) for first, last in
+                        _tile_bounds(n_subsequences - start, block_length)]:
+        queries = Array.from_numpy(_subsequences(time_series, first, last, m), khiva_type)
+        with _bypass_cache():
+            distances = mass(queries, reference)
+        rows, ones_rows = slice(first, last), np.ones((last - first, 1))
+        if not normalize or epsilon is not None:
+            keep = _outer(variable[:, np.newaxis], variable[rows, np.newaxis], khiva_type)
+            distances = (distances ** keep) * keep
+        if not normalize:
+            scale = stds * variable
+            distances = distances * distances * _outer(scale[:, np.newaxis], scale[rows, np.newaxis], khiva_type)
+            distances = distances + _outer(
+                np.column_stack([m * (means ** 2 + stds ** 2), means, stds, ones_columns[:, 0]]),
+                np.column_stack([ones_rows[:, 0], -2 * m * means[rows], -2 * m * stds[rows],
+                                 m * (means[rows] ** 2 + stds[rows] ** 2)]), khiva_type)
+        elif epsilon is not None:
+            # sqrt(m) when exactly one of the subsequences is constant.
+            distances = distances + _outer(
+                np.column_stack([variable, ones_columns[:, 0], variable]),
+                np.sqrt(m) * np.column_stack([ones_rows[:, 0], variable[rows], -2 * variable[rows]]), khiva_type)
+        positions = _integer_outer(np.arange(n_subsequences)[:, np.newaxis], ones_rows)
+        for profile, index, bounds, left in (
+                (left_profile, left_index, np.arange(first, last) - exclusion_zone, True),
+                (right_profile, right_index, np.arange(first, last) + exclusion_zone, False)):
+            nearest, index[rows] = _nearest(distances, positions, _integer_outer(ones_columns, bounds[:, np.newaxis]),
+                                            left, khiva_type)
+            profile[rows] = nearest if normalize else np.sqrt(np.maximum(nearest, 0))
+
+        if start > 0:
+            # The queries are the right neighbours of the earlier subsequences that are far enough.
+            nearest, nearest_index = _nearest(
+                distances.get_rows(0, start - 1).transpose(),
+                _integer_outer(np.arange(first, last)[:, np.newaxis], ones_earlier),
+                _integer_outer(ones_rows, np.arange(start)[:, np.newaxis] + exclusion_zone), False, khiva_type)
+            nearest = nearest if normalize else np.sqrt(np.maximum(nearest, 0))
+            better = nearest < right_profile[:start]
+            right_profile[:start] = np.where(better, nearest, right_profile[:start])
+            right_index[:start] = np.where(better, nearest_index, right_index[:start])
+
+    return left_profile, left_index, right_profile, right_index
+
+
+@cached
+def stomp_self_join(time_series, subsequence_length, left_right=False, exclusion_zone=None, normalize=True,
+                    epsilon=None):
     """ Stomp algorithm to calculate the matrix profile between `t` and itself using a subsequence length of `m`.
     This method filters the trivial matches.
 
@@ -213,8 +502,22 @@ def stomp_self_join(time_series, subsequence_length):
 
     :param time_series: The query and reference time series in KHIVA array format.
     :param subsequence_length: Lenght of the subsequence
-    :return: KHIVA arrays with the profile and index.
+    :param left_right: Whether the left (past-only) and right (future-only) profiles and indexes are also returned.
+                       Subsequences without neighbours in the past (or the future) have an infinite left (or right)
+                       distance and an index of -1, so these indexes are signed 32-bit integers. The index has the
+                       unsigned type of the native one.
+    :param exclusion_zone: Number of subsequences at each side of a subsequence that are considered trivial matches.
+                           None uses the default exclusion zone.
+    :param normalize: Whether the distance is the z-normalized or the non-normalized Euclidean distance.
+    :param epsilon: Subsequences whose standard deviation is lower than epsilon are considered constant. The
+                    z-normalized distance between two constant subsequences is 0, and sqrt(m) between a constant
+                    and a non-constant one. None disables the guard.
+    :return: KHIVA arrays with the profile and index, and the left and right profiles and indexes if requested.
+             When any of the optional parameters is used, the profile is computed by blocks with `mass`.
     """
+    if left_right or exclusion_zone is not None or not normalize or epsilon is not None:
+        return _self_join_by_blocks(time_series, subsequence_length, exclusion_zone, normalize, epsilon, left_right)
+
     profile = ctypes.c_void_p(0)
     index = ctypes.c_void_p(0)
 
@@ -232,6 +535,148 @@ def stomp_self_join(time_series, subsequence_length):
     return MatrixProfileResult(profile=Array(profile), index=Array(index))
 
 
+def _self_join_by_blocks(time_series, subsequence_length, exclusion_zone, normalize, epsilon, left_right):
+    """ Computes the matrix profile of every time series in a KHIVA array by blocks of queries.
+
+    :param time_series: KHIVA array whose first dimension is the length of the time series and the second dimension
+                        is the number of time series.
+    :param subsequence_length: Length of the subsequence.
+    :param exclusion_zone: Number of subsequences at each side of a subsequence that are considered trivial matches,
+                           or None for the default exclusion zone.
+    :param normalize: Whether the distance is the z-normalized or the non-normalized Euclidean distance.
+    :param epsilon: Standard deviation below which subsequences are considered constant, or None.
+    :param left_right: Whether the left and right profiles and indexes are also returned.
+    :return: LeftRightMatrixProfileResult or MatrixProfileResult with KHIVA arrays.
+    """
+    if exclusion_zone is None:
+        exclusion_zone = _default_exclusion_zone(subsequence_length)
+    khiva_type = dtype.f64 if time_series.khiva_type == dtype.f64 else dtype.f32
+    host = time_series.to_numpy().astype(np.float64)
+    left_profile, left_index, right_profile, right_index = zip(
+        *[_left_right_self_join(series, subsequence_length, exclusion_zone, khiva_type, normalize, epsilon)
+          for series in host.reshape(-1, host.shape[-1])])
+    left_profile, left_index = np.array(left_profile), np.array(left_index)
+    right_profile, right_index = np.array(right_profile), np.array(right_index)
+    from_left = left_profile <= right_profile
+    profile = np.where(from_left, left_profile, right_profile)
+    # The index has the unsigned type of the native one. The left and right indexes are signed to hold -1.
+    index = np.maximum(np.where(from_left, left_index, right_index), 0)
+
+    if not left_right:
+        return MatrixProfileResult(profile=Array.from_numpy(profile, khiva_type),
+                                   index=Array.from_numpy(index, dtype.u32))
+    return LeftRightMatrixProfileResult(profile=Array.from_numpy(profile, khiva_type),
+                                        index=Array.from_numpy(index, dtype.u32),
+                                        left_profile=Array.from_numpy(left_profile, khiva_type),
+                                        left_index=Array.from_numpy(left_index, dtype.s32),
+                                        right_profile=Array.from_numpy(right_profile, khiva_type),
+                                        right_index=Array.from_numpy(right_index, dtype.s32))
+
+
+def mstamp(time_series, subsequence_length, epsilon=None):
+    """ mSTAMP algorithm to calculate the multidimensional matrix profile between `t` and itself using a subsequence
+    length of `m`, where every time series of `t` is a dimension (channel) of the same multidimensional time series.
+    This method filters the trivial matches.
+
+    The distance profiles of every dimension are computed once by blocks of queries with `mass`, sorted across
+    dimensions and averaged, so that a single pass provides the matrix profile of every number of dimensions. The
+    blocks are sorted and reduced in the device, and only the nearest neighbours are downloaded; the dimensions
+    sorted by their distance at the nearest neighbour are computed in the host from these neighbours.
+
+    [1] Chin-Chia Michael Yeh, Nickolas Kavantzas and Eamonn Keogh (2017). Matrix Profile VI: Meaningful
+    Multidimensional Motif Discovery. IEEE ICDM 2017.
+
+    :param time_series: KHIVA array whose first dimension is the length of the time series and the second dimension
+                        is the number of dimensions (channels).
+    :param subsequence_length: Length of the subsequence.
+    :param epsilon: Standard deviation below which subsequences are considered constant, as in `stomp_self_join`.
+                    None only considers constant the subsequences whose standard deviation is 0, so that a constant
+                    channel does not spread NaN distances to the profiles of every number of dimensions.
+    :return: KHIVA arrays with the profile, index and dimensions with the following topology:
+              - profile and index: 1st dimension corresponds to the subsequence index and 2nd dimension to the
+                number of dimensions k minus one. The value in position (i, k - 1) is the average distance over the
+                k best matching dimensions of the subsequence i to its nearest neighbour, and its index.
+              - dimensions: 1st dimension corresponds to the dimensions (channels) sorted by their distance at the
+                nearest neighbour, 2nd dimension to the subsequence index and 3rd dimension to the number of
+                dimensions k minus one. Only the first k channels contribute to the k-dimensional profile.
+    """
+    khiva_type = dtype.f64 if time_series.khiva_type == dtype.f64 else dtype.f32
+    host = time_series.to_numpy().astype(np.float64)
+    host = host.reshape(-1, host.shape[-1])
+    n_dimensions = host.shape[0]
+    n_subsequences = host.shape[1] - subsequence_length + 1
+    exclusion_zone = _default_exclusion_zone(subsequence_length)
+    references = [Array.from_numpy(channel, khiva_type) for channel in host]
+    block_length = max(1, _BLOCK_ELEMENTS // (n_dimensions * n_subsequences))
+
+    statistics = [_moving_statistics(channel, subsequence_length) for channel in host]
+    variable = [(stds >= epsilon if epsilon is not None else stds > 0).astype(np.float64) for _, stds in statistics]
+    profile = np.empty((n_dimensions, n_subsequences))
+    index = np.empty((n_dimensions, n_subsequences), dtype=np.int64)
+    dimensions = np.empty((n_dimensions, n_subsequences, n_dimensions), dtype=np.int64)
+    window = np.arange(subsequence_length)
+
+    for first, last in _tile_bounds(n_subsequences, block_length):
+        ones_rows, ones_columns = np.ones((last - first, 1)), np.ones((n_subsequences, 1))
+        positions = _integer_outer(np.arange(n_subsequences)[:, np.newaxis], ones_rows)
+        before = _integer_outer(ones_columns, np.arange(first, last)[:, np.newaxis] - exclusion_zone)
+        after = _integer_outer(ones_columns, np.arange(first, last)[:, np.newaxis] + exclusion_zone)
+        keep = (positions <= before).as_type(khiva_type) + (positions >= after).as_type(khiva_type)
+        excluded = ((positions > before).as_type(khiva_type) * (positions < after).as_type(khiva_type) *
+                    _outer(np.full((n_subsequences, 1), _EXCLUDED_DISTANCE), ones_rows, khiva_type))
+        block = []
+        for channel, reference in enumerate(references):
+            queries = Array.from_numpy(_subsequences(host[channel], first, last, subsequence_length), khiva_type)
+            with _bypass_cache():
+                distances = mass(queries, reference)
+            # 0 between two constant subsequences and sqrt(m) when exactly one of them is constant.
+            references_variable, queries_variable = variable[channel], variable[channel][first:last]
+            constant = _outer(references_variable[:, np.newaxis], queries_variable[:, np.newaxis], khiva_type)
+            distances = (distances ** constant) * constant + _outer(
+                np.column_stack([references_variable, ones_columns[:, 0], references_variable]),
+                np.sqrt(subsequence_length) * np.column_stack([ones_rows[:, 0], queries_variable,
+                                                               -2 * queries_variable]), khiva_type)
+            block.append((distances ** keep) * keep + excluded)
+
+        # Odd-even transposition sort of the distances across dimensions.
+        for sweep in range(n_dimensions):
+            for channel in range(sweep % 2, n_dimensions - 1, 2):
+                lower, upper = block[channel], block[channel + 1]
+                ordered = (lower <= upper).as_type(khiva_type)
+                swapped = (lower > upper).as_type(khiva_type)
+                block[channel] = lower * ordered + upper * swapped
+                block[channel + 1] = upper * ordered + lower * swapped
+
+        total = None
+        for k in range(n_dimensions):
+            total = block[k] if total is None else total + block[k]
+            minima, rows = _first_minimum(total, positions, khiva_type)
+            found = np.isfinite(minima) & (minima < _EXCLUDED_DISTANCE / 2)
+            profile[k, first:last] = np.where(found, minima / (k + 1), np.inf)
+            index[k, first:last] = np.where(found, rows, 0)
+
+            # Distance of every dimension at the nearest neighbour, to sort the dimensions.
+            nearest = index[k, first:last]
+            at_nearest = np.empty((n_dimensions, last - first))
+            for channel, (means, stds) in enumerate(statistics):
+                queries = _subsequences(host[channel], first, last, subsequence_length)
+                neighbours = host[channel][nearest[:, np.newaxis] + window]
+                both = variable[channel][first:last] * variable[channel][nearest]
+                either = np.maximum(variable[channel][first:last], variable[channel][nearest])
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    correlation = (((queries * neighbours).sum(axis=1) / subsequence_length -
+                                    means[first:last] * means[nearest]) / (stds[first:last] * stds[nearest]))
+                at_nearest[channel] = np.where(both > 0,
+                                               np.sqrt(np.maximum(2 * subsequence_length * (1 - correlation), 0)),
+                                               np.sqrt(subsequence_length) * either)
+            dimensions[k, first:last, :] = np.argsort(at_nearest, axis=0).T
+
+    return MultidimensionalMatrixProfileResult(profile=Array.from_numpy(profile, khiva_type),
+                                               index=Array.from_numpy(index, dtype.u32),
+                                               dimensions=Array.from_numpy(dimensions, dtype.u32))
+
+
+@cached
 def matrix_profile(first_time_series, second_time_series, subsequence_length):
     """ Calculate the matrix profile between `ta` and `tb` using a subsequence length of `m`.
 
@@ -265,7 +710,8 @@ def matrix_profile(first_time_series, second_time_series, subsequence_length):
     return MatrixProfileResult(profile=Array(profile), index=Array(index))
 
 
-def matrix_profile_self_join(time_series, subsequence_length):
+@cached
+def matrix_profile_self_join(time_series, subsequence_length, exclusion_zone=None, normalize=True, epsilon=None):
     """ Calculate the matrix profile between `t` and itself using a subsequence length of `m`.
     This method filters the trivial matches.
 
@@ -275,8 +721,16 @@ def matrix_profile_self_join(time_series, subsequence_length):
 
     :param time_series: The query and reference time series in KHIVA array format.
     :param subsequence_length: Lenght of the subsequence
-    :return: KHIVA arrays with the profile and index.
+    :param exclusion_zone: Number of subsequences at each side of a subsequence that are considered trivial matches.
+                           None uses the default exclusion zone.
+    :param normalize: Whether the distance is the z-normalized or the non-normalized Euclidean distance.
+    :param epsilon: Standard deviation below which subsequences are considered constant, as in `stomp_self_join`.
+    :return: KHIVA arrays with the profile and index. When any of the optional parameters is used, the profile is
+             computed by blocks with `mass`.
     """
+    if exclusion_zone is not None or not normalize or epsilon is not None:
+        return _self_join_by_blocks(time_series, subsequence_length, exclusion_zone, normalize, epsilon, False)
+
     profile = ctypes.c_void_p(0)
     index = ctypes.c_void_p(0)
 
@@ -296,7 +750,7 @@ def matrix_profile_self_join(time_series, subsequence_length):
     return MatrixProfileResult(profile=Array(profile), index=Array(index))
 
 
-def get_chains(time_series, subsequence_length):
+def get_chains(time_series, subsequence_length, compact=False):
     """ Calculate all the chains within `tss` using a subsequence length of `m`.
 
      [1] Yan Zhu, Makoto Imamura, Daniel Nikovski, and Eamonn Keogh. Matrix Profile VII: Time Series Chains: A New
@@ -304,7 +758,8 @@ def get_chains(time_series, subsequence_length):
 
      :param time_series: Time series to compute the chains within them.
      :param subsequence_length: Subsequence length.
-     :return: The calculated chains in a KHIVA array with the following topology:
+     :param compact: Whether only the populated chain entries are downloaded and returned.
+     :return: If compact is False, the calculated chains in a KHIVA array with the following topology:
           - 1st dimension corresponds to the chains indexes flattened.
           - 2nd dimension:
             - [0] corresponds to all the indexes in the chains flattened
@@ -314,6 +769,10 @@ def get_chains(time_series, subsequence_length):
           Notice that the size of the first dimension is the maximum possible size which is n - m + 1. If the number of
           values belonging to a chain is lower than the maximum, the remaining values and indexes are 0. It implies
           that 0 is an invalid chain index.
+
+          If compact is True, numpy arrays with the indexes of all the chains flattened, the offsets where every chain
+          starts in the indexes (chain c is indexes[offsets[c]:offsets[c + 1]]) and the time series every chain
+          belongs to.
     """
     c = ctypes.c_void_p(0)
 
@@ -328,4 +787,705 @@ def get_chains(time_series, subsequence_length):
     if error_code.value != 0:
         raise Exception(str(error_message.value.decode()))
 
-    return Array(array_reference=c)
+    chains = Array(array_reference=c)
+    if not compact:
+        return chains
+    return _compact_chains(chains)
+
+
+def _compact_chains(chains):
+    """ Downloads only the populated entries of the chains returned by the library. The populated entries are at the
+    beginning of the first dimension, so they are counted in the device and the rest are never downloaded.
+
+    :param chains: KHIVA array with the chains, as returned by `get_chains`.
+    :return: ChainsResult with numpy arrays.
+    """
+    n_rows = int(chains.dims[0])
+    populated = n_rows - value_count(chains.get_col(1), 0).to_numpy().astype(np.int64).ravel()
+    n_populated = int(populated.max())
+    if n_populated == 0:
+        return ChainsResult(indexes=np.array([], dtype=np.int64), offsets=np.zeros(1, dtype=np.int64),
+                            series=np.array([], dtype=np.int64))
+
+    host = chains.get_rows(0, n_populated - 1).to_numpy().astype(np.int64).reshape(-1, 2, n_populated)
+    indexes, offsets, series = [], [0], []
+    for ts, count in enumerate(populated):
+        if count == 0:
+            continue
+        chain_ids = host[ts, 1, :count]
+        order = np.argsort(chain_ids, kind="mergesort")
+        starts = np.flatnonzero(np.diff(chain_ids[order])) + 1
+        indexes.append(host[ts, 0, :count][order])
+        offsets.extend(offsets[-1] + np.append(starts, count))
+        series.extend([ts] * (len(starts) + 1))
+
+    return ChainsResult(indexes=np.concatenate(indexes), offsets=np.array(offsets, dtype=np.int64),
+                        series=np.array(series, dtype=np.int64))
+
+
+def iter_chains(time_series, subsequence_length):
+    """ Iterates over all the chains within `tss` using a subsequence length of `m`, downloading only the populated
+    chain entries.
+
+     [1] Yan Zhu, Makoto Imamura, Daniel Nikovski, and Eamonn Keogh. Matrix Profile VII: Time Series Chains: A New
+     Primitive for Time Series Data Mining. IEEE ICDM 2017
+
+    :param time_series: Time series to compute the chains within them.
+    :param subsequence_length: Subsequence length.
+    :return: Generator of tuples with the time series and the numpy array with the indexes of every chain.
+    """
+    indexes, offsets, series = get_chains(time_series, subsequence_length, compact=True)
+    for chain, ts in enumerate(series):
+        yield ts, indexes[offsets[chain]:offsets[chain + 1]]
+
+
+def _host_time_series(time_series):
+    """ Flattened float64 numpy copy of a time series.
+
+    :param time_series: KHIVA array or numpy array with one time series.
+    :return: Numpy array with the time series.
+    """
+    if isinstance(time_series, Array):
+        time_series = time_series.to_numpy()
+    return np.asarray(time_series, dtype=np.float64).ravel()
+
+
+def _hash_time_series(time_series, chunk_length=1 << 22):
+    """ Hash of the contents of a time series, computed by chunks to avoid copying it at once.
+
+    :param time_series: Numpy array with one time series.
+    :param chunk_length: Number of points hashed at a time.
+    :return: Hexadecimal digest.
+    """
+    digest = hashlib.sha1()
+    for first in range(0, len(time_series), chunk_length):
+        digest.update(np.ascontiguousarray(time_series[first:first + chunk_length], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def update_matrix_profile_self_join(path, time_series, exclusion_zone=None, khiva_type=dtype.f32):
+    """ Continues the computation of a matrix profile saved with `MatrixProfileResult.save` after new points have been
+    appended to the time series. Only the pairs of subsequences involving at least one new subsequence are joined,
+    and the updated matrix profile is saved again in the same directory. This method filters the trivial matches.
+
+    :param path: Directory where the matrix profile was saved.
+    :param time_series: KHIVA array or numpy array with the whole time series, whose beginning must be the time
+                        series used to calculate the saved matrix profile.
+    :param exclusion_zone: Number of subsequences at each side of a subsequence that are considered trivial matches.
+                           None uses the exclusion zone of the saved matrix profile, and any other value must be
+                           equal to it.
+    :param khiva_type: KHIVA type used to upload the time series.
+    :return: Numpy arrays with the updated profile and index.
+    """
+    stored = MatrixProfileResult.load(path, mmap_mode=None)
+    time_series = _host_time_series(time_series)
+    if len(time_series) < stored.offset or _hash_time_series(time_series[:stored.offset]) != stored.source_hash:
+        raise ValueError("The time series does not start with the time series of the saved matrix profile")
+    if exclusion_zone is None:
+        exclusion_zone = stored.exclusion_zone
+    elif exclusion_zone != stored.exclusion_zone:
+        raise ValueError("The exclusion zone {} differs from the exclusion zone {} of the saved matrix profile".format(
+            exclusion_zone, stored.exclusion_zone))
+
+    m = stored.subsequence_length
+    start = stored.offset - m + 1
+    n_subsequences = len(time_series) - m + 1
+    profile = np.full(n_subsequences, np.inf)
+    index = np.full(n_subsequences, -1, dtype=np.int64)
+    profile[:start] = stored.profile.ravel()
+    index[:start] = stored.index.ravel()
+
+    if n_subsequences > start:
+        left_profile, left_index, right_profile, right_index = _left_right_self_join(
+            time_series, m, exclusion_zone, khiva_type, stored.normalize, start=start)
+        for new_profile, new_index in ((left_profile, left_index), (right_profile, right_index)):
+            better = new_profile < profile
+            profile[better] = new_profile[better]
+            index[better] = new_index[better]
+
+    result = MatrixProfileResult(profile=profile, index=index)
+    result.save(path, m, time_series, exclusion_zone, stored.normalize)
+    return result
+
+
+def _tile_bounds(n_subsequences, tile_length):
+    """ Splits the subsequences of a time series in consecutive tiles.
+
+    :param n_subsequences: Number of subsequences of the time series.
+    :param tile_length: Number of subsequences per tile.
+    :return: List with the first and the last (excluded) subsequence of every tile.
+    """
+    return [(start, min(start + tile_length, n_subsequences)) for start in range(0, n_subsequences, tile_length)]
+
+
+def _self_join_tile(task):
+    """ Computes the matrix profile of one tile of the distance matrix with the KHIVA kernels.
+
+    :param task: Tuple with the query offset, the query segment, the reference offset, the reference segment, the
+                 subsequence length and the KHIVA type. When the reference segment is None, the query segment is
+                 joined with itself, filtering the trivial matches.
+    :return: Tuple with the query offset, the tile profile and the tile index referred to the whole time series.
+    """
+    query_offset, query, reference_offset, reference, subsequence_length, khiva_type = task
+    query_array = Array.from_numpy(query, khiva_type)
+    with _bypass_cache():
+        if reference is None:
+            profile, index = matrix_profile_self_join(query_array, subsequence_length)
+        else:
+            profile, index = matrix_profile(Array.from_numpy(reference, khiva_type), query_array, subsequence_length)
+    return query_offset, profile.to_numpy().flatten(), index.to_numpy().flatten().astype(np.int64) + reference_offset
+
+
+def matrix_profile_self_join_tiled(time_series, subsequence_length, tile_length, n_jobs=1, spill_directory=None,
+                                   khiva_type=dtype.f32):
+    """ Calculate the matrix profile between `t` and itself using a subsequence length of `m`, splitting the distance
+    matrix in tiles so that only two tiles of the time series are in the device at a time. This method filters the
+    trivial matches.
+
+    The tiles of every pair of consecutive chunks of the time series are joined with `matrix_profile_self_join`, so
+    that the trivial matches are filtered by the library, and the rest of the tiles are joined with `matrix_profile`.
+    The partial results are merged with an element-wise minimum.
+
+    [1] Yan Zhu, Zachary Zimmerman, Nader Shakibay Senobari, Chin-Chia Michael Yeh, Gareth Funning, Abdullah Mueen,
+    Philip Brisk and Eamonn Keogh (2016). Matrix Profile II: Exploiting a Novel Algorithm and GPUs to break the one
+    Hundred Million Barrier for Time Series Motifs and Joins. IEEE ICDM 2016.
+
+    :param time_series: Numpy array (it can be a numpy.memmap) or KHIVA array with one time series.
+    :param subsequence_length: Length of the subsequence.
+    :param tile_length: Number of subsequences per tile. It must be greater or equal than the subsequence length.
+    :param n_jobs: Number of worker processes computing tiles. With 1, the tiles are computed in this process.
+    :param spill_directory: Directory where the profile and the index are kept as memory-mapped `profile.npy` and
+                            `index.npy` files instead of in memory.
+    :param khiva_type: KHIVA type used to upload the tiles to the device.
+    :return: Numpy arrays with the profile and index.
+    """
+    if isinstance(time_series, Array):
+        time_series = time_series.to_numpy()
+    time_series = np.asarray(time_series).ravel()
+    if tile_length < subsequence_length:
+        raise ValueError("tile_length must be greater or equal than subsequence_length")
+
+    n_subsequences = len(time_series) - subsequence_length + 1
+    tiles = _tile_bounds(n_subsequences, tile_length)
+
+    def tasks():
+        for i in range(max(len(tiles) - 1, 1)):
+            first, last = tiles[i][0], tiles[min(i + 1, len(tiles) - 1)][1]
+            yield (first, time_series[first:last + subsequence_length - 1], first, None, subsequence_length, khiva_type)
+        for i, (query_first, query_last) in enumerate(tiles):
+            for j, (reference_first, reference_last) in enumerate(tiles):
+                if abs(i - j) > 1:
+                    yield (query_first, time_series[query_first:query_last + subsequence_length - 1],
+                           reference_first, time_series[reference_first:reference_last + subsequence_length - 1],
+                           subsequence_length, khiva_type)
+
+    if spill_directory is None:
+        profile = np.full(n_subsequences, np.inf)
+        index = np.zeros(n_subsequences, dtype=np.int64)
+    else:
+        profile = np.lib.format.open_memmap(os.path.join(spill_directory, "profile.npy"), mode="w+",
+                                            dtype=np.float64, shape=(n_subsequences,))
+        index = np.lib.format.open_memmap(os.path.join(spill_directory, "index.npy"), mode="w+",
+                                          dtype=np.int64, shape=(n_subsequences,))
+        profile[:] = np.inf
+
+    def merge(results):
+        for offset, tile_profile, tile_index in results:
+            current = profile[offset:offset + len(tile_profile)]
+            better = tile_profile < current
+            current[better] = tile_profile[better]
+            index[offset:offset + len(tile_profile)][better] = tile_index[better]
+
+    if n_jobs == 1:
+        merge(_self_join_tile(task) for task in tasks())
+    else:
+        pool = _worker_pool(n_jobs)
+        try:
+            merge(pool.imap_unordered(_self_join_tile, tasks()))
+        finally:
+            pool.close()
+            pool.join()
+
+    if spill_directory is not None:
+        profile.flush()
+        index.flush()
+
+    return MatrixProfileResult(profile=profile, index=index)
+
+
+def _coarse_to_fine_order(n):
+    """ Orders the positions of a sorted list so that its extremes come first, followed by successive midpoints.
+
+    :param n: Length of the list.
+    :return: List with the positions of the list in coarse to fine order.
+    """
+    order = list(range(min(n, 2)))
+    if n > 1:
+        order[1] = n - 1
+    pending = deque([(0, n - 1)])
+    while pending:
+        low, high = pending.popleft()
+        if high - low > 1:
+            middle = (low + high) // 2
+            order.append(middle)
+            pending.extend([(low, middle), (middle, high)])
+    return order
+
+
+def iter_pan_matrix_profile(time_series, subsequence_lengths, coarse_to_fine=True, khiva_type=dtype.f32):
+    """ Calculate the matrix profile between `t` and itself for a range of subsequence lengths, yielding every
+    profile as soon as it is available. This method filters the trivial matches.
+
+    This is a convenience loop over `matrix_profile_self_join`: no work is shared across lengths apart from the
+    upload of the time series, and the order only decides which profiles are available first, e.g. to show a coarse
+    view of all the lengths early.
+
+    [1] Frank Madrid, Shima Imani, Ryan Mercer, Zachary Zimmerman, Nader Shakibay and Eamonn Keogh (2019). Matrix
+    Profile XX: Finding and Visualizing Time Series Motifs of All Lengths using the Matrix Profile. IEEE ICBK 2019.
+
+    :param time_series: The query and reference time series in KHIVA array or numpy array format.
+    :param subsequence_lengths: Iterable with the subsequence lengths.
+    :param coarse_to_fine: Whether the lengths are computed starting with the shortest and the longest ones and
+                           bisecting the range afterwards, or in ascending order.
+    :param khiva_type: KHIVA type used to upload the time series when it is a numpy array.
+    :return: Generator of tuples with the subsequence length and the KHIVA arrays with the profile and index.
+    """
+    if not isinstance(time_series, Array):
+        time_series = Array.from_numpy(np.asarray(time_series), khiva_type)
+    lengths = sorted(set(subsequence_lengths))
+    order = _coarse_to_fine_order(len(lengths)) if coarse_to_fine else range(len(lengths))
+    for position in order:
+        yield lengths[position], matrix_profile_self_join(time_series, lengths[position])
+
+
+def _padding_rows(value, n_rows, n_ts, khiva_type):
+    """ Uploads a constant block to pad the profiles of a set of time series.
+
+    :param value: Value of the block.
+    :param n_rows: Size of the 1st dimension of the block.
+    :param n_ts: Size of the 2nd dimension of the block, i.e. the number of time series.
+    :param khiva_type: KHIVA type of the block.
+    :return: KHIVA array with dimensions [n_rows, n_ts].
+    """
+    if n_rows == 1 and n_ts > 1:
+        # A numpy column is uploaded as a 1-dimensional array, so the row is uploaded and transposed instead.
+        return Array.from_numpy(np.full((1, n_ts), value), khiva_type).transpose()
+    return Array.from_numpy(np.full((n_ts, n_rows), value), khiva_type)
+
+
+def pan_matrix_profile(time_series, subsequence_lengths, khiva_type=dtype.f32):
+    """ Calculate the matrix profile between `t` and itself for a range of subsequence lengths. The time series is
+    uploaded to the device only once and the profiles are stacked in the device. This method filters the trivial
+    matches.
+
+    Every length is computed with an independent call to `matrix_profile_self_join` (see `iter_pan_matrix_profile`),
+    so the sliding statistics and FFTs of the time series are recomputed for every length.
+
+    [1] Frank Madrid, Shima Imani, Ryan Mercer, Zachary Zimmerman, Nader Shakibay and Eamonn Keogh (2019). Matrix
+    Profile XX: Finding and Visualizing Time Series Motifs of All Lengths using the Matrix Profile. IEEE ICBK 2019.
+
+    :param time_series: The query and reference time series in KHIVA array or numpy array format.
+    :param subsequence_lengths: Iterable with the subsequence lengths. It must not be empty.
+    :param khiva_type: KHIVA type used to upload the time series when it is a numpy array.
+    :return: KHIVA arrays with the profiles and indexes, and the sorted subsequence lengths. The arrays have the
+             following topology:
+                - 1st dimension corresponds to the subsequence index. Its size is n - m + 1 for the shortest length;
+                  the profiles of longer lengths are padded with infinity and their indexes with 0.
+                - 2nd dimension corresponds to the number of time series.
+                - 3rd dimension corresponds to the subsequence length.
+    """
+    results = dict(iter_pan_matrix_profile(time_series, subsequence_lengths, False, khiva_type))
+    lengths = sorted(results)
+    if not lengths:
+        raise ValueError("At least one subsequence length is required")
+    n_rows = results[lengths[0]].profile.dims[0]
+
+    profiles = None
+    indexes = None
+    for length in lengths:
+        profile, index = results.pop(length)
+        padding = n_rows - profile.dims[0]
+        if padding > 0:
+            n_ts = int(profile.dims[1])
+            profile = profile.join(0, _padding_rows(np.inf, padding, n_ts, profile.khiva_type))
+            index = index.join(0, _padding_rows(0, padding, n_ts, index.khiva_type))
+        profiles = profile if profiles is None else profiles.join(2, profile)
+        indexes = index if indexes is None else indexes.join(2, index)
+
+    return PanMatrixProfileResult(profile=profiles, index=indexes, subsequence_lengths=lengths)
+
+
+class MassIndex(object):
+    """ Similarity search index over a set of reference time series of the same length. For every query length, the
+    means and standard deviations of the reference subsequences are computed once, and the matrix of their centered
+    subsequences is uploaded to the device once and kept there. A batch of queries is then answered with one matrix
+    product per time series, which gives the dot products of every query with every subsequence, and the stored
+    statistics turn them into the z-normalized Euclidean distances of `mass`:
+    d^2 = 2 m - 2 QT / (std_q std_t).
+
+    As with the `epsilon` guard of `stomp_self_join`, the distance between two constant subsequences is 0, and
+    sqrt(m) between a constant and a non-constant one. Notice that the subsequence matrices take m times the memory
+    of the time series in the device.
+    """
+
+    def __init__(self, time_series, khiva_type=dtype.f32):
+        """ Creates the index.
+
+        :param time_series: KHIVA array whose first dimension is the length of the time series and the second
+                            dimension is the number of time series, or a numpy array with one time series per row.
+        :param khiva_type: KHIVA type used to upload the subsequences and the queries.
+        """
+        if isinstance(time_series, Array):
+            dims = time_series.get_dims()
+            time_series = time_series.to_numpy().astype(np.float64).reshape(int(dims[1]), int(dims[0]))
+        self.time_series = np.atleast_2d(np.asarray(time_series, dtype=np.float64))
+        self.khiva_type = khiva_type
+        self._subsequences = {}
+
+    def _prepare(self, subsequence_length):
+        """ Uploads the centered subsequences of every time series for a query length, the first time it is used.
+
+        :param subsequence_length: Length of the queries.
+        :return: List with, for every time series, the KHIVA array with its centered subsequences (dimension zero is
+                 the subsequence length and dimension one the subsequence index), and numpy arrays with the
+                 inverse of the standard deviations (0 for constant subsequences) and whether they are not constant.
+        """
+        if subsequence_length not in self._subsequences:
+            prepared = []
+            for series in self.time_series:
+                means, stds = _moving_statistics(series, subsequence_length)
+                subsequences = _subsequences(series, 0, len(means), subsequence_length) - means[:, np.newaxis]
+                variable = stds > 0
+                prepared.append((Array.from_numpy(subsequences, self.khiva_type),
+                                 np.where(variable, 1 / np.where(variable, stds, 1), 0), variable.astype(np.float64)))
+            self._subsequences[subsequence_length] = prepared
+        return self._subsequences[subsequence_length]
+
+    @staticmethod
+    def _host_queries(queries):
+        """ Numpy matrix with a batch of queries.
+
+        :param queries: KHIVA array, numpy array with one query per row, or list of queries of the same length.
+        :return: Numpy array with one query per row.
+        """
+        if isinstance(queries, Array):
+            dims = queries.get_dims()
+            return queries.to_numpy().astype(np.float64).reshape(int(dims[1]), int(dims[0]))
+        if isinstance(queries, list) and any(np.ndim(q) > 0 for q in queries) and \
+                len(set(len(q) for q in queries)) > 1:
+            raise ValueError("All the queries of a batch must have the same length")
+        return np.atleast_2d(np.asarray(queries, dtype=np.float64))
+
+    def query(self, queries):
+        """ Mueen's Algorithm for Similarity Search of the queries against the indexed time series.
+
+        :param queries: KHIVA array, numpy array with one query per row, or list of queries of the same length.
+        :return: KHIVA array with the distances, with the same topology as `mass`.
+        """
+        queries = self._host_queries(queries)
+        m = queries.shape[1]
+        if m > self.time_series.shape[1]:
+            raise ValueError("The queries cannot be longer than the indexed time series")
+        means, stds = queries.mean(axis=1), queries.std(axis=1)
+        variable = stds > 0
+        inverse = np.where(variable, 1 / np.where(variable, stds, 1), 0)
+        centered = Array.from_numpy(queries - means[:, np.newaxis], self.khiva_type)
+        ones_queries = np.ones(len(queries))
+
+        result = None
+        for subsequences, reference_inverse, reference_variable in self._prepare(m):
+            ones_subsequences = np.ones(len(reference_inverse))
+            products = subsequences.transpose().matmul(centered)
+            distances = _outer(np.column_stack([m * reference_variable, ones_subsequences]),
+                               np.column_stack([ones_queries, m * variable]), self.khiva_type) - \
+                products * _outer(2 * reference_inverse[:, np.newaxis], inverse[:, np.newaxis], self.khiva_type)
+            positive = (distances > _outer(np.zeros((len(ones_subsequences), 1)), ones_queries[:, np.newaxis],
+                                           self.khiva_type)).as_type(self.khiva_type)
+            distances = (distances * positive) ** _outer(np.full((len(ones_subsequences), 1), 0.5),
+                                                         ones_queries[:, np.newaxis], self.khiva_type)
+            result = distances if result is None else result.join(2, distances)
+        return result
+
+    def best_n(self, queries, n):
+        """ Calculates the N best matches of the queries in the indexed time series.
+
+        :param queries: KHIVA array, numpy array with one query per row, or list of queries of the same length.
+        :param n: Number of matches to return.
+        :return: KHIVA arrays with the distances and indexes, with the same topology as `find_best_n_occurrences`.
+        """
+        queries = self._host_queries(queries)
+        n_subsequences = self.time_series.shape[1] - queries.shape[1] + 1
+        if not 1 <= n <= n_subsequences:
+            raise ValueError("n must be between 1 and the number of subsequences")
+        distances = self.query(queries).to_numpy().reshape(len(self.time_series), len(queries), n_subsequences)
+        indexes = np.argsort(distances, axis=2, kind="mergesort")[:, :, :n]
+        return BestNResultOcurrences(distances=Array.from_numpy(np.take_along_axis(distances, indexes, axis=2),
+                                                                self.khiva_type),
+                                     indexes=Array.from_numpy(indexes, dtype.u32))
+
+
+SubsequenceSearchResult = namedtuple("SubsequenceSearchResult", ["distances", "series", "indexes", "candidates"])
+
+_SYMBOL_BITS = 8
+
+
+class SubsequenceIndex(object):
+    """ iSAX-style similarity search index over the subsequences of a set of time series. Every z-normalized
+    subsequence is summarized with `dimensionality.paa` and the summaries are discretized with SAX symbols of
+    increasing cardinality, building a binary tree whose nodes bound the summaries of their subsequences. Queries
+    traverse the tree best-first, pruning the nodes and subsequences whose PAA lower bound of the z-normalized
+    Euclidean distance cannot improve the current matches, so only a small fraction of the subsequences is compared.
+
+    [1] Jin Shieh and Eamonn Keogh (2008). iSAX: Indexing and Mining Terabyte Sized Time Series. ACM SIGKDD 2008.
+
+    The SAX breakpoints are the quantiles of the summaries of the indexed subsequences, which keeps the tree balanced
+    and the lower bound valid for any distribution of the data.
+    """
+
+    def __init__(self, time_series, subsequence_length, word_length=8, leaf_size=256, khiva_type=dtype.f32):
+        """ Builds the index.
+
+        :param time_series: KHIVA array whose first dimension is the length of the time series and the second
+                            dimension is the number of time series, numpy array with one time series per row, or list
+                            of time series with different lengths.
+        :param subsequence_length: Length of the subsequences. It must be a multiple of `word_length`.
+        :param word_length: Number of PAA segments of every subsequence.
+        :param leaf_size: Maximum number of subsequences of a leaf of the tree.
+        :param khiva_type: KHIVA type used to calculate the summaries in the device.
+        """
+        if subsequence_length % word_length != 0:
+            raise ValueError("The subsequence length must be a multiple of the word length")
+        if leaf_size < 1:
+            raise ValueError("The leaf size must be positive")
+        series = _series_list(time_series)
+        if any(len(ts) < subsequence_length for ts in series):
+            raise ValueError("All the time series must be at least as long as the subsequence length")
+
+        self.subsequence_length = subsequence_length
+        self.word_length = word_length
+        self.leaf_size = leaf_size
+        self.data = np.concatenate(series)
+        self.series_starts = np.cumsum([0] + [len(ts) for ts in series[:-1]]).astype(np.int64)
+        self.offsets = np.cumsum([0] + [len(ts) - subsequence_length + 1 for ts in series]).astype(np.int64)
+        statistics = [_moving_statistics(ts, subsequence_length) for ts in series]
+        self.means = np.concatenate([means for means, _ in statistics])
+        self.stds = np.concatenate([stds for _, stds in statistics])
+
+        n_subsequences = self.offsets[-1]
+        self.summaries = np.empty((n_subsequences, word_length))
+        for first, last in _tile_bounds(n_subsequences, max(1, _BLOCK_ELEMENTS // subsequence_length)):
+            windows = self._normalized_subsequences(np.arange(first, last))
+            self.summaries[first:last] = paa(Array.from_numpy(windows, khiva_type), word_length).to_numpy().reshape(
+                last - first, word_length)
+
+        n_symbols = 1 << _SYMBOL_BITS
+        self.breakpoints = np.concatenate(
+            [[-np.inf], np.quantile(self.summaries, np.arange(1, n_symbols) / float(n_symbols)), [np.inf]])
+        self._build(np.searchsorted(self.breakpoints[1:-1], self.summaries, side="right"))
+
+    def _build(self, symbols):
+        """ Builds the tree. The subsequences of every leaf are consecutive in `order`, and every node keeps the
+        bounds of the summaries of its subsequences.
+
+        :param symbols: Numpy array with the symbols of maximum cardinality of every subsequence.
+        """
+        self.order = np.arange(len(symbols), dtype=np.int64)
+        lower, upper, children, ranges = [], [], [], []
+        pending = [(-1, 0, len(symbols), np.zeros(self.word_length, dtype=np.int64))]
+        while pending:
+            parent, start, end, bits = pending.pop()
+            members = self.order[start:end]
+            split = None
+            while end - start > self.leaf_size and split is None:
+                refinable = np.flatnonzero(bits < _SYMBOL_BITS)
+                if len(refinable) == 0:
+                    break
+                next_bits = (symbols[members[:, None], refinable] >> (_SYMBOL_BITS - bits[refinable] - 1)) & 1
+                balance = np.abs(next_bits.mean(axis=0) - 0.5)
+                segment = refinable[np.argmin(balance)]
+                if balance.min() < 0.5:
+                    split = segment
+                else:
+                    bits[segment] += 1
+
+            node = len(ranges)
+            if parent >= 0:
+                children[parent][int(children[parent][0] >= 0)] = node
+            width = np.left_shift(1, _SYMBOL_BITS - bits)
+            first_symbol = (symbols[members[0]] // width) * width if len(members) else np.zeros_like(width)
+            lower.append(self.breakpoints[first_symbol])
+            upper.append(self.breakpoints[first_symbol + width])
+            children.append([-1, -1])
+            ranges.append([start, end])
+
+            if split is not None:
+                bits[split] += 1
+                high = ((symbols[members, split] >> (_SYMBOL_BITS - bits[split])) & 1).astype(bool)
+                self.order[start:end] = np.concatenate([members[~high], members[high]])
+                middle = start + np.count_nonzero(~high)
+                pending.append((node, middle, end, bits.copy()))
+                pending.append((node, start, middle, bits.copy()))
+
+        self.node_lower = np.array(lower)
+        self.node_upper = np.array(upper)
+        self.node_children = np.array(children, dtype=np.int64)
+        self.node_ranges = np.array(ranges, dtype=np.int64)
+
+    def _normalized_subsequences(self, subsequences):
+        """ Z-normalized subsequences. Constant subsequences are normalized to zero.
+
+        :param subsequences: Numpy array with the identifiers of the subsequences.
+        :return: Numpy array with one z-normalized subsequence per row.
+        """
+        series = np.searchsorted(self.offsets, subsequences, side="right") - 1
+        starts = self.series_starts[series] + subsequences - self.offsets[series]
+        windows = self.data[starts[:, None] + np.arange(self.subsequence_length)]
+        stds = self.stds[subsequences]
+        stds = np.where(stds > 0, stds, np.inf)
+        return (windows - self.means[subsequences, None]) / stds[:, None]
+
+    def _lower_bounds(self, summary, lower, upper):
+        """ PAA lower bounds of the z-normalized Euclidean distance between a query and the subsequences whose
+        summaries are within the given bounds.
+
+        :param summary: Numpy array with the PAA summary of the query.
+        :param lower: Numpy array with the lower bounds of the summaries, one row per node or subsequence.
+        :param upper: Numpy array with the upper bounds of the summaries, one row per node or subsequence.
+        :return: Numpy array with the lower bounds.
+        """
+        gaps = np.maximum(np.maximum(lower - summary, summary - upper), 0)
+        bounds = np.sqrt(self.subsequence_length / float(self.word_length) * np.sum(gaps * gaps, axis=-1))
+        return bounds - np.sqrt(self.subsequence_length) * 1e-5
+
+    def _search(self, query, k, max_leaves):
+        """ Best-first search of the k nearest subsequences of one query.
+
+        :param query: Numpy array with the z-normalized query.
+        :param k: Number of nearest subsequences.
+        :param max_leaves: Maximum number of leaves visited, or None for an exact search.
+        :return: Numpy arrays with the distances and the identifiers of the nearest subsequences, and the number of
+                 subsequences compared.
+        """
+        summary = query.reshape(self.word_length, -1).mean(axis=1)
+        best_distances = np.empty(0)
+        best = np.empty(0, dtype=np.int64)
+        candidates = 0
+        visited = 0
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            threshold = best_distances[-1] if len(best) == k else np.inf
+            if bound >= threshold:
+                break
+            left, right = self.node_children[node]
+            if left < 0:
+                if max_leaves is not None and visited >= max_leaves:
+                    break
+                visited += 1
+                start, end = self.node_ranges[node]
+                members = np.asarray(self.order[start:end])
+                summaries = self.summaries[members]
+                members = members[self._lower_bounds(summary, summaries, summaries) < threshold]
+                if len(members) == 0:
+                    continue
+                candidates += len(members)
+                differences = self._normalized_subsequences(members) - query
+                distances = np.sqrt(np.sum(differences * differences, axis=1))
+                best_distances = np.concatenate([best_distances, distances])
+                best = np.concatenate([best, members])
+                nearest = np.argsort(best_distances, kind="mergesort")[:k]
+                best_distances, best = best_distances[nearest], best[nearest]
+            else:
+                children = np.array([left, right])
+                bounds = self._lower_bounds(summary, self.node_lower[children], self.node_upper[children])
+                for child_bound, child in zip(bounds, children):
+                    if child_bound < threshold:
+                        heapq.heappush(heap, (max(float(child_bound), bound), int(child)))
+        return best_distances, best, candidates
+
+    def query(self, queries, k=1, max_leaves=None):
+        """ Finds the k subsequences nearest to every query, in z-normalized Euclidean distance.
+
+        :param queries: KHIVA array, numpy array with one query per row, or list of queries of the subsequence
+                        length.
+        :param k: Number of nearest subsequences.
+        :param max_leaves: Maximum number of leaves visited per query. None finds the exact nearest subsequences,
+                           while a budget returns approximate ones after visiting the most promising leaves.
+        :return: SubsequenceSearchResult with numpy arrays with the distances, the time series and the indexes of
+                 the nearest subsequences of every query, one row per query, and the number of subsequences compared
+                 for every query.
+        """
+        if isinstance(queries, Array):
+            queries = queries.to_numpy()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        if queries.shape[1] != self.subsequence_length:
+            raise ValueError("The length of the queries must be the subsequence length")
+        if not 1 <= k <= self.offsets[-1]:
+            raise ValueError("k must be between 1 and the number of subsequences")
+        if max_leaves is not None and max_leaves < 1:
+            raise ValueError("The maximum number of leaves must be positive")
+
+        distances = np.full((len(queries), k), np.inf)
+        subsequences = np.full((len(queries), k), -1, dtype=np.int64)
+        candidates = np.zeros(len(queries), dtype=np.int64)
+        for i, query in enumerate(queries):
+            std = query.std()
+            query = (query - query.mean()) / std if std > 0 else np.zeros_like(query)
+            nearest_distances, nearest, candidates[i] = self._search(query, k, max_leaves)
+            distances[i, :len(nearest)] = nearest_distances
+            subsequences[i, :len(nearest)] = nearest
+
+        series = np.searchsorted(self.offsets, np.maximum(subsequences, 0), side="right") - 1
+        indexes = np.where(subsequences >= 0, subsequences - self.offsets[series], -1)
+        series = np.where(subsequences >= 0, series, -1)
+        return SubsequenceSearchResult(distances=distances, series=series, indexes=indexes, candidates=candidates)
+
+    def save(self, path):
+        """ Saves the index in a directory, with one `.npy` file per array, which can be memory-mapped, and the
+        parameters in `metadata.json`.
+
+        :param path: Directory where the index is saved. It is created if it does not exist.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in _SUBSEQUENCE_INDEX_ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(path, "metadata.json"), "w") as handler:
+            json.dump({"subsequence_length": int(self.subsequence_length), "word_length": int(self.word_length),
+                       "leaf_size": int(self.leaf_size)}, handler)
+
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """ Loads an index saved with `save`.
+
+        :param path: Directory where the index was saved.
+        :param mmap_mode: Memory-map mode of the arrays of the index (see numpy.load), or None to read them.
+        :return: The SubsequenceIndex.
+        """
+        index = SubsequenceIndex.__new__(SubsequenceIndex)
+        with open(os.path.join(path, "metadata.json")) as handler:
+            metadata = json.load(handler)
+        index.subsequence_length = metadata["subsequence_length"]
+        index.word_length = metadata["word_length"]
+        index.leaf_size = metadata["leaf_size"]
+        for name in _SUBSEQUENCE_INDEX_ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode))
+        return index
+
+
+_SUBSEQUENCE_INDEX_ARRAYS = ("data", "series_starts", "offsets", "means", "stds", "summaries", "breakpoints", "order",
+                             "node_lower", "node_upper", "node_children", "node_ranges")
+
+
+def _series_list(time_series):
+    """ Splits a set of time series in a list of float64 numpy arrays.
+
+    :param time_series: KHIVA array whose first dimension is the length of the time series and the second dimension
+                        is the number of time series, numpy array with one time series per row, or list of time series.
+    :return: List of numpy arrays with one time series each.
+    """
+    if isinstance(time_series, Array):
+        time_series = time_series.to_numpy()
+    if isinstance(time_series, np.ndarray):
+        return [row for row in np.atleast_2d(np.asarray(time_series, dtype=np.float64))]
+    return [_host_time_series(ts) for ts in time_series]
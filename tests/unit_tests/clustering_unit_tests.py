@@ -11,9 +11,12 @@
 ########################################################################################################################
 # IMPORT
 ########################################################################################################################
+import os
+import tempfile
 import unittest
 from khiva.clustering import *
 from khiva.array import Array, dtype
+from khiva.cache import enable_cache, disable_cache
 import numpy as np
 from khiva.library import set_backend, KHIVABackend
 
@@ -70,6 +73,137 @@ class ClusteringTest(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             lab, expected_l, decimal=self.DECIMAL)
 
+    def test_k_means_plus_plus(self):
+        rng = np.random.RandomState(0)
+        tss = np.vstack([center + rng.randn(20, 4) * 0.1 for center in (0.0, 5.0, 10.0)])
+        groups = np.repeat([0, 1, 2], 20)
+
+        result = k_means(Array.from_numpy(tss, dtype.f32), 3, init="k-means++", n_init=4, random_state=0)
+        labels = result.labels.to_numpy()
+        centroids = result.centroids.to_numpy()
+        for group in range(3):
+            self.assertEqual(1, len(np.unique(labels[groups == group])))
+        self.assertAlmostEqual(np.sum((tss - centroids[labels.astype(int)]) ** 2), result.inertia, delta=self.DELTA)
+
+        labels = k_means(Array.from_numpy(np.rint(tss * 10), dtype.s32), 3, init="k-means++", random_state=0).labels
+        for group in range(3):
+            self.assertEqual(1, len(np.unique(labels.to_numpy()[groups == group])))
+
+    def test_k_shape_restarts(self):
+        rng = np.random.RandomState(0)
+        t = np.linspace(0, 1, 24)
+        shapes = [np.sin(2 * np.pi * t), np.exp(-((t - 0.5) / 0.05) ** 2), t]
+        tss = np.vstack([shape * rng.uniform(1, 3) + rng.randn(24) * 0.05 for shape in shapes for _ in range(10)])
+        groups = np.repeat([0, 1, 2], 10)
+
+        centroids, labels = k_shape(Array.from_numpy(tss, dtype.f32), 3, init="k-means++", n_init=3, random_state=0)
+        labels = labels.to_numpy()
+        for group in range(3):
+            self.assertEqual(1, len(np.unique(labels[groups == group])))
+        self.assertEqual(3, len(np.unique(labels)))
+
+    def test_mini_batch_k_means(self):
+        rng = np.random.RandomState(0)
+        tss = np.vstack([center + rng.randn(40, 4) * 0.1 for center in (0.0, 5.0, 10.0)])
+        groups = np.repeat([0, 1, 2], 40)
+        order = rng.permutation(len(tss))
+
+        model = MiniBatchKMeans(3, random_state=0)
+        for first in range(0, len(tss), 20):
+            model.partial_fit(tss[order[first:first + 20]])
+        self.assertEqual(len(tss), model.counts.sum())
+
+        labels = model.predict(Array.from_numpy(tss, dtype.f32))
+        np.testing.assert_array_equal(labels, model.predict(tss))
+        for group in range(3):
+            self.assertEqual(1, len(np.unique(labels[groups == group])))
+        self.assertEqual(3, len(np.unique(labels)))
+
+    def test_k_means_estimator(self):
+        rng = np.random.RandomState(0)
+        tss = np.vstack([center + rng.randn(20, 4) * 0.1 for center in (0.0, 5.0, 10.0)])
+
+        model = KMeans(3, init="k-means++", random_state=0).fit(Array.from_numpy(tss, dtype.f32))
+        centroids = model.centroids.to_numpy()
+        expected = np.sqrt(np.sum((tss[:, None, :] - centroids[None, :, :]) ** 2, axis=2))
+        np.testing.assert_array_almost_equal(model.transform(tss, batch_size=7), expected, decimal=self.DECIMAL)
+        np.testing.assert_array_equal(model.predict(Array.from_numpy(tss, dtype.f32), batch_size=7),
+                                      model.labels.to_numpy().astype(int))
+        np.testing.assert_array_equal(model.predict(Array.from_numpy(tss, dtype.f64)),
+                                      model.labels.to_numpy().astype(int))
+
+        fixed = KMeans.from_centroids(centroids)
+        np.testing.assert_array_equal(fixed.predict(tss), expected.argmin(axis=1))
+
+    def test_k_shape_estimator(self):
+        t = np.linspace(0, 1, 16)
+        centroids = np.vstack([np.sin(2 * np.pi * t), t])
+        tss = np.vstack([np.roll(np.sin(2 * np.pi * t), 1) * 3, t * 2 + 1, np.sin(2 * np.pi * t) + 0.5])
+
+        model = KShape.from_centroids(centroids)
+        distances = model.transform(tss, batch_size=2)
+        self.assertEqual((3, 2), distances.shape)
+        np.testing.assert_array_equal(model.predict(Array.from_numpy(tss, dtype.f32)), [0, 1, 0])
+        np.testing.assert_array_almost_equal(model.transform(Array.from_numpy(tss, dtype.f64)), distances,
+                                             decimal=self.DECIMAL)
+        self.assertAlmostEqual(0, distances[1, 1], delta=self.DELTA)
+
+    def test_k_shape_warm_start(self):
+        rng = np.random.RandomState(0)
+        t = np.linspace(0, 1, 24)
+        shapes = [np.sin(2 * np.pi * t), np.exp(-((t - 0.5) / 0.05) ** 2), t]
+        tss = np.vstack([shape * rng.uniform(1, 3) + rng.randn(24) * 0.05 for shape in shapes for _ in range(10)])
+        groups = np.repeat([0, 1, 2], 10)
+
+        iterations = []
+        centroids, labels = k_shape(Array.from_numpy(tss, dtype.f32), 3, init_centroids=tss[[0, 10, 20]],
+                                    callback=lambda iteration, c, l, inertia: iterations.append(inertia))
+        np.testing.assert_array_equal(labels.to_numpy().astype(int), groups)
+        self.assertLessEqual(len(iterations), 2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "k_shape.npz")
+            stopped = k_shape(Array.from_numpy(tss, dtype.f32), 3, init_centroids=tss[[0, 10, 20]],
+                              callback=lambda iteration, c, l, inertia: True, checkpoint=checkpoint)
+            self.assertTrue(os.path.isfile(checkpoint))
+            resumed = k_shape(Array.from_numpy(tss, dtype.f32), 3, checkpoint=checkpoint)
+        np.testing.assert_array_equal(resumed.labels.to_numpy().astype(int), groups)
+        self.assertLessEqual(resumed.inertia, stopped.inertia + self.DELTA)
+
+        enable_cache()
+        try:
+            calls = []
+            for _ in range(2):
+                k_shape(Array.from_numpy(tss, dtype.f32), 3, init_centroids=tss[[0, 10, 20]],
+                        callback=lambda iteration, c, l, inertia: calls.append(iteration))
+            self.assertEqual(len(iterations) * 2, len(calls))
+        finally:
+            disable_cache()
+
+    def test_hierarchical(self):
+        tss = Array.from_list([[0.0, 0.0], [1.0, 0.0], [5.0, 0.0], [6.0, 0.0], [20.0, 0.0]], dtype.f32)
+        expected = np.array([[0.0, 1.0, 1.0, 2.0],
+                             [2.0, 3.0, 1.0, 2.0],
+                             [5.0, 6.0, 5.0, 4.0],
+                             [4.0, 7.0, 17.0, 5.0]])
+
+        np.testing.assert_array_almost_equal(hierarchical(tss, linkage="average"), expected, decimal=self.DECIMAL)
+        single = hierarchical(tss, linkage="single")
+        np.testing.assert_array_almost_equal(single[:, 2], [1.0, 1.0, 4.0, 14.0], decimal=self.DECIMAL)
+        complete = hierarchical(tss, linkage="complete", tile_size=2)
+        np.testing.assert_array_almost_equal(complete[:, 2], [1.0, 1.0, 6.0, 20.0], decimal=self.DECIMAL)
+
+    def test_sweep_k(self):
+        rng = np.random.RandomState(0)
+        tss = np.vstack([center + rng.randn(15, 4) * 0.1 for center in (0.0, 5.0, 10.0)])
+
+        result = sweep_k(Array.from_numpy(tss, dtype.f32), [2, 3, 4], algorithm="k_means", random_state=0, n_jobs=2)
+        self.assertEqual([2, 3, 4], result.ks)
+        self.assertEqual(3, result.ks[int(np.argmax(result.silhouette))])
+        self.assertLess(result.inertia[1], result.inertia[0])
+        labels = result.results[1].labels.to_numpy().astype(int)
+        self.assertEqual(3, len(np.unique(labels)))
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(ClusteringTest)
@@ -16,6 +16,7 @@ from khiva.distances import *
 from khiva.array import Array, dtype
 import numpy as np
 from khiva.library import set_backend, KHIVABackend
+from khiva import cache
 
 
 ########################################################################################################################
@@ -33,6 +34,15 @@ class DistancesTest(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             euclidean_result, expected)
 
+    def test_euclidean_cross(self):
+        a = Array.from_list([[0, 1, 2, 3], [4, 5, 6, 7]], dtype.f32)
+        b = Array.from_list([[8, 9, 10, 11], [0, 1, 2, 3], [4, 5, 6, 8]], dtype.f32)
+        result = euclidean(a, b).to_numpy()
+        expected = np.array([[16, 8], [0, 8], [np.sqrt(73), 1]])
+        np.testing.assert_array_almost_equal(result, expected, decimal=5)
+        with self.assertRaises(ValueError):
+            euclidean(a, b, condensed=True)
+
     def test_dtw(self):
         euclidean_result = dtw(Array.from_list(
             [[1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [4, 4, 4, 4, 4], [5, 5, 5, 5, 5]], dtype.s32)).to_numpy()
@@ -40,6 +50,78 @@ class DistancesTest(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             euclidean_result, expected)
 
+    def test_dtw_condensed(self):
+        tss = Array.from_list(
+            [[1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [4, 4, 4, 4, 4], [5, 5, 5, 5, 5]], dtype.s32)
+        result = dtw(tss, condensed=True)
+        expected = np.array([5, 10, 15, 20, 5, 10, 15, 5, 10, 5])
+        np.testing.assert_array_almost_equal(result, expected)
+        self.assertEqual(15, result[condensed_index(5, 3, 0)])
+        np.testing.assert_array_almost_equal(condensed_to_square(result), dtw(tss).to_numpy() + dtw(tss).to_numpy().T)
+
+    def test_dtw_cache(self):
+        tss = Array.from_list(
+            [[1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [4, 4, 4, 4, 4], [5, 5, 5, 5, 5]], dtype.f32)
+        expected = dtw(tss, condensed=True)
+        cache.enable_cache()
+        try:
+            pairwise_distances(tss, dtw, tile_size=2)
+            self.assertEqual(0, len(cache._cache.entries))
+            result = dtw(tss, condensed=True)
+            result[:] = -1
+            np.testing.assert_array_almost_equal(dtw(tss, condensed=True), expected)
+            self.assertEqual(1, len(cache._cache.entries))
+        finally:
+            cache.disable_cache()
+
+    def test_pairwise_distances(self):
+        tss = np.array([[1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [4, 4, 4, 4, 4], [5, 5, 5, 5, 5]])
+        expected = dtw(Array.from_numpy(tss, dtype.f32)).to_numpy()
+        expected = expected + expected.T
+
+        np.testing.assert_array_almost_equal(pairwise_distances(tss, dtw, tile_size=2), expected)
+        np.testing.assert_array_almost_equal(pairwise_distances(Array.from_numpy(tss, dtype.f32), dtw, tile_size=3,
+                                                                condensed=True),
+                                             expected[np.triu_indices(5, 1)])
+        np.testing.assert_array_almost_equal(pairwise_distances(tss, dtw, tile_size=2, condensed=True, n_jobs=2),
+                                             expected[np.triu_indices(5, 1)])
+        tiles = list(iter_distance_tiles(tss, dtw, tile_size=2))
+        self.assertEqual(6, len(tiles))
+        for tile in tiles:
+            rows, cols = tile.distances.shape
+            np.testing.assert_array_almost_equal(
+                tile.distances, expected[tile.row_start:tile.row_start + rows, tile.col_start:tile.col_start + cols])
+
+    def test_dtw_window(self):
+        tss = Array.from_list([[0, 1, 2, 3, 4, 5], [0, 0, 1, 2, 3, 4], [5, 4, 3, 2, 1, 0]], dtype.f32)
+        result = dtw(tss, window=1, condensed=True)
+        np.testing.assert_array_almost_equal(result, np.array([1, 18, 17]))
+        unconstrained = dtw(tss).to_numpy()
+        np.testing.assert_array_almost_equal(dtw(tss, window=5).to_numpy(), unconstrained)
+
+        bounds = lb_keogh(tss, tss, window=1)
+        self.assertTrue(np.all(bounds <= condensed_to_square(result) + 1e-6))
+        self.assertTrue(np.all(lb_kim(tss, tss) <= condensed_to_square(result) + 1e-6))
+
+    def test_dtw_nearest_neighbours(self):
+        references = np.cumsum(np.random.RandomState(0).randn(50, 20), axis=1)
+        queries = references[[3, 7]] + 0.1
+        result = dtw_nearest_neighbours(queries, references, k=2, window=2)
+        expected = dtw(Array.from_numpy(queries, dtype.f64), Array.from_numpy(references, dtype.f64),
+                       window=2).to_numpy().T
+        np.testing.assert_array_equal(result.indexes[:, 0], [3, 7])
+        np.testing.assert_array_almost_equal(result.distances, np.sort(expected, axis=1)[:, :2])
+
+    def test_knn(self):
+        references = np.cumsum(np.random.RandomState(0).randn(30, 8), axis=1)
+        queries = references[[4, 11, 20]] + 0.01
+        expected = euclidean(Array.from_numpy(queries, dtype.f32), Array.from_numpy(references, dtype.f32)).to_numpy().T
+
+        result = knn(queries, references, k=3)
+        np.testing.assert_array_equal(result.indexes, np.argsort(expected, axis=1)[:, :3])
+        np.testing.assert_array_almost_equal(result.distances, np.sort(expected, axis=1)[:, :3], decimal=4)
+        np.testing.assert_array_equal(knn(queries, references, k=1, metric=dtw, window=2).indexes[:, 0], [4, 11, 20])
+
     def test_hamming(self):
         result = hamming(Array.from_list(
             [[1, 1, 1, 1, 1], [2, 2, 2, 2, 2], [3, 3, 3, 3, 3], [4, 4, 4, 4, 4], [5, 5, 5, 5, 5]], dtype.s32)).to_numpy()
@@ -657,6 +657,70 @@ class FeaturesTest(unittest.TestCase):
         e = abs_energy(d).to_numpy()
         self.assertAlmostEqual(e, 385, delta=self.DELTA)
 
+    def test_extract(self):
+        tss = Array.from_list([[0, 1, 2, 3, 4, 5], [6, 7, 8, 9, 10, 11]], dtype.f32)
+        spec = ["mean", ("c3", {"lag": 2}), "linear_trend"]
+
+        result = extract(tss, spec)
+        self.assertEqual(["mean", "c3__lag_2", "linear_trend__pvalue", "linear_trend__rvalue",
+                          "linear_trend__intercept", "linear_trend__slope", "linear_trend__stdrr"], result.names)
+        features = result.features.to_numpy()
+        np.testing.assert_array_almost_equal(features[:, 0], [2.5, 8.5], decimal=4)
+        np.testing.assert_array_almost_equal(features[:, 1], [7.5, 586.5], decimal=4)
+        np.testing.assert_array_almost_equal(features[:, 5], [1.0, 1.0], decimal=4)
+
+        frame = extract(tss, spec, as_frame=True)
+        self.assertEqual(result.names, list(frame.columns))
+        np.testing.assert_array_almost_equal(frame.values, features, decimal=4)
+        with self.assertRaises(ValueError):
+            extract(tss, ["cross_correlation"])
+
+    def test_extract_shared_intermediates(self):
+        tss = Array.from_list([[20, 20, 20, 18, 25, 19, 20, 20, 20, 20, 40, 30, 1, 50, 1, 1, 5, 1, 20, 20],
+                               [20, 20, 20, 2, 19, 1, 20, 20, 20, 1, 15, 1, 30, 1, 1, 18, 4, 1, 20, 20]], dtype.f32)
+        spec = ["mean", "variance", "standard_deviation", "count_above_mean", "count_below_mean", "sum_values",
+                "abs_energy", "maximum", "minimum", "median", ("ratio_beyond_r_sigma", {"r": 0.5}),
+                ("large_standard_deviation", {"r": 0.2}), "variance_larger_than_standard_deviation",
+                ("quantile", {"q": [0.1, 0.6]}), "mean"]
+
+        result = extract(tss, spec)
+        features = result.features.to_numpy()
+        self.assertEqual(16, len(result.names))
+        column = 0
+        for name, parameters in [(item, {}) if isinstance(item, str) else item for item in spec]:
+            if name == "quantile":
+                parameters = {"q": Array.from_list(parameters["q"], dtype.f32)}
+            expected = globals()[name](tss, **parameters).to_numpy().astype(np.float64).reshape(2, -1)
+            np.testing.assert_allclose(features[:, column:column + expected.shape[1]], expected, rtol=1e-4,
+                                       atol=1e-4)
+            column += expected.shape[1]
+
+    def test_rolling(self):
+        rng = np.random.RandomState(0)
+        tss = rng.randn(2, 30) * 5 + 100
+        window, step = 7, 3
+        spec = ["mean", "variance", "maximum", "minimum", "mean_absolute_change", ("c3", {"lag": 1})]
+
+        result = rolling(Array.from_numpy(tss, dtype.f64), window, step, spec)
+        np.testing.assert_array_equal(np.arange(0, 24, 3), result.starts)
+        self.assertEqual(["mean", "variance", "maximum", "minimum", "mean_absolute_change", "c3__lag_1"],
+                         result.names)
+        self.assertEqual((2, 8, 6), result.features.shape)
+        for i in range(2):
+            windows = np.vstack([tss[i, start:start + window] for start in result.starts])
+            np.testing.assert_allclose(result.features[i, :, 0], windows.mean(axis=1), rtol=1e-6)
+            np.testing.assert_allclose(result.features[i, :, 1], windows.var(axis=1), rtol=1e-4)
+            np.testing.assert_allclose(result.features[i, :, 2], windows.max(axis=1), rtol=1e-6)
+            np.testing.assert_allclose(result.features[i, :, 3], windows.min(axis=1), rtol=1e-6)
+            np.testing.assert_allclose(result.features[i, :, 4], np.abs(np.diff(windows, axis=1)).mean(axis=1),
+                                       rtol=1e-6)
+            expected = c3(Array.from_numpy(windows, dtype.f32), 1).to_numpy().reshape(-1)
+            np.testing.assert_allclose(result.features[i, :, 5], expected, rtol=1e-4)
+
+        frame = rolling(tss, window, step, spec, as_frame=True)
+        self.assertEqual((16, 6), frame.shape)
+        np.testing.assert_allclose(frame.values, result.features.reshape(16, 6), rtol=1e-4)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(FeaturesTest)
@@ -13,9 +13,11 @@
 ########################################################################################################################
 import unittest
 import os
+import tempfile
 from khiva.matrix import *
 from khiva.array import *
 from khiva.library import set_backend, KHIVABackend
+from khiva.cache import enable_cache, disable_cache, clear_cache
 
 
 ########################################################################################################################
@@ -322,6 +324,253 @@ class MatrixTest(unittest.TestCase):
 
         np.testing.assert_array_equal(chain_indexes, chains_result[1, :])
 
+    def test_matrix_profile_self_join_tiled(self):
+        ts = np.array([0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583,
+                       0.3712, 0.3543, 0.6450, 0.9675, 0.3636, 0.4165, 0.5814, 0.8962, 0.3712, 0.6755, 0.6105,
+                       0.5232, 0.5567, 0.7896, 0.8966, 0.0536, 0.5775, 0.2908, 0.9941, 0.5143, 0.3670])
+
+        expected = matrix_profile_self_join(Array.from_numpy(ts, dtype.f32), 4)
+        result = matrix_profile_self_join_tiled(ts, 4, 6)
+
+        np.testing.assert_array_almost_equal(result.profile, expected.profile.to_numpy(), decimal=3)
+        np.testing.assert_array_equal(result.index, expected.index.to_numpy())
+
+    def test_pan_matrix_profile(self):
+        ts = Array.from_list([0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583,
+                              0.3712, 0.3543, 0.6450, 0.9675, 0.3636], dtype.f32)
+
+        result = pan_matrix_profile(ts, [5, 3, 4])
+        profiles = result.profile.to_numpy()
+        indexes = result.index.to_numpy()
+
+        self.assertEqual([3, 4, 5], result.subsequence_lengths)
+        np.testing.assert_array_equal([3, 1, 14], profiles.shape)
+        for i, m in enumerate(result.subsequence_lengths):
+            expected = matrix_profile_self_join(ts, m)
+            n = 16 - m + 1
+            np.testing.assert_array_almost_equal(profiles[i, 0, :n], expected.profile.to_numpy(),
+                                                 decimal=self.DECIMAL)
+            np.testing.assert_array_equal(indexes[i, 0, :n], expected.index.to_numpy())
+            self.assertTrue(np.all(np.isinf(profiles[i, 0, n:])))
+
+        tss = Array.from_list([[0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105],
+                               [0.1583, 0.3712, 0.3543, 0.6450, 0.9675, 0.3636, 0.6010, 0.0278, 0.9806, 0.2126]],
+                              dtype.f32)
+        profiles = pan_matrix_profile(tss, [3, 4]).profile.to_numpy()
+        np.testing.assert_array_equal([2, 2, 8], profiles.shape)
+        np.testing.assert_array_almost_equal(profiles[1, :, :7], matrix_profile_self_join(tss, 4).profile.to_numpy(),
+                                             decimal=self.DECIMAL)
+        self.assertTrue(np.all(np.isinf(profiles[1, :, 7])))
+
+        with self.assertRaises(ValueError):
+            pan_matrix_profile(ts, [])
+
+    def test_iter_pan_matrix_profile(self):
+        ts = Array.from_list([0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583,
+                              0.3712, 0.3543, 0.6450, 0.9675, 0.3636], dtype.f32)
+
+        lengths = [m for m, _ in iter_pan_matrix_profile(ts, range(3, 8))]
+
+        self.assertEqual([3, 7, 5, 4, 6], lengths)
+
+    def test_mass_index(self):
+        index = MassIndex(np.array([10, 10, 10, 11, 12, 11, 10, 10, 11, 12, 11, 14, 10, 10]))
+
+        distances = index.query([4, 3, 8]).to_numpy()
+        distances_expected = np.array([1.732051, 0.328954, 1.210135, 3.150851, 3.245858, 2.822044,
+                                       0.328954, 1.210135, 3.150851, 0.248097, 3.30187, 2.82205])
+        np.testing.assert_array_almost_equal(distances, distances_expected, decimal=3)
+        np.testing.assert_array_almost_equal(index.query([[4, 3, 8], [8, 3, 4]]).to_numpy()[0], distances,
+                                             decimal=self.DECIMAL)
+
+        best = index.best_n(np.array([4, 3, 8]), 1)
+        self.assertAlmostEqual(best.distances.to_numpy().flatten()[0], 0.248097, delta=1e-3)
+        self.assertEqual(best.indexes.to_numpy().flatten()[0], 9)
+        with self.assertRaises(ValueError):
+            index.query([[4, 3, 8], [4, 3]])
+
+    def test_stomp_self_join_left_right(self):
+        ts = Array.from_list([10, 10, 11, 11, 10, 11, 10, 10, 11, 11, 10, 11, 10, 10], dtype.f32)
+
+        result = stomp_self_join(ts, 3, left_right=True)
+        left_profile = result.left_profile.to_numpy()
+        left_index = result.left_index.to_numpy()
+        right_profile = result.right_profile.to_numpy()
+        right_index = result.right_index.to_numpy()
+
+        self.assertTrue(np.isinf(left_profile[0]))
+        self.assertEqual(left_index[0], -1)
+        self.assertTrue(np.isinf(right_profile[-1]))
+        self.assertEqual(right_index[-1], -1)
+        self.assertAlmostEqual(left_profile[6], 0.0, delta=1e-2)
+        self.assertEqual(left_index[6], 0)
+        self.assertAlmostEqual(right_profile[0], 0.0, delta=1e-2)
+        self.assertEqual(right_index[0], 6)
+        np.testing.assert_array_almost_equal(result.profile.to_numpy(), np.minimum(left_profile, right_profile),
+                                             decimal=self.DECIMAL)
+
+    def test_stomp_self_join_by_blocks_native(self):
+        ts = np.cumsum(np.random.RandomState(0).randn(300))
+        exclusion_zone = int(np.ceil(16 / 4.0))
+
+        native = stomp_self_join(Array.from_numpy(ts, dtype.f32), 16)
+        blocks = stomp_self_join(Array.from_numpy(ts, dtype.f32), 16, left_right=True, exclusion_zone=exclusion_zone)
+
+        np.testing.assert_array_almost_equal(blocks.profile.to_numpy(), native.profile.to_numpy(), decimal=3)
+        np.testing.assert_array_equal(blocks.index.to_numpy(), native.index.to_numpy())
+
+    def test_find_best_n_left_discords(self):
+        ts = Array.from_numpy(np.array([10.0, 11.0, 14.0, 11.0, -2.0, 11.0, 18.0, 11.0, 1.0, 25.0, 10.0, 11.0, 1.0,
+                                        0.0, 19.0]), dtype.f32)
+        result = stomp_self_join(ts, 3, left_right=True)
+
+        discords = find_best_n_left_discords(result.left_profile, result.left_index, 3, 1)
+        left_profile = result.left_profile.to_numpy()
+        subsequence = discords.subsequence_indexes.to_numpy().flatten()[0]
+
+        self.assertTrue(np.isfinite(left_profile[subsequence]))
+        self.assertAlmostEqual(discords.distances.to_numpy().flatten()[0],
+                               np.max(left_profile[np.isfinite(left_profile)]), delta=self.DELTA)
+
+    def test_mstamp(self):
+        channel = [0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583, 0.3712,
+                   0.3543, 0.6450, 0.9675, 0.3636]
+        tss = Array.from_list([channel, channel], dtype.f32)
+
+        result = mstamp(tss, 4)
+        profile = result.profile.to_numpy()
+        index = result.index.to_numpy()
+        dimensions = result.dimensions.to_numpy()
+        expected = stomp_self_join(Array.from_list(channel, dtype.f32), 4, left_right=True)
+
+        np.testing.assert_array_equal([2, 13], profile.shape)
+        np.testing.assert_array_equal([2, 13, 2], dimensions.shape)
+        for k in range(2):
+            np.testing.assert_array_almost_equal(profile[k], expected.profile.to_numpy(), decimal=3)
+            np.testing.assert_array_equal(index[k], expected.index.to_numpy())
+        for i in range(13):
+            self.assertEqual({0, 1}, set(dimensions[1, i].tolist()))
+
+    def test_mstamp_native(self):
+        ts = np.cumsum(np.random.RandomState(1).randn(200))
+
+        result = mstamp(Array.from_numpy(ts, dtype.f32), 10)
+        expected = stomp_self_join(Array.from_numpy(ts, dtype.f32), 10)
+
+        np.testing.assert_array_almost_equal(result.profile.to_numpy(), expected.profile.to_numpy(), decimal=3)
+        np.testing.assert_array_equal(result.index.to_numpy(), expected.index.to_numpy())
+
+    def test_mstamp_constant_channel(self):
+        channel = np.cumsum(np.random.RandomState(2).randn(60))
+
+        profile = mstamp(Array.from_numpy(np.vstack([channel, np.full(60, 3.0)]), dtype.f32), 8).profile.to_numpy()
+        expected = mstamp(Array.from_numpy(channel, dtype.f32), 8).profile.to_numpy()
+
+        self.assertFalse(np.any(np.isnan(profile)))
+        np.testing.assert_array_almost_equal(profile[0], np.zeros(53), decimal=self.DECIMAL)
+        np.testing.assert_array_almost_equal(profile[1], expected / 2, decimal=3)
+
+    def test_matrix_profile_self_join_non_normalized(self):
+        ts = np.array([0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583,
+                       0.3712, 0.3543, 0.6450, 0.9675, 0.3636])
+        subsequences = np.array([ts[i:i + 4] for i in range(13)])
+        distances = np.sqrt(((subsequences[:, np.newaxis] - subsequences[np.newaxis]) ** 2).sum(axis=2))
+        offsets = np.abs(np.arange(13)[:, np.newaxis] - np.arange(13)[np.newaxis])
+        distances[offsets < 2] = np.inf
+
+        result = matrix_profile_self_join(Array.from_numpy(ts, dtype.f32), 4, exclusion_zone=2, normalize=False)
+
+        np.testing.assert_array_almost_equal(result.profile.to_numpy(), distances.min(axis=1), decimal=3)
+        np.testing.assert_array_equal(result.index.to_numpy(), distances.argmin(axis=1))
+
+    def test_stomp_self_join_constant_regions(self):
+        ts = Array.from_list([1, 2, 3, 4, 5, 5, 5, 5, 5, 5, 4, 3, 2, 1, 5, 5, 5, 5, 1, 2], dtype.f32)
+
+        result = stomp_self_join(ts, 4, epsilon=1e-6)
+        profile = result.profile.to_numpy()
+
+        self.assertFalse(np.any(np.isnan(profile)))
+        self.assertAlmostEqual(profile[4], 0.0, delta=self.DELTA)
+        self.assertAlmostEqual(profile[14], 0.0, delta=self.DELTA)
+
+    def test_get_chains_compact(self):
+        tss = Array.from_list([[10, 11, 10, 11, 12, 13, 12, 13, 14, 15, 14, 15, 16, 17, 16, 17],
+                               [10, 11, 10, 11, 12, 13, 12, 13, 14, 15, 14, 15, 16, 17, 16, 17]], dtype.f32)
+        chains = get_chains(tss, 4).to_numpy()
+        compact = get_chains(tss, 4, compact=True)
+
+        for ts in range(2):
+            populated = chains[ts, 1, :] != 0
+            self.assertEqual(np.count_nonzero(populated), np.sum(np.diff(compact.offsets)[compact.series == ts]))
+            np.testing.assert_array_equal(np.sort(chains[ts, 0, populated]),
+                                          np.sort(np.concatenate([c for s, c in iter_chains(tss, 4) if s == ts])))
+        self.assertEqual(compact.offsets[-1], len(compact.indexes))
+
+    def test_update_matrix_profile_self_join(self):
+        ts = np.array([0.6010, 0.0278, 0.9806, 0.2126, 0.0655, 0.5497, 0.2864, 0.3410, 0.7509, 0.4105, 0.1583,
+                       0.3712, 0.3543, 0.6450, 0.9675, 0.3636, 0.4165, 0.5814, 0.8962, 0.3712, 0.6755, 0.6105])
+        with tempfile.TemporaryDirectory() as path:
+            stomp_self_join(Array.from_numpy(ts[:14], dtype.f32), 4, exclusion_zone=1).save(path, 4, ts[:14],
+                                                                                            exclusion_zone=1)
+            stored = MatrixProfileResult.load(path)
+            self.assertEqual(4, stored.subsequence_length)
+            self.assertEqual(14, stored.offset)
+            self.assertEqual(1, stored.exclusion_zone)
+            self.assertEqual(11, len(stored.profile))
+            with self.assertRaises(ValueError):
+                update_matrix_profile_self_join(path, ts, exclusion_zone=2)
+
+            result = update_matrix_profile_self_join(path, ts)
+            expected = stomp_self_join(Array.from_numpy(ts, dtype.f32), 4, exclusion_zone=1)
+
+            np.testing.assert_array_almost_equal(result.profile, expected.profile.to_numpy(), decimal=3)
+            np.testing.assert_array_equal(result.index, expected.index.to_numpy())
+            self.assertEqual(22, MatrixProfileResult.load(path).offset)
+            with self.assertRaises(ValueError):
+                update_matrix_profile_self_join(path, ts[::-1])
+
+    def test_cache(self):
+        tss = Array.from_list([[10, 11, 10, 11, 12, 11, 10, 10, 11, 11, 10, 11, 10, 10]], dtype.f32)
+        expected = stomp_self_join(tss, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            enable_cache(max_entries=2, directory=directory)
+            try:
+                first = stomp_self_join(tss, 3)
+                second = stomp_self_join(tss, 3)
+                self.assertIsNot(first[0], second[0])
+                for result in (first, second):
+                    np.testing.assert_array_almost_equal(result[0].to_numpy(), expected[0].to_numpy(),
+                                                         decimal=self.DECIMAL)
+                    np.testing.assert_array_equal(result[1].to_numpy(), expected[1].to_numpy())
+                clear_cache()
+                np.testing.assert_array_equal(stomp_self_join(tss, 3)[1].to_numpy(), expected[1].to_numpy())
+            finally:
+                disable_cache()
+
+    def test_subsequence_index(self):
+        rng = np.random.RandomState(0)
+        tss = [np.cumsum(rng.randn(n)) for n in (600, 400)]
+        queries = np.vstack([tss[1][200:216] + rng.randn(16) * 0.1, np.cumsum(rng.randn(16))])
+        index = SubsequenceIndex(tss, 16, word_length=4, leaf_size=32)
+
+        windows = np.vstack([[ts[i:i + 16] for i in range(len(ts) - 15)] for ts in tss])
+        windows = (windows - windows.mean(axis=1, keepdims=True)) / windows.std(axis=1, keepdims=True)
+        normalized = (queries - queries.mean(axis=1, keepdims=True)) / queries.std(axis=1, keepdims=True)
+        expected = np.sort(np.sqrt(((windows[None] - normalized[:, None]) ** 2).sum(axis=2)), axis=1)[:, :3]
+
+        result = index.query(queries, k=3)
+        np.testing.assert_array_almost_equal(result.distances, expected, decimal=4)
+        self.assertEqual(1, result.series[0, 0])
+        self.assertEqual(200, result.indexes[0, 0])
+        self.assertTrue(np.all(result.candidates < len(windows)))
+        approximate = index.query(queries, k=3, max_leaves=1)
+        self.assertTrue(np.all(approximate.distances >= result.distances - self.DELTA))
+
+        with tempfile.TemporaryDirectory() as path:
+            index.save(path)
+            loaded = SubsequenceIndex.load(path).query(queries, k=3)
+        np.testing.assert_array_equal(loaded.indexes, result.indexes)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(MatrixTest)